@@ -1,16 +1,68 @@
 import json
-from dataclasses import dataclass
-from typing import List, Optional
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Callable, Iterator, List, Optional, Tuple
 
 from rich.console import Console
 
-from core.model import LLMClient
+from core.kv_cache import LiveCache
 from core.history_manager import HistoryManager
 from core.action import Action, ActionType
+from core.telemetry import telemetry
 from core.utilities import strip_markdown_fences
 
+if TYPE_CHECKING:
+    # torch and transformers load in the background; see main.py
+    from core.model import LLMClient
+
 console = Console()
 
+# set on a prefetch worker thread while it runs an agent speculatively
+_speculation = threading.local()
+
+# replies per call that may fail to parse before the call gives up
+MAX_JSON_ATTEMPTS = 3
+
+
+class SpeculationCancelled(Exception):
+    pass
+
+
+class InvalidReply(RuntimeError):
+    """
+    An agent's model kept replying with text that is not valid JSON.
+    """
+
+
+@dataclass
+class Speculation:
+    """
+    Side effects of an agent call made ahead of time. History entries and
+    state updates are recorded instead of applied, and only take effect if
+    the prediction is confirmed and the speculation committed.
+    """
+    entries: List[Tuple[HistoryManager, str]] = field(default_factory=list)
+    effects: List[Callable[[], None]] = field(default_factory=list)
+    cancel: threading.Event = field(default_factory=threading.Event)
+
+    def run(self, fn: Callable, *args):
+        _speculation.current = self
+        try:
+            return fn(*args)
+        finally:
+            _speculation.current = None
+
+    def commit(self):
+        for history, entry in self.entries:
+            history.add(entry)
+        for effect in self.effects:
+            effect()
+
+
+def current_speculation() -> Optional[Speculation]:
+    return getattr(_speculation, "current", None)
+
 
 @dataclass
 class BaseAgent:
@@ -18,33 +70,118 @@ class BaseAgent:
     Base class for all agents, encapsulating common LLM interaction
     and history management.
     """
-    model: LLMClient
+    model: "LLMClient"
     history: HistoryManager
 
-    def _generate(self, prompt: str) -> str:
+    # KV cache kept between turns when the model runs in incremental mode
+    _live: LiveCache = field(default_factory=LiveCache, init=False, repr=False)
+    _history_epoch: int = field(default=0, init=False, repr=False)
+
+    # JSON retries that actually ran, and replies in which constrained
+    # decoding overrode at least one of the model's tokens
+    retries: int = field(default=0, init=False)
+    constrained_replies: int = field(default=0, init=False)
+
+    # reply to hand back from the next _generate instead of calling the model
+    _canned: Optional[str] = field(default=None, init=False, repr=False)
+
+    @contextmanager
+    def serving(self, raw: Optional[str]) -> Iterator[None]:
+        """
+        Answer the next generation inside this block with `raw`, e.g. a
+        reply from a lesson pack. The calling method builds its prompt and
+        parses the reply as usual, so history and state stay consistent.
+        A None `raw` leaves generation untouched.
+        """
+        self._canned = raw
+        try:
+            yield
+        finally:
+            self._canned = None
+
+    def _generate(self, prompt: str,
+                  on_text: Optional[Callable[[str], None]] = None,
+                  expect: Optional[List[ActionType]] = None) -> str:
         """
         Prepend this agent's history to the prompt, invoke the LLM,
         and log the interaction. Returns the raw JSON string from the model.
+        If `on_text` is given the response is streamed to it as it is generated.
+        `expect` lists the action types a constrained model may emit.
         """
-        context = self.history.get_full()
-        full_prompt = f"{context}\n{prompt}" if context else prompt
-
-        while True:
-            raw = self.model.generate(full_prompt)
-            try:
-                json.loads(strip_markdown_fences(raw))
-                break
-            except json.JSONDecodeError:
-                console.print("[bold red]JSON decoding error, retrying...[/]")
-                full_prompt += (
-                    "\nYour last response was not valid JSON. "
-                    "Please reply with only a valid JSON object."
-                )
-
-        self.history.add(f"Prompt: {prompt}")
-        self.history.add(f"Response: {raw}")
+        if self._canned is not None:
+            raw, self._canned = self._canned, None
+            if on_text is not None:
+                on_text(raw)
+            self._record(f"Prompt: {prompt}")
+            self._record(f"Response: {raw}")
+            return raw
+
+        with telemetry.scope(agent=type(self).__name__), \
+                telemetry.span("agent.generate", "agent", retries=0) as span:
+            context = self.history.get_full()
+            full_prompt = f"{context}\n{prompt}" if context else prompt
+
+            live = None
+            if self.model.incremental:
+                if self.history.epoch != self._history_epoch:
+                    # history was summarized; the cached tokens no longer match
+                    self._live.reset()
+                    self._history_epoch = self.history.epoch
+                live = self._live
+
+            allowed = [t.name for t in expect] if expect else None
+            spec = current_speculation()
+            cancel = spec.cancel if spec is not None else None
+
+            for attempt in range(1, MAX_JSON_ATTEMPTS + 1):
+                raw = self.model.generate(full_prompt, live=live, on_text=on_text,
+                                          allowed_actions=allowed,
+                                          quiet=spec is not None, cancel=cancel)
+                if cancel is not None and cancel.is_set():
+                    raise SpeculationCancelled()
+                if self.model.last_interventions:
+                    self.constrained_replies += 1
+                    console.log(f"[dim]Constrained decoding overrode {self.model.last_interventions} "
+                                f"token(s) in this reply[/]")
+                try:
+                    json.loads(strip_markdown_fences(raw))
+                    break
+                except json.JSONDecodeError:
+                    if attempt == MAX_JSON_ATTEMPTS:
+                        raise InvalidReply(f"{type(self).__name__} gave no valid JSON reply "
+                                           f"in {MAX_JSON_ATTEMPTS} attempts")
+                    self.retries += 1
+                    span["retries"] += 1
+                    console.print("[bold red]JSON decoding error, retrying...[/]")
+                    full_prompt += (
+                        "\nYour last response was not valid JSON. "
+                        "Please reply with only a valid JSON object."
+                    )
+
+        self._record(f"Prompt: {prompt}")
+        self._record(f"Response: {raw}")
         return raw
 
+    def _record(self, entry: str):
+        """
+        Add `entry` to this agent's history, or hold it back while speculating.
+        """
+        spec = current_speculation()
+        if spec is not None:
+            spec.entries.append((self.history, entry))
+        else:
+            self.history.add(entry)
+
+    def _apply(self, effect: Callable[[], None]):
+        """
+        Apply a state update now, or hold it back while speculating.
+        """
+        spec = current_speculation()
+        if spec is not None:
+            spec.effects.append(effect)
+        else:
+            effect()
+
     def _parse_action(self, raw: str,
                       expect: Optional[List[ActionType]] = None) -> Action:
         """
@@ -23,7 +23,7 @@ class CoderAgent(BaseAgent):
             Use the file name '{file_name}' for the generated code.
             """
         )
-        raw = self._generate(prompt)
+        raw = self._generate(prompt, expect=[ActionType.GENERATE_CODE])
         action = self._parse_action(raw, expect=[ActionType.GENERATE_CODE])
 
         return action
@@ -1,4 +1,5 @@
 from dataclasses import dataclass
+from typing import Callable, Optional
 
 from core.action import Action, ActionType
 from agents.base_agent import BaseAgent
@@ -11,7 +12,8 @@ class ExplainerAgent(BaseAgent):
     Maintains its own history and emits EXPLAIN_CONCEPT actions.
     """
 
-    def explain_concept_action(self, concept: str) -> Action:
+    def explain_concept_action(self, concept: str,
+                               on_text: Optional[Callable[[str], None]] = None) -> Action:
         """
         Request a clear explanation for the given concept, with examples if helpful.
         Emits EXPLAIN_CONCEPT with payload { explanation: str, examples: List[str] }.
@@ -21,11 +23,12 @@ class ExplainerAgent(BaseAgent):
             "Return JSON: { 'action': 'EXPLAIN_CONCEPT', 'payload': "
             "{ 'explanation': <str>, 'examples': [ ... ] } }."
         )
-        raw = self._generate(prompt)
+        raw = self._generate(prompt, on_text=on_text, expect=[ActionType.EXPLAIN_CONCEPT])
         action = self._parse_action(raw, expect=[ActionType.EXPLAIN_CONCEPT])
         return action
 
-    def answer_question_action(self, concept: str, question: str) -> Action:
+    def answer_question_action(self, concept: str, question: str,
+                               on_text: Optional[Callable[[str], None]] = None) -> Action:
         """
         Provide a targeted answer to a follow-up question about the concept.
         Emits EXPLAIN_CONCEPT with payload { explanation: str, examples: List[str] }.
@@ -36,6 +39,6 @@ class ExplainerAgent(BaseAgent):
             "Return JSON: { 'action': 'EXPLAIN_CONCEPT', 'payload': "
             "{ 'explanation': <str>, 'examples': [ ... ] } }."
         )
-        raw = self._generate(prompt)
+        raw = self._generate(prompt, on_text=on_text, expect=[ActionType.EXPLAIN_CONCEPT])
         action = self._parse_action(raw, expect=[ActionType.EXPLAIN_CONCEPT])
         return action
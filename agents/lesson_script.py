@@ -0,0 +1,239 @@
+import json
+import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, replace
+from typing import Any, List, Optional, Tuple
+
+from rich.console import Console
+
+from agents.base_agent import BaseAgent
+from core.action import Action, ActionType
+from core.history_manager import HistoryManager
+from core.lesson_pack import LessonPack
+
+console = Console()
+
+# the request SessionAgent.run opens every session with
+INIT_REQUEST = "Initialize lesson plan for topic: {topic}"
+
+CODE_DIRECTION = (
+    "Write a short, self-contained example program that demonstrates '{concept}' "
+    "for a lesson on '{topic}'. Leave one or two clearly marked TODO sections "
+    "for the learner to complete."
+)
+
+# words a learner uses to just move the lesson along
+_CONTINUE_WORDS = {
+    "y", "yes", "yeah", "yep", "ok", "okay", "sure", "ready", "next", "continue",
+    "go", "ahead", "start", "begin", "done", "finished", "sounds", "good", "great",
+    "let's", "lets", "let", "us", "i'm", "im", "i", "am", "move", "on", "please",
+    "proceed", "to", "the", "lesson", "objective",
+}
+
+_OPTION = re.compile(r"^\s*(?:option\s*)?(?:([1-9])|([a-d]))\s*[).:]?\s*$", re.I)
+
+
+def is_continue(text: str) -> bool:
+    words = re.sub(r"[^a-z' ]", " ", text.lower()).split()
+    return bool(words) and all(w in _CONTINUE_WORDS for w in words)
+
+
+def _envelope(action: Action) -> str:
+    return json.dumps({"action": action.type.name, "payload": action.payload})
+
+
+def _scripted(action: ActionType, payload: dict) -> str:
+    return json.dumps({"thought": "Following the lesson script.", "action": action.name, "payload": payload})
+
+
+def code_file_name(topic: str, concept: str) -> str:
+    t = topic.lower()
+    ext = ".cu" if "cuda" in t else ".cpp" if "sycl" in t else ".c"
+    slug = re.sub(r"[^a-z0-9]+", "_", concept.lower()).strip("_")[:40] or "example"
+    return slug + ext
+
+
+@dataclass
+class LessonScript:
+    """
+    Walks a lesson from a LessonPack the way the session model would:
+    explain, quiz, evaluate, code and review each objective, then finish.
+
+    `reply` returns the session reply for the next scripted step when the
+    learner's input just moves the lesson along (or answers the quiz), and
+    None when they have left the script, in which case the model decides.
+    `observe` follows the actions actually handled, so the script picks up
+    again after an off-script detour.
+    """
+    session: Any
+    pack: LessonPack
+
+    topic: Optional[str] = None
+    stage: str = "start"
+    file_name: str = ""
+    served: int = 0
+
+    def begin(self, topic: str):
+        plan = self.pack.get(topic, "", ActionType.INITIALIZE.name)
+        self.topic = topic if plan is not None else None
+        self.stage = "start"
+
+    def lookup(self, method_name: str, *args) -> Optional[str]:
+        """
+        Packed reply for a sub-agent call on the current objective.
+        """
+        if self.topic is None or not self.session.lesson_objectives:
+            return None
+        concept = self.session.lesson_objectives[self.session.current_index]
+        return self.pack.get(self.topic, concept, method_name, *args)
+
+    def _answer(self, text: str) -> Optional[str]:
+        options = self.session.quizzer.last_quiz.get("options", [])
+        m = _OPTION.match(text)
+        if m:
+            n = int(m.group(1)) if m.group(1) else "abcd".index(m.group(2).lower()) + 1
+            return str(n) if 1 <= n <= len(options) else None
+        for i, opt in enumerate(options, start=1):
+            if text.strip().lower() == str(opt).strip().lower():
+                return str(i)
+        return None
+
+    def reply(self, user_input: str) -> Optional[str]:
+        if self.topic is None:
+            return None
+        s = self.session
+        if self.stage == "start":
+            if user_input == INIT_REQUEST.format(topic=self.topic):
+                return self.pack.get(self.topic, "", ActionType.INITIALIZE.name)
+            return None
+        if self.stage == "quizzed":
+            answer = self._answer(user_input)
+            if answer is None:
+                return None
+            return _scripted(ActionType.CALL_QUIZZER, {"user_answer": answer})
+        if not is_continue(user_input):
+            return None
+
+        objectives = s.lesson_objectives
+        concept = objectives[s.current_index]
+        if self.stage == "planned":
+            return _scripted(ActionType.CALL_EXPLAINER, {"concept": objectives[0], "is_question": False})
+        if self.stage == "explained":
+            return _scripted(ActionType.CALL_QUIZZER, {"concept": concept})
+        if self.stage == "evaluated":
+            coder = self.pack.get(self.topic, concept, ActionType.CALL_CODER.name)
+            return _scripted(ActionType.CALL_CODER, json.loads(coder)) if coder else None
+        if self.stage == "coded":
+            return _scripted(ActionType.CALL_REVIEWER, {"file_name": self.file_name, "topic": s.lesson_topic})
+        if self.stage == "reviewed":
+            if s.current_index + 1 < len(objectives):
+                return _scripted(ActionType.CALL_EXPLAINER,
+                                 {"concept": objectives[s.current_index + 1], "is_question": False})
+            return _scripted(ActionType.FINISH, {"summary": f"We covered every objective of {s.lesson_topic}."})
+        return None
+
+    def observe(self, action: Action):
+        if self.topic is None:
+            return
+        p = action.payload
+        if action.type == ActionType.INITIALIZE:
+            plan = json.loads(self.pack.get(self.topic, "", ActionType.INITIALIZE.name))
+            if p.get("objectives") != plan["payload"].get("objectives"):
+                # the learner changed the plan; nothing in the pack matches any more
+                self.topic = None
+            self.stage = "planned"
+        elif action.type == ActionType.CALL_EXPLAINER and not p.get("is_question", False):
+            self.stage = "explained"
+        elif action.type == ActionType.CALL_QUIZZER:
+            self.stage = "quizzed" if "concept" in p else "evaluated"
+        elif action.type == ActionType.CALL_CODER:
+            self.stage = "coded"
+            self.file_name = p.get("file_name", "")
+        elif action.type == ActionType.CALL_REVIEWER:
+            self.stage = "reviewed"
+
+
+# --- building -------------------------------------------------------------------
+
+def _fresh(agent: BaseAgent, entries: Optional[List[str]] = None) -> BaseAgent:
+    """
+    Copy of `agent` with its own history, so pack jobs can run concurrently.
+    """
+    h = agent.history
+    history = HistoryManager(summarizer=h.summarizer, history=list(entries or []),
+                             token_limit=h.token_limit, summarize_at=h.summarize_at)
+    return replace(agent, history=history)
+
+
+Entry = Tuple[Tuple[str, ...], str]
+
+
+def _plan(session: Any, topic: str) -> Action:
+    return _fresh(session).step(INIT_REQUEST.format(topic=topic))
+
+
+def _explain(session: Any, topic: str, concept: str) -> List[Entry]:
+    action = _fresh(session.explainer).explain_concept_action(concept)
+    return [((topic, concept, "explain_concept_action", concept), _envelope(action))]
+
+
+def _quiz(session: Any, topic: str, concept: str) -> List[Entry]:
+    quizzer = _fresh(session.quizzer)
+    quiz = quizzer.generate_quiz_action(concept)
+    entries = [((topic, concept, "generate_quiz_action", concept), _envelope(quiz))]
+    for n in range(1, len(quiz.payload.get("options", [])) + 1):
+        # evaluate each option from the same post-quiz history
+        evaluator = _fresh(quizzer, quizzer.history.history)
+        action = evaluator.evaluate_quiz_answer_action(str(n))
+        entries.append(((topic, concept, "evaluate_quiz_answer_action", str(n)), _envelope(action)))
+    return entries
+
+
+def _code(session: Any, topic: str, concept: str) -> List[Entry]:
+    direction = CODE_DIRECTION.format(concept=concept, topic=topic)
+    file_name = code_file_name(topic, concept)
+    action = _fresh(session.coder).generate_code_action(direction, file_name)
+    call = json.dumps({"code_direction": direction, "file_name": file_name})
+    return [
+        ((topic, concept, ActionType.CALL_CODER.name), call),
+        ((topic, concept, "generate_code_action", direction, file_name), _envelope(action)),
+    ]
+
+
+def build_lesson_pack(session: Any, topics: List[str], pack: LessonPack, workers: int = 8):
+    """
+    Generate the plan for every topic, then the explanation, quiz (with an
+    evaluation of every option) and example code for every objective, and
+    store them in `pack`. Jobs run on `workers` threads so a shared
+    GenerationScheduler can batch them.
+    """
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="lesson-pack") as pool:
+        plans = {pool.submit(_plan, session, t): t for t in topics}
+        jobs = {}
+        for future in as_completed(plans):
+            topic = plans[future]
+            try:
+                plan = future.result()
+            except Exception as e:
+                console.print(f"[bold red]Skipping topic '{topic}': {e}[/]")
+                continue
+            objectives = plan.payload.get("objectives", [])
+            if plan.type != ActionType.INITIALIZE or not objectives:
+                console.print(f"[bold red]Skipping topic '{topic}': no lesson plan.[/]")
+                continue
+            pack.put((topic, "", ActionType.INITIALIZE.name), _envelope(plan))
+            console.log(f"Planned '{topic}': {len(objectives)} objectives")
+            for concept in objectives:
+                for job in (_explain, _quiz, _code):
+                    jobs[pool.submit(job, session, topic, concept)] = (topic, concept, job.__name__)
+
+        for future in as_completed(jobs):
+            topic, concept, job = jobs[future]
+            try:
+                entries = future.result()
+            except Exception as e:
+                console.print(f"[bold red]{job[1:]} failed for '{concept}': {e}[/]")
+                continue
+            for parts, text in entries:
+                pack.put(parts, text)
+            console.log(f"[dim]{job[1:]}: {concept}[/]")
@@ -0,0 +1,98 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Optional, Tuple
+
+from rich.console import Console
+
+from agents.base_agent import BaseAgent, Speculation, SpeculationCancelled
+from core.action import Action, ActionType
+
+console = Console()
+
+
+@dataclass
+class Prefetch:
+    key: Tuple
+    agent: BaseAgent
+    speculation: Speculation
+    future: Future
+
+
+@dataclass
+class PrefetchEngine:
+    """
+    Runs the sub-agent call the session is most likely to make next while
+    the learner is still reading the last panel.
+
+    A prefetch is keyed by the exact call it stands in for, e.g.
+    ("generate_quiz_action", concept). Its history entries and state updates
+    are held back; `take` commits them when the session makes that call, and
+    cancels and discards the prefetch when the session calls the same agent
+    for something else.
+    """
+    quizzer: Any
+
+    _worker: ThreadPoolExecutor = field(
+        default_factory=lambda: ThreadPoolExecutor(max_workers=1, thread_name_prefix="prefetch"),
+        init=False, repr=False,
+    )
+    _inflight: Optional[Prefetch] = field(default=None, init=False, repr=False)
+    hits: int = field(default=0, init=False)
+    misses: int = field(default=0, init=False)
+
+    def predict(self, action: Action) -> Optional[Tuple[BaseAgent, Callable, Tuple]]:
+        """
+        The call expected to follow `action`, as (agent, method, args).
+        """
+        p = action.payload
+        if action.type == ActionType.CALL_EXPLAINER and not p.get("is_question", False):
+            # an explanation is almost always followed by a quiz on the same objective
+            return self.quizzer, self.quizzer.generate_quiz_action, (p.get("concept", ""),)
+        return None
+
+    def start(self, agent: BaseAgent, method: Callable, args: Tuple):
+        self.discard()
+        spec = Speculation()
+        key = (method.__name__,) + tuple(args)
+        future = self._worker.submit(spec.run, method, *args)
+        self._inflight = Prefetch(key=key, agent=agent, speculation=spec, future=future)
+
+    def take(self, agent: BaseAgent, method: Callable, *args) -> Optional[Action]:
+        """
+        Return the prefetched result of `method(*args)` and commit its side
+        effects, or None if nothing usable was prefetched. Any prefetch on
+        `agent` for a different call is cancelled first, so the caller can
+        use the agent safely.
+        """
+        inflight = self._inflight
+        if inflight is None or inflight.agent is not agent:
+            return None
+        self._inflight = None
+
+        if inflight.key != (method.__name__,) + tuple(args):
+            self._cancel(inflight)
+            self.misses += 1
+            return None
+
+        try:
+            action = inflight.future.result()
+        except Exception as e:
+            console.log(f"[dim]Prefetch failed, generating normally: {e}[/]")
+            self.misses += 1
+            return None
+        inflight.speculation.commit()
+        self.hits += 1
+        console.log(f"[dim]Using prefetched {method.__name__} ({self.hits} hits, {self.misses} misses)[/]")
+        return action
+
+    def discard(self):
+        if self._inflight is not None:
+            self._cancel(self._inflight)
+            self._inflight = None
+
+    def _cancel(self, inflight: Prefetch):
+        inflight.speculation.cancel.set()
+        try:
+            inflight.future.result()
+        except (SpeculationCancelled, Exception):
+            pass
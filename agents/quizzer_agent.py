@@ -23,13 +23,17 @@ class QuizzerAgent(BaseAgent):
             Create a quiz question for the topic '{topic}'.
             """
         )
-        raw = self._generate(prompt)
+        raw = self._generate(prompt, expect=[ActionType.GENERATE_QUIZ])
         action = self._parse_action(raw, expect=[ActionType.GENERATE_QUIZ])
 
-        self.last_quiz = action.payload.copy()
+        quiz = action.payload.copy()
+        self._apply(lambda: self._remember_quiz(quiz))
 
         return action
 
+    def _remember_quiz(self, quiz: Dict[str, Any]):
+        self.last_quiz = quiz
+
     def evaluate_quiz_answer_action(self, user_answer: str) -> Action:
         """
         Evaluate the user's answer against the last generated quiz.
@@ -61,6 +65,6 @@ class QuizzerAgent(BaseAgent):
             """
         )
 
-        raw = self._generate(prompt)
+        raw = self._generate(prompt, expect=[ActionType.EVALUATE_QUIZ_ANSWER])
         action = self._parse_action(raw, expect=[ActionType.EVALUATE_QUIZ_ANSWER])
         return action
@@ -1,4 +1,5 @@
 from dataclasses import dataclass
+from typing import Callable, Optional
 
 from core.action import Action, ActionType
 from agents.base_agent import BaseAgent
@@ -20,18 +21,43 @@ class ReviewerAgent(BaseAgent):
             Review the code in '{file_name}' related to the topic '{topic}'.
             """
         )
-        raw = self._generate(prompt)
+        raw = self._generate(prompt, expect=[ActionType.SYSTEM_CALL])
         action = self._parse_action(raw, expect=[ActionType.SYSTEM_CALL])
 
         return action
 
-    def step(self) -> Action:
+    def review_report_action(self, file_name: str, topic: str, report: str,
+                             on_text: Optional[Callable[[str], None]] = None) -> Action:
+        """
+        Write the review in one call from the review pipeline's report (diff,
+        compile, run and output check), instead of gathering it step by step.
+        Emits REVIEW_FINISH, or SYSTEM_CALL if the model still wants to run
+        something itself.
+        """
+        prompt = (
+            f"""
+            Review the code in '{file_name}' related to the topic '{topic}'.
+            The code has already been compiled and run for you; the report follows.
+            Reply with REVIEW_FINISH directly.
+
+            {report}
+            """
+        )
+        expect = [ActionType.SYSTEM_CALL, ActionType.REVIEW_FINISH]
+        raw = self._generate(prompt, on_text=on_text, expect=expect)
+        action = self._parse_action(raw, expect=expect)
+
+        return action
+
+    def step(self, on_text: Optional[Callable[[str], None]] = None) -> Action:
         """
         Perform a single step in the review process.
         This method should be called repeatedly until a REVIEW_FINISH action is returned.
+        `on_text` receives the response as it streams in.
         """
         prompt = "Please provide the next step in the code review process."
-        raw = self._generate(prompt)
-        action = self._parse_action(raw, expect=[ActionType.SYSTEM_CALL, ActionType.REVIEW_FINISH])
+        expect = [ActionType.SYSTEM_CALL, ActionType.REVIEW_FINISH]
+        raw = self._generate(prompt, on_text=on_text, expect=expect)
+        action = self._parse_action(raw, expect=expect)
 
         return action
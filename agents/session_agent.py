@@ -1,19 +1,45 @@
 from dataclasses import dataclass, field
-from typing import List, Any
+from typing import Callable, List, Any, Optional
 from enum import Enum, auto
 
 from rich.console import Console
 
-from agents.base_agent import BaseAgent
+from agents.base_agent import BaseAgent, InvalidReply
 from agents.explainer_agent import ExplainerAgent
 from agents.quizzer_agent import QuizzerAgent
 from agents.coder_agent import CoderAgent
 from agents.reviewer_agent import ReviewerAgent
+from agents.prefetch import PrefetchEngine
+from agents.lesson_script import LessonScript, INIT_REQUEST
 from core.executor import Executor
+from core.lesson_pack import LessonPack
 from core.action import Action, ActionType
+from core.observation import Observation
+from core.timing import startup
+from core.telemetry import telemetry
 
 console = Console()
 
+DEFAULT_TOPICS = [
+    "Introduction to Parallel Computing Concepts (shared memory vs. distributed memory)",
+    "OpenMP: Parallelizing Loops with Directives",
+    "CUDA: Vector Addition with Thrust",
+    "MPI: Hello World and Basic Point-to-Point Communication",
+    "SYCL: Simple Kernel for Array Multiplication"
+]
+
+# the actions the session system prompt defines, which `handle` dispatches
+SESSION_ACTIONS = [
+    ActionType.INITIALIZE,
+    ActionType.CALL_EXPLAINER,
+    ActionType.CALL_QUIZZER,
+    ActionType.CALL_CODER,
+    ActionType.CALL_REVIEWER,
+    ActionType.BENCHMARK_CODE,
+    ActionType.QUERY_USER,
+    ActionType.FINISH,
+]
+
 
 class SessionState(Enum):
     INIT = auto()
@@ -38,14 +64,16 @@ class SessionAgent(BaseAgent):
     lesson_topic: str = ""
     lesson_objectives: List[str] = field(default_factory=list)
     current_index: int = 0
-    default_topics: List[str] = field(default_factory=lambda: [
-        "Introduction to Parallel Computing Concepts (shared memory vs. distributed memory)",
-        "OpenMP: Parallelizing Loops with Directives",
-        "CUDA: Vector Addition with Thrust",
-        "MPI: Hello World and Basic Point-to-Point Communication",
-        "SYCL: Simple Kernel for Array Multiplication"
-    ])
+    default_topics: List[str] = field(default_factory=lambda: list(DEFAULT_TOPICS))
     state:      SessionState = SessionState.INIT
+    prefetch:   Optional[PrefetchEngine] = None
+    lesson_pack: Optional[LessonPack] = None
+
+    script: Optional[LessonScript] = field(default=None, init=False, repr=False)
+
+    def __post_init__(self):
+        if self.lesson_pack is not None:
+            self.script = LessonScript(session=self, pack=self.lesson_pack)
 
     def step(self, user_input: str) -> Action:
         """
@@ -55,9 +83,13 @@ class SessionAgent(BaseAgent):
         3) Update state if necessary.
         """
         prompt = self._build_state_prompt(user_input)
-        raw = self._generate(prompt)
+        scripted = self.script.reply(user_input) if self.script is not None else None
+        if scripted is not None:
+            self.script.served += 1
+        with self.serving(scripted):
+            raw = self._generate(prompt, expect=SESSION_ACTIONS)
 
-        action = self._parse_action(raw, expect=list(ActionType))
+        action = self._parse_action(raw, expect=SESSION_ACTIONS)
 
         self._transition_state(action)
         return action
@@ -86,10 +118,13 @@ class SessionAgent(BaseAgent):
             else:
                 self.current_index = idx
 
-            if is_question:
-                sub = self.explainer.answer_question_action(concept, question)
-            else:
-                sub = self.explainer.explain_concept_action(concept)
+            with self.executor.streaming(ActionType.EXPLAIN_CONCEPT, f"Concept: {concept}") as on_text:
+                if is_question:
+                    sub = self._call(self.explainer, self.explainer.answer_question_action,
+                                     concept, question, on_text=on_text)
+                else:
+                    sub = self._call(self.explainer, self.explainer.explain_concept_action,
+                                     concept, on_text=on_text)
             obs = self.executor.execute(sub)
 
         elif action.type == ActionType.CALL_QUIZZER:
@@ -97,9 +132,9 @@ class SessionAgent(BaseAgent):
 
             if "concept" in payload:
                 self.current_index = self.lesson_objectives.index(payload["concept"])
-                sub = self.quizzer.generate_quiz_action(payload["concept"])
+                sub = self._call(self.quizzer, self.quizzer.generate_quiz_action, payload["concept"])
             elif "user_answer" in payload:
-                sub = self.quizzer.evaluate_quiz_answer_action(payload["user_answer"])
+                sub = self._call(self.quizzer, self.quizzer.evaluate_quiz_answer_action, payload["user_answer"])
             else:
                 raise ValueError("Quiz action must have either 'concept' or 'user_answer' in payload.")
 
@@ -109,7 +144,7 @@ class SessionAgent(BaseAgent):
             code_direction = action.payload.get("code_direction", "")
             file_name = action.payload.get("file_name", "")
 
-            sub = self.coder.generate_code_action(code_direction, file_name)
+            sub = self._call(self.coder, self.coder.generate_code_action, code_direction, file_name)
             obs = self.executor.execute(sub)
 
         elif action.type == ActionType.CALL_REVIEWER:
@@ -117,10 +152,19 @@ class SessionAgent(BaseAgent):
             file_name = payload.get("file_name", "")
             topic = payload.get("topic", self.lesson_topic)
 
-            review_action = self.reviewer.initialize_review_action(
-                file_name=file_name,
-                topic=topic
-            )
+            report = self.executor.review(file_name)
+            if report is not None:
+                # the report is part of the prompt, which the reviewer's history records
+                with self.executor.streaming(ActionType.REVIEW_FINISH, "Review Summary") as on_text:
+                    review_action = self.reviewer.review_report_action(
+                        file_name, topic, report.result, on_text=on_text
+                    )
+            else:
+                # no built-in toolchain for this file; let the reviewer drive the shell
+                review_action = self.reviewer.initialize_review_action(
+                    file_name=file_name,
+                    topic=topic
+                )
 
             while review_action.type != ActionType.REVIEW_FINISH:
                 # print type of review_action
@@ -130,10 +174,14 @@ class SessionAgent(BaseAgent):
 
                 self.reviewer.history.add(f"Reviewer Observation: {obs.result}")
 
-                review_action = self.reviewer.step()
+                with self.executor.streaming(ActionType.REVIEW_FINISH, "Review Summary") as on_text:
+                    review_action = self.reviewer.step(on_text=on_text)
 
             obs = self.executor.execute(review_action)
 
+        elif action.type == ActionType.BENCHMARK_CODE:
+            obs = self.executor.execute(action)
+
         elif action.type == ActionType.QUERY_USER:
             # This action is used to query the user for input
             obs = self.executor.execute(action)
@@ -148,8 +196,35 @@ class SessionAgent(BaseAgent):
             obs = self.executor.execute(sub)
 
         self.history.add(f"Observation: {getattr(obs, 'result', obs)}")
+        if self.script is not None:
+            self.script.observe(action)
+        if self.prefetch is not None:
+            guess = self.prefetch.predict(action)
+            if guess is not None and self._packed(guess[1], *guess[2]) is None:
+                self.prefetch.start(*guess)
         return obs
 
+    def _call(self, agent: BaseAgent, method: Callable, *args, **kwargs) -> Action:
+        """
+        Invoke a sub-agent method, serving its reply from the lesson pack or
+        a matching prefetched result when one exists.
+        """
+        packed = self._packed(method, *args)
+        if packed is not None:
+            self.script.served += 1
+            with agent.serving(packed):
+                return method(*args, **kwargs)
+        if self.prefetch is not None:
+            action = self.prefetch.take(agent, method, *args)
+            if action is not None:
+                return action
+        return method(*args, **kwargs)
+
+    def _packed(self, method: Callable, *args) -> Optional[str]:
+        if self.script is None:
+            return None
+        return self.script.lookup(method.__name__, *args)
+
     def _build_state_prompt(self, user_input: str) -> str:
         """
         Build a prompt that includes the current session state and user input.
@@ -187,32 +262,87 @@ class SessionAgent(BaseAgent):
             # fallback: stay in current state
             pass
 
-    def run(self):
+    def _summarize_in_background(self):
+        """
+        Start summarizing any history close to its budget, so the work
+        overlaps with the learner typing instead of the next generation.
+        """
+        for agent in (self, self.explainer, self.quizzer, self.coder, self.reviewer):
+            agent.history.start_background_summary()
+
+    def _turn(self, user_input: str) -> Any:
+        """
+        One `step` and `handle`. A reply that never parsed ends the turn
+        with an error observation instead of ending the session.
+        """
+        try:
+            return self.handle(self.step(user_input))
+        except InvalidReply as e:
+            obs = Observation(result=f"Error: {e}. Please try again or rephrase your request.")
+            console.print(f"[bold red]{obs.result}[/]")
+            self.history.add(f"Observation: {obs.result}")
+            return obs
+
+    def run(self, topic: Optional[str] = None, read_input: Optional[Callable[[], str]] = None):
         """
         Interactive loop: read user input, call `step`, then `handle`, until finished.
+        `topic` skips the topic menu, e.g. when it was shown while the model loaded.
+        `read_input` replaces the input prompt, e.g. with scripted inputs.
         """
         from rich.prompt import Prompt
 
-        console.print("[bold green]👋 Welcome to the HPC Tutor![/]")
-        console.print("Please choose a topic to start your session.")
-        topics = self.default_topics
-        for idx, topic in enumerate(topics, start=1):
-            console.print(f"[bold blue]{idx}. {topic}[/]")
-        choice = Prompt.ask("Enter a number or type a new topic")
-        try:
-            topic = topics[int(choice) - 1]
-        except Exception:
-            topic = choice.strip()
-        console.print(f"[bold blue]Selected topic: {topic}[/]")
+        if read_input is None:
+            read_input = lambda: Prompt.ask("Your input")
+        if topic is None:
+            topic = choose_topic(self.default_topics)
 
-        action = self.step(f"Initialize lesson plan for topic: {topic}")
-        self.handle(action)
+        if self.script is not None:
+            self.script.begin(topic)
+        turn = 0
+        with telemetry.scope(turn=turn):
+            self._turn(INIT_REQUEST.format(topic=topic))
 
         while self.state != SessionState.FINISHED:
+            self._summarize_in_background()
             user_input = ""
             while not user_input.strip():
-                user_input = Prompt.ask("Your input").strip()
-            action = self.step(user_input)
-            self.handle(action)
+                user_input = read_input().strip()
+            turn += 1
+            with telemetry.scope(turn=turn):
+                self._turn(user_input)
 
+        if self.prefetch is not None:
+            self.prefetch.discard()
         console.print("[bold green]Session complete![/]")
+
+        agents = [self, self.explainer, self.quizzer, self.coder, self.reviewer]
+        console.log(
+            f"JSON retries: {sum(a.retries for a in agents)}; "
+            f"replies steered by constrained decoding: {sum(a.constrained_replies for a in agents)}"
+        )
+        for agent in agents:
+            if agent.model.assistant_model is not None:
+                console.log(f"{type(agent).__name__} decoding: {agent.model.stats}")
+        if self.script is not None:
+            console.log(f"Lesson pack: {self.script.served} replies served without the model")
+
+
+def choose_topic(topics: List[str]) -> str:
+    """
+    Show the welcome screen and topic menu, and return the chosen topic.
+    Needs no model, so main.py can show it while the model loads.
+    """
+    from rich.prompt import Prompt
+
+    console.print("[bold green]👋 Welcome to the HPC Tutor![/]")
+    console.print("Please choose a topic to start your session.")
+    for idx, topic in enumerate(topics, start=1):
+        console.print(f"[bold blue]{idx}. {topic}[/]")
+    startup.mark("first prompt")
+    choice = Prompt.ask("Enter a number or type a new topic")
+    try:
+        topic = topics[int(choice) - 1]
+    except Exception:
+        topic = choice.strip()
+    console.print(f"[bold blue]Selected topic: {topic}[/]")
+    return topic
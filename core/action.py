@@ -12,6 +12,7 @@ class ActionType(Enum):
     CALL_REVIEWER = auto()
     QUERY_USER = auto()
     GENERATE_HOMEWORK = auto()
+    BENCHMARK_CODE = auto()
     FINISH = auto()
 
     # Used by ExplainerAgent
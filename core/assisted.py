@@ -0,0 +1,74 @@
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict
+
+
+class ForwardCounter:
+    """
+    Counts forward passes of a model, per thread, so concurrent clients on
+    a shared model each see only their own calls.
+    """
+
+    def __init__(self, model: Any):
+        self._local = threading.local()
+        model.register_forward_hook(self._hook)
+
+    def _hook(self, module, args, output):
+        self._local.count = self.count + 1
+
+    @property
+    def count(self) -> int:
+        return getattr(self._local, "count", 0)
+
+
+_COUNTERS: Dict[int, ForwardCounter] = {}
+_COUNTERS_LOCK = threading.Lock()
+
+
+def forward_counter(model: Any) -> ForwardCounter:
+    """
+    Shared ForwardCounter for `model`, hooked on first use.
+    """
+    with _COUNTERS_LOCK:
+        counter = _COUNTERS.get(id(model))
+        if counter is None:
+            counter = _COUNTERS[id(model)] = ForwardCounter(model)
+        return counter
+
+
+@dataclass
+class DecodeStats:
+    """
+    Running decode throughput for one LLMClient. With a draft model,
+    `rounds` counts target forward passes (each verifies a run of draft
+    tokens and adds one of its own) and `drafted` counts draft tokens
+    proposed, which gives the draft acceptance rate.
+    """
+    calls: int = 0
+    tokens: int = 0
+    seconds: float = 0.0
+    rounds: int = 0
+    drafted: int = 0
+
+    def record(self, tokens: int, seconds: float, rounds: int = 0, drafted: int = 0):
+        self.calls += 1
+        self.tokens += tokens
+        self.seconds += seconds
+        self.rounds += rounds
+        self.drafted += drafted
+
+    @property
+    def tokens_per_second(self) -> float:
+        return self.tokens / self.seconds if self.seconds else 0.0
+
+    @property
+    def acceptance_rate(self) -> float:
+        accepted = max(self.tokens - self.rounds, 0)
+        return min(accepted / self.drafted, 1.0) if self.drafted else 0.0
+
+    def __str__(self) -> str:
+        text = f"{self.calls} calls, {self.tokens} tokens at {self.tokens_per_second:.1f} tok/s"
+        if self.drafted:
+            text += (f", {self.acceptance_rate:.0%} of {self.drafted} draft tokens accepted "
+                     f"({self.tokens / max(self.rounds, 1):.2f} tokens per target step)")
+        return text
@@ -0,0 +1,164 @@
+import io
+import os
+import statistics
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+from rich.console import Console
+from rich.table import Table
+
+from core.utilities import ShellResult
+
+
+@dataclass(frozen=True)
+class BenchmarkConfig:
+    threads: int = 1
+    ranks: int = 1
+
+    @property
+    def cores(self) -> int:
+        return self.threads * self.ranks
+
+    def label(self) -> str:
+        parts = []
+        if self.ranks > 1:
+            parts.append(f"{self.ranks} ranks")
+        parts.append(f"{self.threads} thread" + ("s" if self.threads > 1 else ""))
+        return " × ".join(parts)
+
+
+@dataclass
+class BenchmarkResult:
+    times: List[float] = field(default_factory=list)
+    error: Optional[str] = None
+
+    @property
+    def median(self) -> Optional[float]:
+        return statistics.median(self.times) if self.times and self.error is None else None
+
+
+def default_sweep(cpus: int) -> List[int]:
+    """
+    1, 2, 4, ... up to `cpus` (and `cpus` itself).
+    """
+    counts, n = [], 1
+    while n < cpus:
+        counts.append(n)
+        n *= 2
+    return counts + [cpus]
+
+
+def sweep_configs(threads: List[int], ranks: List[int], cpus: Optional[int] = None) -> List[BenchmarkConfig]:
+    """
+    Every thread × rank combination (that fits on `cpus` cores, if given).
+    """
+    configs = [
+        BenchmarkConfig(threads=t, ranks=r)
+        for r in sorted(set(ranks)) for t in sorted(set(threads))
+        if t >= 1 and r >= 1 and (cpus is None or t * r <= cpus)
+    ]
+    return configs or [BenchmarkConfig()]
+
+
+@dataclass
+class CoreBudget:
+    """
+    Cores not taken by a running benchmark; runs wait until theirs are free.
+    """
+    free: int
+    _cond: threading.Condition = field(default_factory=threading.Condition, init=False, repr=False)
+
+    def acquire(self, n: int):
+        with self._cond:
+            self._cond.wait_for(lambda: self.free >= n)
+            self.free -= n
+
+    def release(self, n: int):
+        with self._cond:
+            self.free += n
+            self._cond.notify_all()
+
+
+@dataclass
+class Benchmark:
+    """
+    Time a program across thread/rank configurations, `repetitions` times
+    each. Runs whose cores add up to no more than the machine's go at the
+    same time; each takes the median of its repetitions.
+    """
+    run_shell: Callable[[str, int], ShellResult]
+    repetitions: int = 3
+    cpus: int = field(default_factory=lambda: os.cpu_count() or 1)
+
+    def run(self, command: Callable[[BenchmarkConfig], str],
+            configs: List[BenchmarkConfig]) -> Dict[BenchmarkConfig, BenchmarkResult]:
+        results = {config: BenchmarkResult() for config in configs}
+        budget = CoreBudget(self.cpus)
+        lock = threading.Lock()
+
+        def once(config: BenchmarkConfig):
+            result = results[config]
+            if result.error is not None:
+                return
+            cores = min(config.cores, self.cpus)
+            budget.acquire(cores)
+            try:
+                shell = self.run_shell(command(config), cores)
+            finally:
+                budget.release(cores)
+            with lock:
+                if shell.exit_code != 0:
+                    result.error = shell.summary().splitlines()[0]
+                else:
+                    result.times.append(shell.duration)
+
+        # the widest runs first, so narrow ones fill the cores left over
+        jobs = [c for c in sorted(configs, key=lambda c: -c.cores) for _ in range(self.repetitions)]
+        with ThreadPoolExecutor(max_workers=self.cpus) as pool:
+            list(pool.map(once, jobs))
+        return results
+
+
+def scaling_table(learner: Dict[BenchmarkConfig, BenchmarkResult],
+                  reference: Optional[Dict[BenchmarkConfig, BenchmarkResult]] = None) -> Table:
+    """
+    Time, speedup and parallel efficiency per configuration, relative to the
+    smallest one, next to the reference solution's time.
+    """
+    configs = sorted(learner, key=lambda c: (c.cores, c.ranks))
+    base = learner[configs[0]].median
+    table = Table(title="Scaling benchmark")
+    for col in ("Configuration", "Time (s)", "Speedup", "Efficiency"):
+        table.add_column(col, justify="right")
+    if reference is not None:
+        table.add_column("Reference (s)", justify="right")
+        table.add_column("vs. reference", justify="right")
+    for config in configs:
+        result = learner[config]
+        t = result.median
+        row = [config.label()]
+        if t is None:
+            row += [result.error or "failed", "", ""]
+        elif base is None:
+            row += [f"{t:.3f}", "", ""]
+        else:
+            speedup = base / t
+            efficiency = speedup * configs[0].cores / config.cores
+            row += [f"{t:.3f}", f"{speedup:.2f}×", f"{100 * efficiency:.0f}%"]
+        if reference is not None:
+            ref = reference.get(config, BenchmarkResult()).median
+            row += [f"{ref:.3f}" if ref is not None else "-",
+                    f"{t / ref:.2f}×" if t is not None and ref else "-"]
+        table.add_row(*row)
+    return table
+
+
+def table_text(table: Table) -> str:
+    """
+    `table` rendered as plain text, e.g. for an Observation.
+    """
+    out = io.StringIO()
+    Console(file=out, width=120, no_color=True).print(table)
+    return out.getvalue()
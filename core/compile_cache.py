@@ -0,0 +1,339 @@
+import hashlib
+import json
+import os
+import re
+import shlex
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Callable, Dict, List, Optional
+
+from rich.console import Console
+from rich.text import Text
+
+from core.utilities import ShellResult
+
+console = Console()
+
+# bump when the key layout or entry format changes
+CACHE_FORMAT = 2
+
+# compiler drivers whose plain invocations are cached (versioned names too, e.g. g++-12)
+_COMPILER = re.compile(r"^(gcc|g\+\+|cc|c\+\+|clang|clang\+\+|nvcc|mpicc|mpicxx|mpic\+\+|mpiCC"
+                       r"|icx|icpx|dpcpp|acpp|syclcc)(-[\d.]+)?$")
+SOURCE_EXTS = (".c", ".cc", ".cpp", ".cxx", ".cu", ".C")
+# anything beyond a single plain command (chains, pipes, globs, substitutions)
+_SHELL_SYNTAX = re.compile(r"[|&;<>()$`*?\[\]{}~\n\\]")
+# "quoted" and <angled> #includes
+_INCLUDE = re.compile(r'^\s*#\s*include\s*(?:"([^"]+)"|<([^>]+)>)', re.MULTILINE)
+# options whose value is the next argument (rather than an input file)
+_VALUE_OPTS = {"-D", "-U", "-x", "-isystem", "-iquote", "-idirafter", "-Xlinker", "-Xcompiler",
+               "-Xptxas", "-ccbin", "-arch", "-gencode", "-MF", "-MT", "-MQ"}
+# environment that changes what a compiler finds
+_ENV = ("CPATH", "C_INCLUDE_PATH", "CPLUS_INCLUDE_PATH", "LIBRARY_PATH", "CUDA_HOME", "OMPI_CC", "OMPI_CXX")
+
+
+@dataclass
+class CompileJob:
+    argv: List[str]
+    sources: List[str]
+    output: str
+    include_dirs: List[str]
+    # other input files: objects, archives, shared libraries, forced includes
+    inputs: List[str] = field(default_factory=list)
+    # -l libraries found in the -L directories
+    libraries: List[str] = field(default_factory=list)
+
+
+def parse_compile(cmd: str, cwd: str = ".") -> Optional[CompileJob]:
+    """
+    The compile job `cmd` runs, or None if it is not a plain compiler
+    invocation producing a single file from sources under `cwd`. Every
+    input it names must exist, so that all of them can be hashed.
+    """
+    cmd = re.sub(r"\s+2>&1\s*$", "", cmd.strip())
+    if _SHELL_SYNTAX.search(cmd):
+        return None
+    try:
+        argv = shlex.split(cmd)
+    except ValueError:
+        return None
+    if not argv or not _COMPILER.match(os.path.basename(argv[0])):
+        return None
+
+    sources, include_dirs, output = [], [], None
+    inputs, lib_dirs, libs = [], [], []
+    compile_only = assembly = False
+    args = iter(argv[1:])
+    for arg in args:
+        if arg == "-o":
+            output = next(args, None)
+        elif arg.startswith("-o") and len(arg) > 2:
+            output = arg[2:]
+        elif arg == "-I":
+            include_dirs.append(next(args, ""))
+        elif arg.startswith("-I"):
+            include_dirs.append(arg[2:])
+        elif arg == "-L":
+            lib_dirs.append(next(args, ""))
+        elif arg.startswith("-L"):
+            lib_dirs.append(arg[2:])
+        elif arg == "-l":
+            libs.append(next(args, ""))
+        elif arg.startswith("-l"):
+            libs.append(arg[2:])
+        elif arg == "-include":
+            inputs.append(next(args, ""))
+        elif arg in _VALUE_OPTS:
+            next(args, None)
+        elif arg == "-c":
+            compile_only = True
+        elif arg == "-S":
+            assembly = True
+        elif arg == "-E" or arg.startswith("-M"):
+            # output goes to stdout or a dependency file
+            return None
+        elif not arg.startswith("-") and arg.endswith(SOURCE_EXTS):
+            sources.append(arg)
+        elif not arg.startswith("-"):
+            inputs.append(arg)
+
+    if not sources or not all(os.path.isfile(os.path.join(cwd, p)) for p in sources + inputs):
+        return None
+    if output is None:
+        if compile_only or assembly:
+            if len(sources) > 1:
+                return None
+            output = os.path.splitext(os.path.basename(sources[0]))[0] + (".s" if assembly else ".o")
+        else:
+            output = "a.out"
+    return CompileJob(argv=argv, sources=sources, output=output, include_dirs=include_dirs,
+                      inputs=inputs, libraries=_find_libraries(libs, lib_dirs, cwd))
+
+
+def _find_libraries(libs: List[str], lib_dirs: List[str], cwd: str) -> List[str]:
+    """
+    The files `-l` options resolve to in the `-L` directories, as the linker
+    searches them. Libraries found only on the system paths are not listed.
+    """
+    found = []
+    for lib in libs:
+        names = [lib[1:]] if lib.startswith(":") else [f"lib{lib}.so", f"lib{lib}.a"]
+        for d in lib_dirs:
+            path = next((os.path.join(d, n) for n in names if os.path.isfile(os.path.join(cwd, d, n))), None)
+            if path is not None:
+                found.append(path)
+                break
+    return found
+
+
+def _local_headers(job: CompileJob, cwd: str) -> List[str]:
+    """
+    Headers reachable from the job's sources, relative to `cwd`: quoted
+    #includes found next to the including file or in the -I directories,
+    and angled ones found in the -I directories. System headers are
+    covered by the compiler version.
+    """
+    seen: List[str] = []
+    todo = list(job.sources)
+    while todo:
+        path = todo.pop()
+        try:
+            with open(os.path.join(cwd, path), errors="replace") as f:
+                text = f.read()
+        except OSError:
+            continue
+        for quoted, angled in _INCLUDE.findall(text):
+            name = quoted or angled
+            bases = ([os.path.dirname(path)] if quoted else []) + job.include_dirs
+            for base in bases:
+                candidate = os.path.normpath(os.path.join(base, name))
+                if os.path.isfile(os.path.join(cwd, candidate)):
+                    if candidate not in seen:
+                        seen.append(candidate)
+                        todo.append(candidate)
+                    break
+    return seen
+
+
+def _digest(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+@dataclass
+class CompileCache:
+    """
+    On-disk, content-addressed cache of compiler invocations.
+
+    A compile is keyed by the SHA-256 of the command line, the compiler's
+    `--version`, the contents of its sources, local headers, linked
+    objects and libraries, and the environment compilers read. An entry
+    holds the diagnostics, exit code and the output file; a hit restores the
+    file and prints the diagnostics again without running the compiler, so
+    repeated builds of the same skeleton are free across reviews and
+    learners. Least recently used entries are evicted past `max_bytes`.
+    """
+    directory: str
+    max_bytes: int = 512 * 1024 * 1024
+
+    hits: int = field(default=0, init=False)
+    misses: int = field(default=0, init=False)
+    seconds_saved: float = field(default=0.0, init=False)
+    _size: int = field(default=0, init=False, repr=False)
+    _versions: Dict[str, Optional[str]] = field(default_factory=dict, init=False, repr=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False)
+
+    def __post_init__(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._size = sum(os.path.getsize(p) for p in self._files())
+
+    def _files(self):
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith((".json", ".bin")):
+                    yield os.path.join(root, name)
+
+    def _path(self, key: str, ext: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}{ext}")
+
+    def _compiler_version(self, compiler: str) -> Optional[str]:
+        path = shutil.which(compiler)
+        if path is None:
+            return None
+        stamp = f"{os.path.realpath(path)}:{os.path.getmtime(path)}"
+        with self._lock:
+            if stamp in self._versions:
+                return self._versions[stamp]
+        try:
+            proc = subprocess.run([path, "--version"], capture_output=True, text=True, timeout=10)
+            version = f"{stamp}\n{proc.stdout}"
+        except (OSError, subprocess.SubprocessError):
+            version = None
+        with self._lock:
+            self._versions[stamp] = version
+        return version
+
+    def key(self, cmd: str, job: CompileJob, cwd: str) -> Optional[str]:
+        version = self._compiler_version(job.argv[0])
+        if version is None:
+            return None
+        paths = job.sources + job.inputs + job.libraries + _local_headers(job, cwd)
+        files = {p: _digest(os.path.join(cwd, p)) for p in paths}
+        blob = json.dumps({
+            "format": CACHE_FORMAT,
+            "cmd": cmd.strip(),
+            "compiler": version,
+            "files": files,
+            "env": {k: os.environ.get(k) for k in _ENV},
+        }, sort_keys=True)
+        return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+    def run(self, cmd: str, cwd: Optional[str], run_cmd: Callable[[], ShellResult]) -> ShellResult:
+        """
+        Result of the shell command `cmd` run in `cwd`: restored from the
+        cache when it is a compile seen before, otherwise from `run_cmd()`,
+        whose result is cached if `cmd` is a compile.
+        """
+        cwd = cwd or "."
+        job = parse_compile(cmd, cwd)
+        key = self.key(cmd, job, cwd) if job is not None else None
+        if key is None:
+            return run_cmd()
+
+        restored = self._restore(key, job, cwd)
+        if restored is not None:
+            return restored
+        with self._lock:
+            self.misses += 1
+        result = run_cmd()
+        if not (result.timed_out or result.truncated):
+            self._store(key, job, cwd, result)
+        return result
+
+    def _restore(self, key: str, job: CompileJob, cwd: str) -> Optional[ShellResult]:
+        start = time.perf_counter()
+        meta_path = self._path(key, ".json")
+        try:
+            with open(meta_path) as f:
+                entry = json.load(f)
+            target = os.path.join(cwd, job.output)
+            if entry["has_output"]:
+                shutil.copyfile(self._path(key, ".bin"), target)
+                os.chmod(target, entry["mode"])
+            os.utime(meta_path)
+        except (OSError, ValueError, KeyError):
+            return None
+        # nothing ran, so there is no resource profile to report
+        result = ShellResult(**dict(entry["result"], profile=None))
+        with self._lock:
+            self.hits += 1
+            self.seconds_saved += result.duration
+        result.duration = time.perf_counter() - start
+        restored = job.output if entry["has_output"] else "diagnostics"
+        console.print(f"♻️  [bold blue]Compilation cache hit:[/] restored {restored}")
+        # replayed as the compiler printed them, warnings included
+        for text, style in ((result.stdout, ""), (result.stderr, "red")):
+            for line in text.splitlines():
+                console.print(Text(line, style=style))
+        return result
+
+    def _store(self, key: str, job: CompileJob, cwd: str, result: ShellResult):
+        meta_path = self._path(key, ".json")
+        os.makedirs(os.path.dirname(meta_path), exist_ok=True)
+        target = os.path.join(cwd, job.output)
+        has_output = result.exit_code == 0 and os.path.isfile(target)
+        added = 0
+        try:
+            if has_output:
+                fd, tmp = tempfile.mkstemp(dir=os.path.dirname(meta_path), suffix=".tmp")
+                os.close(fd)
+                shutil.copyfile(target, tmp)
+                os.replace(tmp, self._path(key, ".bin"))
+                added += os.path.getsize(self._path(key, ".bin"))
+            entry = {
+                "result": asdict(result),
+                "has_output": has_output,
+                "mode": os.stat(target).st_mode & 0o777 if has_output else 0,
+                "output": job.output,
+            }
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(meta_path), suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                json.dump(entry, f)
+            os.replace(tmp, meta_path)
+            added += os.path.getsize(meta_path)
+        except OSError as e:
+            console.log(f"[yellow]Could not cache compile output: {e}[/]")
+            return
+        with self._lock:
+            self._size += added
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        entries = sorted(
+            (p for p in self._files() if p.endswith(".json")),
+            key=lambda p: os.path.getmtime(p),
+        )
+        for meta_path in entries:
+            if self._size <= self.max_bytes * 0.9:
+                break
+            for path in (meta_path, meta_path[:-len(".json")] + ".bin"):
+                try:
+                    size = os.path.getsize(path)
+                    os.remove(path)
+                except OSError:
+                    continue
+                self._size -= size
+
+    def stats(self) -> str:
+        total = self.hits + self.misses
+        rate = 100.0 * self.hits / total if total else 0.0
+        return (f"compilation cache: {self.hits} hits, {self.misses} misses ({rate:.0f}% hit rate), "
+                f"{self.seconds_saved:.1f}s of compiling saved, {self._size / 1e6:.1f} MB on disk")
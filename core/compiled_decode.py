@@ -0,0 +1,120 @@
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional
+
+from rich.console import Console
+
+from core.kv_cache import layer_states
+from core.loader import resolve
+
+console = Console()
+
+
+def static_cache(hf_model: Any, max_cache_len: int) -> Any:
+    """
+    A StaticCache of `max_cache_len` tokens for `hf_model`. Sliding-window
+    layers get full-length storage as well: the attention mask still applies
+    the window, and unlike the rolling static layers they do not make
+    torch.compile specialize (and recompile) on every decode position.
+    """
+    from transformers import StaticCache
+    from transformers.cache_utils import StaticLayer
+
+    cache = StaticCache(config=hf_model.config, max_cache_len=max_cache_len)
+    cache.layers = [StaticLayer(max_cache_len=max_cache_len) for _ in cache.layers]
+    return cache
+
+
+@dataclass
+class CompiledDecoder:
+    """
+    Opt-in fast path for single-request decoding on one hf_model: a
+    preallocated static KV cache per cache length and a torch.compile'd
+    forward for the decode steps (transformers compiles it when `generate`
+    gets a static cache and a compile config; prefill stays eager).
+
+    A client's cache holds `context_tokens` of prompt plus its
+    `max_new_tokens`. Requests that would not fit fall back to the
+    dynamic cache. Generations take turns, so each cache is allocated once
+    and reused, and the compiled graph is reused for each cache length.
+    `warm` compiles ahead of the first request.
+    """
+    hf_model: Any
+    context_tokens: int = 4096
+    # "default" on CPU; "reduce-overhead" adds CUDA graphs on GPUs
+    mode: str = "default"
+
+    fallbacks: int = field(default=0, init=False)
+    _caches: Dict[int, Any] = field(default_factory=dict, init=False, repr=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False)
+
+    def cache_len(self, max_new_tokens: int) -> int:
+        return self.context_tokens + max_new_tokens
+
+    def _compile_config(self) -> Any:
+        from transformers import CompileConfig
+
+        config = CompileConfig(dynamic=False, mode=self.mode)
+        # transformers only compiles on accelerators unless told otherwise
+        config._compile_all_devices = True
+        return config
+
+    def _cache(self, length: int) -> Any:
+        cache = self._caches.get(length)
+        if cache is None:
+            cache = self._caches[length] = static_cache(resolve(self.hf_model), length)
+        else:
+            cache.reset()
+        return cache
+
+    @contextmanager
+    def prepare(self, inputs: Dict[str, Any], max_new_tokens: int) -> Iterator[Optional[Dict[str, Any]]]:
+        """
+        Swap a static cache into `inputs`, seeded with any prefix cache they
+        carry, and yield the extra `generate` kwargs; yields None when the
+        request does not fit. Holds the decoder for the duration.
+        """
+        length = self.cache_len(max_new_tokens)
+        prompt_len = inputs["input_ids"].shape[-1]
+        if prompt_len + max_new_tokens > length:
+            self.fallbacks += 1
+            console.log(f"[dim]{prompt_len} prompt tokens exceed the static cache; decoding eagerly[/]")
+            yield None
+            return
+
+        import torch
+
+        with self._lock:
+            # the cache tensors are allocated under generate's inference mode
+            with torch.inference_mode():
+                cache = self._cache(length)
+                prefix = inputs.get("past_key_values")
+                if prefix is not None:
+                    n = prefix.get_seq_length()
+                    states = layer_states(prefix)
+                    # a rolling sliding-window layer may hold less than the
+                    # whole prefix; then the whole prompt is prefilled instead
+                    if all(k is not None and k.shape[-2] == n for k, _ in states):
+                        for i, (k, v) in enumerate(states):
+                            cache.update(k, v, i)
+            inputs["past_key_values"] = cache
+            yield {"compile_config": self._compile_config()}
+
+    def warm(self, max_new_tokens: List[int]):
+        """
+        Compile the decode step for the cache length of each `max_new_tokens`
+        with a short throwaway generation.
+        """
+        import torch
+
+        hf_model = resolve(self.hf_model)
+        for n in sorted(set(max_new_tokens)):
+            start = time.perf_counter()
+            bos = hf_model.generation_config.bos_token_id or 0
+            inputs = {"input_ids": torch.full((1, 8), bos, device=hf_model.device)}
+            with self.prepare(inputs, n) as extra, torch.inference_mode():
+                hf_model.generate(**inputs, max_new_tokens=3, min_new_tokens=3, do_sample=False, **extra)
+            console.log(f"[dim]Compiled decoding for {self.cache_len(n)}-token caches "
+                        f"in {time.perf_counter() - start:.1f}s[/]")
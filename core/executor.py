@@ -1,23 +1,212 @@
+import dataclasses
 import os
 import subprocess
-from dataclasses import dataclass
+import tempfile
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Callable, Iterator, List, Optional
 
 from rich.console import Console
+from rich.live import Live
 from rich.panel import Panel
 from rich.syntax import Syntax
 from rich.table import Table
 from rich.prompt import Prompt
 
 from core.action import Action, ActionType
-from core.utilities import save_to_file, run_shell
+from core.compile_cache import CompileCache
+from core.resource_profile import is_program_run
+from core.telemetry import telemetry
+from core.review_pipeline import ReviewPipeline, pick_toolchain
+from core.benchmark import Benchmark, default_sweep, scaling_table, sweep_configs, table_text
+from core.utilities import ShellLimits, ShellResult, save_to_file, run_shell, partial_json_string
 from core.observation import Observation
 
 console = Console()
 
+# payload field shown while an action of that type is still being generated
+STREAMED_FIELDS = {
+    ActionType.EXPLAIN_CONCEPT: "explanation",
+    ActionType.REVIEW_FINISH: "feedback_summary",
+}
+
+
+def run_editor(path: str):
+    editor = os.environ.get('EDITOR', 'vi')
+    subprocess.run([editor, path])
+
+
+def press_enter():
+    Prompt.ask("", default="", show_default=False)
+
+
+def _counts(value: Any) -> List[int]:
+    """
+    Thread or rank counts from a model payload: a list of integers (or a
+    single one), empty when not given. Raises ValueError/TypeError otherwise.
+    """
+    if value is None:
+        return []
+    values = value if isinstance(value, list) else [value]
+    if any(isinstance(v, bool) or isinstance(v, float) and not v.is_integer() for v in values):
+        raise ValueError(value)
+    return [int(v) for v in values]
+
 
 @dataclass
 class Executor:
+    stream: bool = True
+    # directory generated files are written to and shell commands run in
+    # (the current directory when None)
+    workdir: Optional[str] = None
+    # opens a file for the learner to edit and returns once it is saved
+    edit: Callable[[str], None] = run_editor
+    # waits for the learner before the editor opens
+    confirm: Callable[[], None] = press_enter
+    shell_limits: ShellLimits = field(default_factory=ShellLimits)
+    # restores repeated compiler invocations instead of rerunning them
+    compile_cache: Optional[CompileCache] = None
+
+    _references: Optional[tempfile.TemporaryDirectory] = field(default=None, init=False, repr=False)
+
+    def _path(self, fname: str) -> str:
+        return os.path.join(self.workdir, fname) if self.workdir else fname
+
+    def _reference_dir(self) -> str:
+        """
+        The session's private directory for the coder's reference solutions,
+        outside the learner's working directory. Removed at exit.
+        """
+        if self._references is None:
+            self._references = tempfile.TemporaryDirectory(prefix="tutor-reference-")
+        return self._references.name
+
+    def _run_shell(self, cmd: str) -> ShellResult:
+        def run_cmd() -> ShellResult:
+            return run_shell(cmd, cwd=self.workdir, limits=self.shell_limits, profile=is_program_run(cmd))
+
+        with telemetry.span("shell", "shell", cmd=cmd) as span:
+            if self.compile_cache is None:
+                result = run_cmd()
+            else:
+                result = self.compile_cache.run(cmd, self.workdir, run_cmd)
+            span.update(exit_code=result.exit_code, timed_out=result.timed_out)
+            return result
+
+    def review(self, file_name: str) -> Optional[Observation]:
+        """
+        Diff, compile, run and check the learner's copy of `file_name`
+        without the model. None when the file's language has no toolchain.
+        """
+        console.print(Panel(f"Reviewing learner_{file_name}", title="Code Review", expand=False))
+        report = ReviewPipeline(run_shell=self._run_shell, workdir=self.workdir,
+                                reference_dir=self._reference_dir()).report(file_name)
+        return Observation(result=report) if report is not None else None
+
+    def benchmark(self, p: dict) -> Observation:
+        """
+        Build the learner's program and the reference solution and time both
+        across the requested OpenMP thread and MPI rank counts.
+        """
+        file_name = os.path.basename(p.get("file_name", ""))
+        if file_name.startswith("learner_"):
+            file_name = file_name[len("learner_"):]
+        learner_file = f"learner_{file_name}"
+        try:
+            with open(self._path(learner_file)) as f:
+                source = f.read()
+        except OSError:
+            return Observation(result=f"Cannot benchmark: {learner_file} does not exist.")
+        toolchain = pick_toolchain(file_name, source)
+        if toolchain is None:
+            return Observation(result=f"Cannot benchmark {file_name}: unsupported language.")
+
+        stem = os.path.splitext(file_name)[0]
+        builds = {"learner": (learner_file, f"learner_{stem}")}
+        reference_file = os.path.join(self._reference_dir(), file_name)
+        if os.path.exists(reference_file):
+            builds["reference"] = (reference_file, os.path.join(self._reference_dir(), stem))
+        binaries = {}
+        for who, (source_file, binary) in builds.items():
+            shell = self._run_shell(toolchain.compile_cmd(source_file, binary))
+            if shell.exit_code != 0:
+                if who == "learner":
+                    return Observation(result="Cannot benchmark: compilation failed.\n" + shell.summary())
+                continue
+            binaries[who] = binary
+
+        try:
+            asked_threads = _counts(p.get("threads"))
+            asked_ranks = _counts(p.get("ranks"))
+            repetitions = max(1, int(p.get("repetitions") or 3))
+        except (TypeError, ValueError):
+            return Observation(result=(
+                "Cannot benchmark: threads and ranks must be lists of integers and repetitions an integer, "
+                f"got threads={p.get('threads')!r}, ranks={p.get('ranks')!r}, "
+                f"repetitions={p.get('repetitions')!r}."
+            ))
+
+        cpus = os.cpu_count() or 1
+        threads = asked_threads or (default_sweep(cpus) if toolchain.openmp else [1])
+        ranks = asked_ranks or (default_sweep(cpus) if toolchain.mpi else [1])
+        # only the default sweep is kept within the machine; asked-for counts may oversubscribe it
+        limit = None if asked_threads or asked_ranks else cpus
+        configs = sweep_configs(threads, ranks, limit)
+        bench = Benchmark(run_shell=self._run_benchmark, repetitions=repetitions, cpus=cpus)
+
+        console.print(Panel(
+            f"Timing {len(configs)} configurations × {bench.repetitions} repetitions of {', '.join(binaries)}",
+            title="⏱️ Benchmark", expand=False,
+        ))
+        results = {}
+        with console.status("⏳ [bold blue]Benchmarking...[/]", spinner="dots"):
+            for who, binary in binaries.items():
+                results[who] = bench.run(
+                    lambda c, binary=binary: f"OMP_NUM_THREADS={c.threads} {toolchain.run_cmd(binary, ranks=c.ranks)}",
+                    configs,
+                )
+        table = scaling_table(results["learner"], results.get("reference"))
+        console.print(table)
+        return Observation(result=(
+            f"Benchmark of {learner_file} (median wall time of {bench.repetitions} runs; "
+            f"runs that fit on the machine's {cpus} cores together ran concurrently):\n" + table_text(table)
+        ))
+
+    def _run_benchmark(self, cmd: str, cores: int) -> ShellResult:
+        # the CPU limit is per process, so it grows with the cores a run uses
+        limits = self.shell_limits
+        if limits.cpu_seconds:
+            limits = dataclasses.replace(limits, cpu_seconds=limits.cpu_seconds * cores)
+        return run_shell(cmd, cwd=self.workdir, limits=limits, quiet=True)
+
+    @contextmanager
+    def streaming(self, action_type: ActionType, title: str) -> Iterator[Optional[Callable[[str], None]]]:
+        """
+        Render the panel for `action_type` progressively while its JSON is
+        generated. Yields an `on_text` callback for LLMClient.generate, or
+        None when streaming is off or the action has no streamed field.
+        The live panel is transient; `execute` prints the final one.
+        """
+        key = STREAMED_FIELDS.get(action_type)
+        if not self.stream or key is None:
+            yield None
+            return
+
+        with Live(Panel("…", title=title), console=console, transient=True, refresh_per_second=8) as live:
+            def on_text(text: str):
+                body = partial_json_string(text, key)
+                if body:
+                    # keep the newest lines in view while the text grows
+                    lines = body.splitlines()[-max(console.height - 4, 1):]
+                    live.update(Panel("\n".join(lines), title=title))
+
+            yield on_text
+
     def execute(self, action: Action) -> Observation:
+        with telemetry.span(f"executor.{action.type.name}", "executor"):
+            return self._execute(action)
+
+    def _execute(self, action: Action) -> Observation:
         console.log(f"[bold cyan]Executing action[/] → {action.type.name}")
         p = action.payload
 
@@ -83,9 +272,16 @@ class Executor:
             syntax = Syntax(code, lang, line_numbers=True)
             console.print(Panel(syntax, title=f"📝 Generated Code → {fname}"))
 
-            save_to_file(code, fname)
+            save_to_file(code, self._path(fname))
+            solution = p.get("solution", "")
+            if solution:
+                # kept out of the learner's directory, and written without
+                # save_to_file's log line; the review pipeline compares the
+                # learner's output with it
+                with open(os.path.join(self._reference_dir(), os.path.basename(fname)), "w") as f:
+                    f.write(solution.strip() + "\n")
             learner_fname = f"learner_{fname}"
-            save_to_file(code, learner_fname)
+            save_to_file(code, self._path(learner_fname))
 
             console.print()
             console.print(Panel(
@@ -98,12 +294,11 @@ class Executor:
                 expand=False
             ))
 
-            Prompt.ask("", default="", show_default=False)
+            self.confirm()
 
-            editor = os.environ.get('EDITOR', 'vi')
-            subprocess.run([editor, learner_fname])
+            self.edit(self._path(learner_fname))
 
-            with open(learner_fname) as f:
+            with open(self._path(learner_fname)) as f:
                 final = f.read()
             console.print(Panel(
                 Syntax(final, lang, line_numbers=True),
@@ -120,8 +315,20 @@ class Executor:
         elif action.type == ActionType.SYSTEM_CALL:
             cmd = action.payload
             console.print(Panel(f"Running shell command: {cmd}", title="Shell Command", expand=False))
-            output = run_shell(cmd)
-            return Observation(result=output)
+            shell = self._run_shell(cmd)
+            return Observation(
+                result=shell.summary(),
+                exit_code=shell.exit_code,
+                duration=shell.duration,
+                truncated=shell.truncated,
+                stdout=shell.stdout,
+                stderr=shell.stderr,
+                profile=shell.profile,
+            )
+
+        elif action.type == ActionType.BENCHMARK_CODE:
+            # payload: {"file_name": ..., "threads": [...], "ranks": [...], "repetitions": ...}
+            return self.benchmark(p)
 
         elif action.type == ActionType.REVIEW_FINISH:
             # payload: the reviewer's final review in string format
@@ -1,36 +1,155 @@
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
 from dataclasses import dataclass, field
-from typing import Any, List
+from typing import Any, List, Optional
 
 from rich.console import Console
 from rich.table import Table
 
+from core.telemetry import telemetry
+
 console = Console()
 
+# one background summary at a time, shared by every HistoryManager whose
+# summarizer decodes on its own
+_SUMMARY_WORKER = ThreadPoolExecutor(max_workers=1, thread_name_prefix="summarizer")
+
+
+def start_summary_worker():
+    """
+    Start the shared summary thread now, from the calling thread. A server
+    does this before serving: threads started from a learner's session
+    write to that learner for good.
+    """
+    _SUMMARY_WORKER.submit(lambda: None).result()
+
 
 @dataclass
 class HistoryManager:
     summarizer: Any
     history: List[str] = field(default_factory=list)
-    word_limit: int = 800
+    # budget for the joined history, in model tokens
+    token_limit: int = 1024
+    # fraction of the budget at which a background summary may be started
+    summarize_at: float = 0.75
+    # bumped whenever entries are rewritten rather than appended, so
+    # consumers holding per-turn state (e.g. a live KV cache) can drop it
+    epoch: int = 0
+
+    # per-entry token counts, computed once when the entry is added
+    token_counts: List[int] = field(default_factory=list, init=False)
+    total_tokens: int = field(default=0, init=False)
+    _text: Optional[str] = field(default=None, init=False, repr=False)
+    _pending: Optional[Future] = field(default=None, init=False, repr=False)
+    _worker: Optional[ThreadPoolExecutor] = field(default=None, init=False, repr=False)
+    _lock: threading.RLock = field(default_factory=threading.RLock, init=False, repr=False)
+
+    def __post_init__(self):
+        entries, self.history = self.history, []
+        for entry in entries:
+            self.add(entry)
+
+    def count_tokens(self, text: str) -> int:
+        count = getattr(self.summarizer, "count_tokens", None)
+        if count is None:
+            return len(text.split())
+        return count(text)
 
     def add(self, entry: str):
-        self.history.append(entry)
+        n = self.count_tokens(entry)
+        with self._lock:
+            self.history.append(entry)
+            self.token_counts.append(n)
+            # +1 for the newline joining it to the previous entry
+            self.total_tokens += n + (1 if len(self.history) > 1 else 0)
+            self._text = None
+
+    def _replace(self, entries: List[str]):
+        with self._lock:
+            self.history = []
+            self.token_counts = []
+            self.total_tokens = 0
+            for entry in entries:
+                self.add(entry)
+            self.epoch += 1
+
+    def _summary_worker(self) -> ThreadPoolExecutor:
+        # behind a scheduler, summaries of different histories can share a
+        # batch, so each history gets its own worker instead of queueing
+        if getattr(self.summarizer, "scheduler", None) is None:
+            return _SUMMARY_WORKER
+        if self._worker is None:
+            self._worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix="summarizer")
+        return self._worker
+
+    def start_background_summary(self) -> bool:
+        """
+        If the history is nearing its budget, summarize what is there now on
+        the background worker. The summary replaces exactly those entries
+        once it is ready; anything added meanwhile is kept after it.
+        Meant to be called while the learner is typing.
+        """
+        with self._lock:
+            if self._pending is not None or self.total_tokens < self.summarize_at * self.token_limit:
+                return False
+            text = "\n".join(self.history)
+            self._pending = self._summary_worker().submit(
+                self._summarize_snapshot, text, len(self.history), self.epoch
+            )
+        return True
+
+    def _summarize_snapshot(self, text: str, n: int, epoch: int):
+        summary = None
+        try:
+            summary = self.summarizer.generate(text, quiet=True)
+        finally:
+            # one locked step, so get_full never sees no summary pending
+            # while the history is still over budget
+            with self._lock:
+                # the snapshot is stale if the history was rewritten meanwhile
+                if summary is not None and self.epoch == epoch:
+                    self._replace([f"History summary: {summary}"] + self.history[n:])
+                self._pending = None
 
     def get_full(self) -> str:
-        full_text = "\n".join(self.history)
+        with telemetry.span("history.get_full", "history") as span:
+            pending = self._pending
+            if pending is not None and self.total_tokens > self.token_limit:
+                # a summary is already on its way; waiting beats starting another
+                span["waited_for_summary"] = True
+                try:
+                    pending.result()
+                except Exception as e:
+                    console.print(f"[red]Background summary failed: {e}[/]")
+
+            snapshot = None
+            with self._lock:
+                if self.total_tokens > self.token_limit:
+                    snapshot = "\n".join(self.history), len(self.history), self.epoch
+            if snapshot is not None:
+                full_text, n, epoch = snapshot
+                # summarized outside the lock, so adds from other threads do not wait on the model
+                span["summarized"] = True
+                console.print("[red][DEBUG SUMMARIZER][/]")
+                # quiet: a summary may quote what an agent must not echo (e.g. a reference solution)
+                summary = self.summarizer.generate(full_text, quiet=True)
+                console.print("[red][DEBUG SUMMARIZER END][/]\n")
+                with self._lock:
+                    # a history rewritten meanwhile already holds a newer summary
+                    if self.epoch == epoch:
+                        self._replace([f"History summary: {summary}"] + self.history[n:])
 
-        if len(full_text.split()) > self.word_limit:
-            console.print("[red][DEBUG SUMMARIZER][/]")
-            summary = self.summarizer.generate(full_text)
-            console.print("[red][DEBUG SUMMARIZER END][/]\n")
-            self.history = [f"History summary: {summary}"]
-            return self.history[0]
-        return full_text
+            with self._lock:
+                if self._text is None:
+                    self._text = "\n".join(self.history)
+                span["tokens"] = self.total_tokens
+                return self._text
 
     def show_history(self):
         table = Table(title="Agent History")
         table.add_column("Step", style="dim", width=6, justify="right")
+        table.add_column("Tokens", style="dim", justify="right")
         table.add_column("Entry")
-        for i, entry in enumerate(self.history, 1):
-            table.add_row(str(i), entry)
+        for i, (entry, n) in enumerate(zip(self.history, self.token_counts), 1):
+            table.add_row(str(i), str(n), entry)
         console.print(table)
@@ -0,0 +1,327 @@
+import http.client
+import json
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from rich.console import Console
+
+from core.assisted import DecodeStats
+from core.response_cache import ResponseCache
+from core.telemetry import telemetry
+from core.timing import startup
+from core.utilities import JSONObjectScanner, redact_payload, trim_after_json_object
+
+console = Console()
+
+# errors from reusing a keep-alive connection the server has since closed
+_STALE = (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError)
+
+
+class BackendError(RuntimeError):
+    pass
+
+
+class ConnectionPool:
+    """
+    Keep-alive HTTP connections to one server, shared by every client and
+    thread. At most `size` requests are in flight at once (the server
+    batches them); further requests wait for a free connection. A pooled
+    connection the server has closed is replaced transparently.
+    """
+
+    def __init__(self, url: str, size: int = 8, timeout: float = 600.0, api_key: Optional[str] = None):
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https") or not parts.hostname:
+            raise ValueError(f"Expected an http(s) URL, got {url!r}")
+        self.url = url
+        self.https = parts.scheme == "https"
+        self.host = parts.hostname
+        self.port = parts.port or (443 if self.https else 80)
+        # e.g. "/v1"
+        self.path = parts.path.rstrip("/")
+        self.size = size
+        self.timeout = timeout
+        self.headers = {"Content-Type": "application/json", "Connection": "keep-alive"}
+        if api_key:
+            self.headers["Authorization"] = f"Bearer {api_key}"
+        self.opened = 0
+        self.requests = 0
+        self._idle: List[http.client.HTTPConnection] = []
+        self._served: Dict[str, str] = {}
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+
+    def _checkout(self) -> Tuple[http.client.HTTPConnection, bool]:
+        with self._lock:
+            self.requests += 1
+            if self._idle:
+                return self._idle.pop(), True
+            self.opened += 1
+        cls = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+        return cls(self.host, self.port, timeout=self.timeout), False
+
+    def _checkin(self, conn: http.client.HTTPConnection, reusable: bool):
+        if reusable:
+            with self._lock:
+                self._idle.append(conn)
+        else:
+            conn.close()
+
+    @contextmanager
+    def post(self, path: str, payload: Optional[Dict[str, Any]], root: bool = False,
+             method: str = "POST") -> Iterator[http.client.HTTPResponse]:
+        """
+        POST `payload` as JSON to `path` under the URL's path (under the
+        server root with `root`) and yield the response; `method="GET"`
+        sends no body. The connection goes back to the pool only if the body
+        was read to the end.
+        """
+        path = path if root else self.path + path
+        body = json.dumps(payload).encode("utf-8") if payload is not None else None
+        self._slots.acquire()
+        conn, resp = None, None
+        try:
+            for attempt in range(2):
+                conn, reused = self._checkout()
+                try:
+                    conn.request(method, path, body=body, headers=self.headers)
+                    resp = conn.getresponse()
+                    break
+                except _STALE as e:
+                    conn.close()
+                    if not reused or attempt:
+                        raise BackendError(f"The inference server at {self.url} closed the connection: {e}") from e
+                except OSError as e:
+                    conn.close()
+                    raise BackendError(f"Cannot reach the inference server at {self.url}: {e}") from e
+            if resp.status >= 400:
+                detail = resp.read().decode("utf-8", errors="replace")[:500]
+                raise BackendError(f"{self.url}{path} answered {resp.status} {resp.reason}: {detail}")
+            yield resp
+        finally:
+            if conn is not None:
+                self._checkin(conn, resp is not None and resp.isclosed())
+            self._slots.release()
+
+    def served_model(self, model: str) -> str:
+        """
+        What the server reports serving for `model` on /models: the served
+        id (a checkpoint path for llama.cpp), with the weights it was loaded
+        from when the server says (vLLM's "root"). Asked once per model; just
+        `model` if the server does not list its models.
+        """
+        served = self._served.get(model)
+        if served is None:
+            try:
+                with self.post("/models", None, method="GET") as resp:
+                    entries = json.loads(resp.read())["data"]
+                # llama.cpp serves its one model under any requested name
+                entry = next((e for e in entries if e["id"] == model), entries[0])
+                served = entry["id"] + (f"@{entry['root']}" if entry.get("root") else "")
+            except (BackendError, ValueError, KeyError, IndexError, TypeError):
+                served = model
+            self._served[model] = served
+        return served
+
+    def stats(self) -> str:
+        return (f"inference server {self.url}: {self.requests} requests over "
+                f"{self.opened} connections (pool of {self.size})")
+
+
+def _events(resp: http.client.HTTPResponse) -> Iterator[Dict[str, Any]]:
+    """
+    The JSON events of a server-sent event stream, up to "[DONE]".
+    """
+    for raw in resp:
+        line = raw.decode("utf-8").strip()
+        if not line.startswith("data:"):
+            continue
+        data = line[len("data:"):].strip()
+        if data == "[DONE]":
+            # drain the end of the chunked body so the connection can be reused
+            resp.read()
+            return
+        yield json.loads(data)
+
+
+@dataclass
+class OpenAIClient:
+    """
+    LLMClient's interface over an OpenAI-compatible chat completions server
+    (llama.cpp server, vLLM, ...) instead of an in-process model, so agents
+    and prompts work unchanged while the server does the batching.
+    Requests go through a shared ConnectionPool. Replies are streamed when
+    the caller renders them, may be cancelled, or should stop at the end of
+    their JSON object, which closes the stream early.
+    """
+    pool: ConnectionPool
+    model: str
+    system_prompt: str
+    max_new_tokens: int
+    # ask for a JSON object (response_format) when the caller names allowed actions
+    constrained_json: bool = False
+    stop_at_json_end: bool = False
+    response_cache: Optional[ResponseCache] = None
+    owner: Any = None
+    # payload fields left out of the console echo (the coder's reference solution)
+    hidden_fields: Tuple[str, ...] = ()
+
+    # what BaseAgent, HistoryManager and SessionAgent read from a client
+    incremental: bool = field(default=False, init=False)
+    assistant_model: Any = field(default=None, init=False)
+    last_ttft: Optional[float] = field(default=None, init=False, repr=False)
+    last_interventions: int = field(default=0, init=False, repr=False)
+    last_timing: Dict[str, Any] = field(default_factory=dict, init=False, repr=False)
+    stats: DecodeStats = field(default_factory=DecodeStats, init=False, repr=False)
+
+    _chars_per_token: Optional[float] = field(default=None, init=False, repr=False)
+
+    def count_tokens(self, text: str) -> int:
+        """
+        Token count estimated locally, at the characters per token of the
+        server's tokenizer, measured once on the system prompt.
+        """
+        if self._chars_per_token is None:
+            self._chars_per_token = self._measure_chars_per_token()
+        return max(1, round(len(text) / self._chars_per_token))
+
+    def _measure_chars_per_token(self) -> float:
+        # llama.cpp and vLLM have a /tokenize endpoint; four characters per token without it
+        sample = self.system_prompt
+        try:
+            with self.pool.post("/tokenize", {"model": self.model, "content": sample, "prompt": sample},
+                                root=True) as resp:
+                data = json.loads(resp.read())
+            n = data["count"] if "count" in data else len(data["tokens"])
+        except (BackendError, ValueError, KeyError):
+            return 4.0
+        return len(sample) / n if n and sample else 4.0
+
+    def warm_prefix(self):
+        # the server keeps its own prompt cache
+        pass
+
+    def _payload(self, user_prompt: str, allowed_actions: Optional[List[str]], stream: bool) -> Dict[str, Any]:
+        payload: Dict[str, Any] = {
+            "model": self.model,
+            "messages": [
+                {"role": "system", "content": self.system_prompt},
+                {"role": "user", "content": user_prompt},
+            ],
+            "max_tokens": self.max_new_tokens,
+            "temperature": 0,
+            "stream": stream,
+        }
+        if stream:
+            payload["stream_options"] = {"include_usage": True}
+        if self.constrained_json and allowed_actions:
+            payload["response_format"] = {"type": "json_object"}
+        return payload
+
+    def _complete(self, payload: Dict[str, Any]) -> str:
+        start = time.perf_counter()
+        with self.pool.post("/chat/completions", payload) as resp:
+            data = json.loads(resp.read())
+        text = data["choices"][0]["message"].get("content") or ""
+        usage = data.get("usage") or {}
+        tokens = usage.get("completion_tokens", 0)
+        self.last_timing = {"prompt_tokens": usage.get("prompt_tokens", 0), "generated_tokens": tokens}
+        self.stats.record(tokens=tokens, seconds=time.perf_counter() - start)
+        return text
+
+    def _stream(self, payload: Dict[str, Any], on_text: Optional[Callable[[str], None]],
+                cancel: Optional[threading.Event]) -> str:
+        start = time.perf_counter()
+        first = None
+        text, chunks = "", 0
+        usage: Dict[str, Any] = {}
+        scanner = JSONObjectScanner() if self.stop_at_json_end else None
+        with self.pool.post("/chat/completions", payload) as resp:
+            for event in _events(resp):
+                usage = event.get("usage") or usage
+                choices = event.get("choices") or []
+                delta = (choices[0].get("delta") or {}).get("content") if choices else None
+                if delta:
+                    if first is None:
+                        first = time.perf_counter()
+                    text += delta
+                    chunks += 1
+                    if on_text is not None:
+                        on_text(text)
+                # leaving early closes the connection, which stops the server
+                # generating; a new connection costs far less than the tokens saved
+                if cancel is not None and cancel.is_set():
+                    break
+                if scanner is not None and delta and scanner.feed(delta):
+                    break
+
+        end = time.perf_counter()
+        tokens = usage.get("completion_tokens", chunks)
+        self.last_ttft = first - start if first is not None else None
+        self.last_timing = {"prompt_tokens": usage.get("prompt_tokens", 0), "generated_tokens": tokens}
+        if first is not None:
+            self.last_timing.update(prefill=first - start, decode_tokens=max(tokens - 1, 0),
+                                    decode_seconds=end - first)
+            if tokens > 1 and end > first:
+                self.last_timing["decode_tok_s"] = (tokens - 1) / (end - first)
+        self.stats.record(tokens=tokens, seconds=end - start)
+        return text
+
+    def generate(
+        self,
+        user_prompt: str,
+        live: Any = None,
+        on_text: Optional[Callable[[str], None]] = None,
+        allowed_actions: Optional[List[str]] = None,
+        quiet: bool = False,
+        cancel: Optional[threading.Event] = None,
+    ) -> str:
+        """
+        Same contract as LLMClient.generate. `live` is ignored: the server
+        reuses cached prompt prefixes on its own.
+        """
+        with telemetry.span("llm.generate", "llm", owner=self.owner, streamed=on_text is not None):
+            self.last_timing = {}
+            key = None
+            if self.response_cache is not None:
+                key = ResponseCache.key(
+                    model=self.model,
+                    revision=self.pool.served_model(self.model),
+                    system_prompt=self.system_prompt,
+                    prompt=user_prompt,
+                    max_new_tokens=self.max_new_tokens,
+                    allowed_actions=allowed_actions if self.constrained_json else None,
+                    stop_at_json_end=self.stop_at_json_end,
+                )
+                cached = self.response_cache.get(key)
+                if cached is not None:
+                    telemetry.annotate(cached_reply=True)
+                    if on_text is not None:
+                        on_text(cached)
+                    if not quiet:
+                        console.print("[red]▶️  LLMClient.generate() output (cached):[/]\n",
+                                      redact_payload(cached, self.hidden_fields))
+                    return cached
+
+            stream = on_text is not None or cancel is not None or self.stop_at_json_end
+            payload = self._payload(user_prompt, allowed_actions, stream)
+            if stream:
+                decoded = self._stream(payload, on_text, cancel)
+            else:
+                status = nullcontext() if quiet else console.status("Generating response...", spinner="dots")
+                with status:
+                    decoded = self._complete(payload)
+            if self.stop_at_json_end:
+                decoded = trim_after_json_object(decoded)
+            telemetry.annotate(**self.last_timing)
+            startup.mark("first reply")
+            if not quiet:
+                console.print("[red]▶️  LLMClient.generate() output:[/]\n",
+                              redact_payload(decoded, self.hidden_fields))
+            if key is not None and not (cancel is not None and cancel.is_set()):
+                self.response_cache.put(key, decoded, meta={"model": self.model})
+            return decoded
@@ -0,0 +1,493 @@
+import copy
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Set
+
+import torch
+from transformers import LogitsProcessor, StoppingCriteria
+
+# the scanner needs no torch, so it lives with the other JSON text helpers
+from core.utilities import JSONObjectScanner
+
+# top-level keys of the action envelope every agent replies with
+ENVELOPE_KEYS = ("thought", "action", "payload")
+REQUIRED_KEYS = ("action", "payload")
+
+_WS = " \t\n\r"
+_MAX_WS_RUN = 64
+_LITERALS = ("true", "false", "null")
+_ESCAPES = '"\\/bfnrt'
+_HEX = "0123456789abcdefABCDEF"
+
+# number sub-states that may end the number
+_NUM_DONE = {"zero", "int", "frac", "exp"}
+# spare tokens before closing is forced: one unforced token may open several containers
+_CLOSING_MARGIN = 8
+# longest closing text worked out
+_CLOSING_LIMIT = 256
+
+
+@dataclass
+class EnvelopeGrammar:
+    """
+    Incremental, character-level validator for a single JSON action
+    envelope: an object with keys drawn from `thought` (string), `action`
+    (one of `actions`) and `payload` (any JSON value), in any order.
+    Nested payloads are checked as plain JSON.
+
+    `feed` consumes text and reports whether it is still a valid prefix;
+    validators are small and cheap to `copy` for look-ahead.
+    """
+    actions: List[str]
+
+    state: str = "start"
+    stack: List[str] = field(default_factory=list)
+    seen: Set[str] = field(default_factory=set)
+    key: Optional[str] = None
+    buf: str = ""
+    literal: str = ""
+    num: str = ""
+    unicode_left: int = 0
+    ws_run: int = 0
+    # string state to return to after an escape: "key" or "string"
+    resume: str = "string"
+
+    def copy(self) -> "EnvelopeGrammar":
+        new = copy.copy(self)
+        new.stack = list(self.stack)
+        new.seen = set(self.seen)
+        return new
+
+    @property
+    def done(self) -> bool:
+        return self.state == "done"
+
+    @property
+    def started(self) -> bool:
+        return self.state not in ("start",)
+
+    def feed(self, text: str) -> bool:
+        for ch in text:
+            if not self._feed_char(ch):
+                return False
+        return True
+
+    def closing(self, limit: int = _CLOSING_LIMIT) -> Optional[str]:
+        """
+        The shortest text found that completes the envelope from here: open
+        strings and containers are closed, missing required keys added with
+        an empty value. None if it would be longer than `limit`.
+        """
+        grammar = self.copy()
+        text = ""
+        while not grammar.done:
+            if len(text) >= limit:
+                return None
+            ch = grammar._closing_char()
+            if not grammar._feed_char(ch):
+                return None
+            text += ch
+        return text
+
+    def _missing_keys(self) -> List[str]:
+        return [k for k in REQUIRED_KEYS if k not in self.seen]
+
+    def _closing_char(self) -> str:
+        """
+        The next character of `closing`.
+        """
+        state = self.state
+        if self.unicode_left:
+            return "0"
+        if state == "escape":
+            return "n"
+        if state in ("string", "key"):
+            role = self._string_role()
+            if role == "key":
+                names = [k for k in self._missing_keys() + list(ENVELOPE_KEYS)
+                         if k.startswith(self.buf) and k not in self.seen]
+            elif role == "action":
+                names = [a for a in self.actions if a.startswith(self.buf)]
+            else:
+                names = [self.buf]
+            return names[0][len(self.buf)] if names and names[0] != self.buf else '"'
+        if state == "literal":
+            return self.literal[0]
+        if state == "number" and self.num not in _NUM_DONE:
+            # "-", "1." and "1e" need a digit
+            return "0"
+        if state == "start":
+            return "{"
+        if state == "colon":
+            return ":"
+        if state == "value":
+            if self._at_top() and self.key in ("thought", "action"):
+                return '"'
+            return "{" if self._at_top() and self.key == "payload" else "0"
+        if state == "obj_key":
+            return '"'
+        if state == "arr_first":
+            return "]"
+        # obj_first, after_value, or a number that may end here
+        at_top = len(self.stack) == 1 and self.stack[-1] == "o"
+        if at_top and self._missing_keys():
+            return '"' if state == "obj_first" else ","
+        return "}" if self.stack[-1] == "o" else "]"
+
+    # --- helpers -----------------------------------------------------------------
+
+    def _at_top(self) -> bool:
+        return len(self.stack) == 1
+
+    def _close_value(self):
+        self.state = "after_value" if self.stack else "done"
+
+    def _open(self, kind: str):
+        self.stack.append(kind)
+        self.state = "obj_first" if kind == "o" else "arr_first"
+
+    def _start_value(self, ch: str) -> bool:
+        # the top-level keys constrain the type of their value
+        if self._at_top() and self.key in ("thought", "action") and ch != '"':
+            return False
+        if ch == "{" or ch == "[":
+            self._open("o" if ch == "{" else "a")
+        elif ch == '"':
+            self.state = "string"
+            self.buf = ""
+        elif ch in "tfn":
+            self.literal = next(lit for lit in _LITERALS if lit[0] == ch)[1:]
+            self.state = "literal"
+        elif ch == "-":
+            self.num, self.state = "minus", "number"
+        elif ch == "0":
+            self.num, self.state = "zero", "number"
+        elif ch.isdigit():
+            self.num, self.state = "int", "number"
+        else:
+            return False
+        return True
+
+    def _close_container(self, ch: str) -> bool:
+        kind = self.stack[-1]
+        if (kind == "o") != (ch == "}"):
+            return False
+        if kind == "o" and self._at_top() and not all(k in self.seen for k in REQUIRED_KEYS):
+            return False
+        self.stack.pop()
+        self._close_value()
+        return True
+
+    def _number_char(self, ch: str) -> Optional[bool]:
+        """
+        Advance the number sub-state. Returns None if `ch` ends the number.
+        """
+        n = self.num
+        if ch.isdigit():
+            if n in ("minus", "int"):
+                self.num = "int" if n == "int" or ch != "0" else "zero"
+            elif n in ("frac0", "frac"):
+                self.num = "frac"
+            elif n in ("exp0", "expsign", "exp"):
+                self.num = "exp"
+            else:
+                return False
+            return True
+        if ch == "." and n in ("zero", "int"):
+            self.num = "frac0"
+            return True
+        if ch in "eE" and n in ("zero", "int", "frac"):
+            self.num = "exp0"
+            return True
+        if ch in "+-" and n == "exp0":
+            self.num = "expsign"
+            return True
+        if n in _NUM_DONE:
+            return None
+        return False
+
+    def _string_char(self, ch: str) -> bool:
+        if self.unicode_left:
+            if ch not in _HEX:
+                return False
+            self.unicode_left -= 1
+            return True
+        if self.state == "escape":
+            if ch not in _ESCAPES and ch != "u":
+                return False
+            self.unicode_left = 4 if ch == "u" else 0
+            self.state = self.resume
+            return True
+        if ord(ch) < 0x20:
+            return False
+
+        role = self._string_role()
+        if ch == '"':
+            if role == "key":
+                if self.buf not in ENVELOPE_KEYS or self.buf in self.seen:
+                    return False
+                self.key = self.buf
+                self.seen.add(self.buf)
+            if self.state == "key":
+                self.state = "colon"
+                return True
+            if role == "action" and self.buf not in self.actions:
+                return False
+            self._close_value()
+            return True
+        if ch == "\\":
+            # keys and action names are plain identifiers
+            if role in ("key", "action"):
+                return False
+            self.resume = self.state
+            self.state = "escape"
+            return True
+        if role == "key":
+            cand = self.buf + ch
+            if not any(k.startswith(cand) and k not in self.seen for k in ENVELOPE_KEYS):
+                return False
+            self.buf = cand
+        elif role == "action":
+            cand = self.buf + ch
+            if not any(a.startswith(cand) for a in self.actions):
+                return False
+            self.buf = cand
+        return True
+
+    def _string_role(self) -> str:
+        if self.state == "key":
+            return "key" if self._at_top() else "free"
+        if self._at_top() and self.key == "action":
+            return "action"
+        return "free"
+
+    def _feed_char(self, ch: str) -> bool:
+        state = self.state
+
+        if state in ("string", "key", "escape"):
+            return self._string_char(ch)
+
+        if state == "literal":
+            if not self.literal or ch != self.literal[0]:
+                return False
+            self.literal = self.literal[1:]
+            if not self.literal:
+                self._close_value()
+            return True
+
+        if state == "number":
+            ok = self._number_char(ch)
+            if ok is not None:
+                return ok
+            self._close_value()
+            return self._feed_char(ch)
+
+        if ch in _WS:
+            if state == "done":
+                return False
+            self.ws_run += 1
+            return self.ws_run <= _MAX_WS_RUN
+        self.ws_run = 0
+
+        if state == "start":
+            if ch != "{":
+                return False
+            self._open("o")
+            return True
+
+        if state == "value":
+            return self._start_value(ch)
+
+        if state in ("obj_first", "obj_key"):
+            if ch == '"':
+                self.state = "key"
+                self.buf = ""
+                return True
+            if ch == "}" and state == "obj_first":
+                return self._close_container(ch)
+            return False
+
+        if state == "colon":
+            if ch != ":":
+                return False
+            self.state = "value"
+            return True
+
+        if state == "arr_first":
+            if ch == "]":
+                return self._close_container(ch)
+            return self._start_value(ch)
+
+        if state == "after_value":
+            if ch == ",":
+                if self.stack[-1] == "o":
+                    self.state = "obj_key"
+                    if self._at_top():
+                        self.key = None
+                else:
+                    self.state = "value"
+                return True
+            if ch in "}]":
+                return self._close_container(ch)
+            return False
+
+        return False
+
+
+class TokenTexts:
+    """
+    Memoized text of individual token ids. Decoding after an anchor token
+    keeps the leading space that some tokenizers drop for a lone token.
+    """
+
+    def __init__(self, tokenizer: Any):
+        self.tokenizer = tokenizer
+        self._texts: Dict[int, str] = {}
+        anchor = tokenizer.encode("a", add_special_tokens=False)
+        self._anchor = anchor[:1]
+        self._anchor_text = tokenizer.decode(self._anchor) if self._anchor else ""
+
+    def __getitem__(self, token_id: int) -> str:
+        text = self._texts.get(token_id)
+        if text is None:
+            try:
+                full = self.tokenizer.decode(self._anchor + [token_id], skip_special_tokens=True)
+                text = full[len(self._anchor_text):]
+            except Exception:
+                text = ""
+            self._texts[token_id] = text
+        return text
+
+
+_TOKEN_TEXTS: Dict[int, TokenTexts] = {}
+
+
+def token_texts(tokenizer: Any) -> TokenTexts:
+    """
+    Shared TokenTexts for `tokenizer`, so clients on one processor share the memo.
+    """
+    texts = _TOKEN_TEXTS.get(id(tokenizer))
+    if texts is None:
+        texts = _TOKEN_TEXTS[id(tokenizer)] = TokenTexts(tokenizer)
+    return texts
+
+
+class EnvelopeLogitsProcessor(LogitsProcessor):
+    """
+    Greedy constrained decoding for the action envelope: at every step the
+    highest-scoring token that keeps the output a valid envelope prefix is
+    the only one left unmasked, and once the object closes only EOS remains.
+
+    `interventions` counts steps inside the object where the model's own
+    choice had to be overridden. With `max_new_tokens`, the object is
+    closed along `EnvelopeGrammar.closing` once the remaining budget leaves
+    no more room than that (at worst one token per character), so a reply
+    never runs out of tokens in the middle of a string or number.
+    """
+
+    def __init__(self, texts: TokenTexts, actions: List[str], prompt_len: int, eos_ids: List[int],
+                 max_new_tokens: Optional[int] = None):
+        self.texts = texts
+        self.actions = actions
+        self.prompt_len = prompt_len
+        self.eos_ids = eos_ids
+        self.max_new_tokens = max_new_tokens
+        self.interventions = 0
+        # per row: tokens fed so far, and the grammar state after each of them
+        self._fed: Dict[int, List[int]] = {}
+        self._states: Dict[int, List[EnvelopeGrammar]] = {}
+
+    def _grammar(self, row: int, ids: torch.Tensor) -> EnvelopeGrammar:
+        fed = self._fed.setdefault(row, [])
+        states = self._states.setdefault(row, [EnvelopeGrammar(actions=self.actions)])
+        new = ids[self.prompt_len:].tolist()
+        if new[:len(fed)] != fed:
+            # assisted decoding rejected draft tokens: rewind to the shared prefix
+            n = 0
+            while n < min(len(fed), len(new)) and fed[n] == new[n]:
+                n += 1
+            del fed[n:], states[n + 1:]
+        for tid in new[len(fed):]:
+            grammar = states[-1].copy()
+            grammar.feed(self.texts[tid])
+            states.append(grammar)
+            fed.append(tid)
+        return states[-1]
+
+    def _first_valid(self, grammar: EnvelopeGrammar, scores: torch.Tensor) -> Optional[int]:
+        vocab = scores.shape[-1]
+        for k in (32, 512, vocab):
+            top = torch.topk(scores, min(k, vocab)).indices.tolist()
+            for rank, tid in enumerate(top):
+                text = self.texts[tid]
+                if text and grammar.copy().feed(text):
+                    if rank and grammar.started:
+                        self.interventions += 1
+                    return tid
+            if k >= vocab:
+                break
+        return None
+
+    def _closing_token(self, grammar: EnvelopeGrammar, generated: int, scores: torch.Tensor) -> Optional[int]:
+        """
+        The best token continuing the envelope's closing text, when the
+        remaining budget has come down to its length; None before that.
+        """
+        if self.max_new_tokens is None:
+            return None
+        remaining = self.max_new_tokens - generated
+        if remaining > _CLOSING_LIMIT + _CLOSING_MARGIN:
+            return None
+        closing = grammar.closing()
+        if closing is None or len(closing) + _CLOSING_MARGIN < remaining:
+            return None
+        ranked = torch.argsort(scores, descending=True).tolist()
+        for tid in ranked:
+            text = self.texts[tid]
+            if text and closing.startswith(text):
+                if tid != ranked[0] and grammar.started:
+                    self.interventions += 1
+                return tid
+        return None
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        for row in range(input_ids.shape[0]):
+            grammar = self._grammar(row, input_ids[row])
+            if grammar.done:
+                allowed = self.eos_ids[:1]
+            else:
+                generated = input_ids.shape[-1] - self.prompt_len
+                tid = self._closing_token(grammar, generated, scores[row])
+                if tid is None:
+                    tid = self._first_valid(grammar, scores[row])
+                allowed = [tid] if tid is not None else []
+            if not allowed:
+                continue
+            keep = scores[row, allowed].clone()
+            scores[row] = float("-inf")
+            scores[row, allowed] = keep
+        return scores
+
+
+class JSONObjectStoppingCriteria(StoppingCriteria):
+    """
+    Ends generation for each sequence as soon as its first top-level JSON
+    object is balanced, instead of running on to EOS or max_new_tokens.
+    """
+
+    def __init__(self, texts: TokenTexts, prompt_len: int):
+        self.texts = texts
+        self.prompt_len = prompt_len
+        self._rows: Dict[int, JSONObjectScanner] = {}
+        self._fed: Dict[int, int] = {}
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        done = []
+        for row in range(input_ids.shape[0]):
+            scanner = self._rows.setdefault(row, JSONObjectScanner())
+            fed = self._fed.get(row, 0)
+            new = input_ids[row, self.prompt_len + fed:].tolist()
+            for tid in new:
+                scanner.feed(self.texts[tid])
+            self._fed[row] = fed + len(new)
+            done.append(scanner.closed)
+        return torch.tensor(done, dtype=torch.bool, device=input_ids.device)
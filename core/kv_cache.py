@@ -0,0 +1,157 @@
+import copy
+import threading
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+
+from rich.console import Console
+
+if TYPE_CHECKING:
+    from core.kv_snapshot import KVSnapshotStore
+
+console = Console()
+
+
+def new_dynamic_cache(hf_model: Any) -> Any:
+    """
+    Create an empty DynamicCache laid out for `hf_model` (sliding-window
+    layers included on versions that support it). Past states are recorded
+    so the cache can later be cropped back below the sliding window.
+    """
+    from transformers import DynamicCache
+
+    try:
+        cache = DynamicCache(config=hf_model.config)
+    except TypeError:
+        cache = DynamicCache()
+    if hasattr(cache, "activate_past_recording"):
+        cache.activate_past_recording()
+    return cache
+
+
+def layer_states(cache: Any) -> List[Tuple[Any, Any]]:
+    """
+    (keys, values) per layer, for both the layered and the legacy cache API.
+    """
+    if hasattr(cache, "layers"):
+        return [(layer.keys, layer.values) for layer in cache.layers]
+    return list(zip(cache.key_cache, cache.value_cache))
+
+
+def crop_cache(cache: Any, keep: int) -> bool:
+    """
+    Crop `cache` in place to its first `keep` tokens. Returns False when the
+    cache cannot be rolled back that far.
+    """
+    remove = cache.get_seq_length() - keep
+    if remove <= 0:
+        return remove == 0
+    try:
+        cache.crop(-remove)
+    except Exception:
+        return False
+    return cache.get_seq_length() == keep
+
+
+def common_prefix_len(a: List[int], b: List[int]) -> int:
+    n = min(len(a), len(b))
+    i = 0
+    while i < n and a[i] == b[i]:
+        i += 1
+    return i
+
+
+@dataclass
+class PrefixCache:
+    """
+    Prefilled KV state for token prefixes (in practice: each agent's system
+    prompt), shared by every LLMClient that runs on the same hf_model.
+
+    The first lookup of a prefix runs a single forward pass and keeps the
+    resulting cache; every later lookup returns a private deep copy that
+    `generate` is free to extend in place. With `snapshots` set, prefilled
+    prefixes are also saved to disk and loaded from there on the next run.
+    """
+    hf_model: Any
+    snapshots: Optional["KVSnapshotStore"] = None
+    _entries: Dict[Tuple[int, ...], Any] = field(default_factory=dict, init=False, repr=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False)
+
+    def prefill(self, prefix_ids: List[int]) -> Any:
+        import torch
+
+        ids = torch.tensor([prefix_ids], device=self.hf_model.device)
+        cache = new_dynamic_cache(self.hf_model)
+        with torch.inference_mode():
+            self.hf_model(input_ids=ids, past_key_values=cache, use_cache=True)
+        return cache
+
+    def lookup(self, prefix_ids: List[int]) -> Any:
+        """
+        Return a copy of the cache for `prefix_ids`, prefilling it on first use.
+        """
+        key = tuple(prefix_ids)
+        with self._lock:
+            cache = self._entries.get(key)
+            if cache is None:
+                cache = self._load_or_prefill(prefix_ids)
+                self._entries[key] = cache
+        return copy.deepcopy(cache)
+
+    def warm(self, prefix_ids: List[int]):
+        """
+        Make sure the cache for `prefix_ids` is ready without copying it.
+        """
+        key = tuple(prefix_ids)
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = self._load_or_prefill(prefix_ids)
+
+    def _load_or_prefill(self, prefix_ids: List[int]) -> Any:
+        if self.snapshots is not None:
+            cache = self.snapshots.load(self.hf_model, prefix_ids)
+            if cache is not None:
+                console.log(f"[dim]Loaded {len(prefix_ids)} prefix tokens from KV snapshot[/]")
+                return cache
+        console.log(f"[dim]Prefilling {len(prefix_ids)} prefix tokens[/]")
+        cache = self.prefill(prefix_ids)
+        if self.snapshots is not None:
+            self.snapshots.save(self.hf_model, prefix_ids, cache)
+        return cache
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+@dataclass
+class LiveCache:
+    """
+    An agent's KV cache carried from one turn to the next, together with the
+    token ids it holds. Each request reuses the longest prefix it shares with
+    the previous turn and only prefills what was appended since.
+    """
+    ids: List[int] = field(default_factory=list)
+    cache: Any = None
+
+    def reset(self):
+        self.ids = []
+        self.cache = None
+
+    def take(self, input_ids: List[int]) -> Any:
+        """
+        Hand over the cache cropped to the prefix it shares with `input_ids`,
+        leaving at least one token to prefill. Returns None if nothing is
+        reusable. The live cache is empty until `store` is called again.
+        """
+        cache, ids = self.cache, self.ids
+        self.reset()
+        if cache is None:
+            return None
+        keep = min(common_prefix_len(ids, input_ids), len(input_ids) - 1)
+        if keep <= 0 or not crop_cache(cache, keep):
+            return None
+        return cache
+
+    def store(self, ids: List[int], cache: Any):
+        self.ids = ids[:cache.get_seq_length()]
+        self.cache = cache
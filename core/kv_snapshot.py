@@ -0,0 +1,161 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from rich.console import Console
+
+from core.kv_cache import layer_states, new_dynamic_cache
+
+console = Console()
+
+# bump when the file layout changes
+SNAPSHOT_FORMAT = 1
+
+
+def model_fingerprint(hf_model: Any) -> Dict[str, str]:
+    """
+    Everything about `hf_model` that changes the KV state it computes for a
+    given prompt: checkpoint and revision, dtype, quantization and module
+    types (dynamic quantization swaps Linear classes without touching the
+    config).
+    """
+    import transformers
+
+    config = hf_model.config
+    name = getattr(config, "_name_or_path", "") or getattr(hf_model, "name_or_path", "")
+    revision = getattr(config, "_commit_hash", None)
+    if not revision and os.path.isdir(name):
+        # local checkpoint: the weights' mtimes stand in for a revision
+        stamps = [
+            f"{f}:{os.path.getmtime(os.path.join(name, f)):.0f}"
+            for f in sorted(os.listdir(name))
+            if f.endswith((".safetensors", ".bin", "config.json"))
+        ]
+        revision = hashlib.sha256("|".join(stamps).encode()).hexdigest()[:16]
+    modules = sorted({type(m).__name__ for m in hf_model.modules()})
+    return {
+        "model": name,
+        "revision": revision or "unknown",
+        "dtype": str(getattr(hf_model, "dtype", "")),
+        "quantization": str(getattr(config, "quantization_config", None)),
+        "modules": hashlib.sha256("|".join(modules).encode()).hexdigest()[:16],
+        "transformers": transformers.__version__,
+    }
+
+
+@dataclass
+class KVSnapshotStore:
+    """
+    Prefilled prefix caches saved as safetensors files (memory-mapped on
+    load) so a restart can skip prefilling the agents' system prompts.
+
+    A snapshot is named by the hash of the model fingerprint and the prefix
+    token ids, so an edited prompt, chat template or checkpoint simply misses.
+    The fingerprint is also stored in the file and checked on load. Snapshots
+    of the same checkpoint at another revision or setting are stale and
+    removed when a new one is written.
+    """
+    directory: str
+
+    _fingerprints: Dict[int, Dict[str, str]] = field(default_factory=dict, init=False, repr=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False)
+
+    def __post_init__(self):
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _fingerprint(self, hf_model: Any) -> Dict[str, str]:
+        with self._lock:
+            fp = self._fingerprints.get(id(hf_model))
+            if fp is None:
+                fp = self._fingerprints[id(hf_model)] = model_fingerprint(hf_model)
+            return fp
+
+    def _meta(self, hf_model: Any, prefix_ids: List[int]) -> Dict[str, str]:
+        prefix = hashlib.sha256(json.dumps(prefix_ids).encode()).hexdigest()
+        return {"format": str(SNAPSHOT_FORMAT), **self._fingerprint(hf_model),
+                "prefix": prefix, "tokens": str(len(prefix_ids))}
+
+    def _path(self, meta: Dict[str, str]) -> str:
+        key = hashlib.sha256(json.dumps(meta, sort_keys=True).encode()).hexdigest()
+        return os.path.join(self.directory, f"{key}.safetensors")
+
+    def load(self, hf_model: Any, prefix_ids: List[int]) -> Optional[Any]:
+        """
+        The cache for `prefix_ids` rebuilt from disk, or None if there is no
+        valid snapshot.
+        """
+        from safetensors import safe_open
+
+        meta = self._meta(hf_model, prefix_ids)
+        path = self._path(meta)
+        if not os.path.exists(path):
+            return None
+        try:
+            with safe_open(path, framework="pt", device=str(hf_model.device)) as f:
+                if f.metadata() != meta:
+                    raise ValueError("fingerprint mismatch")
+                cache = new_dynamic_cache(hf_model)
+                n_layers = int(len(f.keys()) / 2)
+                for i in range(n_layers):
+                    # replaying the update reproduces the state a prefill leaves behind
+                    cache.update(f.get_tensor(f"k{i}"), f.get_tensor(f"v{i}"), i)
+        except Exception as e:
+            console.log(f"[yellow]Discarding stale KV snapshot {os.path.basename(path)}: {e}[/]")
+            self._remove(path)
+            return None
+        if cache.get_seq_length() != len(prefix_ids):
+            self._remove(path)
+            return None
+        return cache
+
+    def save(self, hf_model: Any, prefix_ids: List[int], cache: Any):
+        from safetensors.torch import save_file
+
+        meta = self._meta(hf_model, prefix_ids)
+        tensors = {}
+        for i, (k, v) in enumerate(layer_states(cache)):
+            tensors[f"k{i}"] = k.detach().contiguous().cpu()
+            tensors[f"v{i}"] = v.detach().contiguous().cpu()
+        path = self._path(meta)
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        os.close(fd)
+        try:
+            save_file(tensors, tmp, metadata=meta)
+            os.replace(tmp, path)
+        except Exception as e:
+            console.log(f"[yellow]Could not write KV snapshot: {e}[/]")
+            self._remove(tmp)
+            return
+        self._prune(meta, keep=path)
+
+    def _prune(self, meta: Dict[str, str], keep: str):
+        """
+        Remove snapshots of the same checkpoint made by another revision,
+        dtype, quantization or library version.
+        """
+        from safetensors import safe_open
+
+        current = {k: meta[k] for k in meta if k not in ("prefix", "tokens")}
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if not name.endswith(".safetensors") or path == keep:
+                continue
+            try:
+                with safe_open(path, framework="pt") as f:
+                    other = f.metadata() or {}
+            except Exception:
+                self._remove(path)
+                continue
+            if other.get("model") == meta["model"] and any(other.get(k) != v for k, v in current.items()):
+                self._remove(path)
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -0,0 +1,93 @@
+import os
+import sqlite3
+import threading
+import zlib
+from urllib.parse import quote
+from dataclasses import dataclass, field
+from typing import Optional
+
+from rich.console import Console
+
+console = Console()
+
+# bump when the key layout or entry format changes
+PACK_FORMAT = 1
+
+_SEP = "\x1f"
+
+
+@dataclass
+class LessonPack:
+    """
+    Pre-generated agent replies for whole lessons, stored in one SQLite
+    file. Entries are keyed by (topic, objective, call, *args), e.g.
+    (topic, objective, "generate_quiz_action", objective), and hold the
+    zlib-compressed JSON reply the agent would otherwise generate.
+
+    `model_id` is recorded when a pack is built; serving a pack built by a
+    different model only warns, since the replies are still well formed.
+    A `read_only` pack must exist and is never written to.
+    """
+    path: str
+    model_id: str = ""
+    read_only: bool = False
+
+    _db: sqlite3.Connection = field(default=None, init=False, repr=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False)
+
+    def __post_init__(self):
+        if self.read_only:
+            # a plain connect would create an empty pack at a mistyped path
+            if not os.path.isfile(self.path):
+                raise FileNotFoundError(f"Lesson pack {self.path} does not exist")
+            uri = f"file:{quote(os.path.abspath(self.path))}?mode=ro"
+            self._db = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        else:
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            with self._db:
+                self._db.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)")
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, body BLOB) WITHOUT ROWID"
+                )
+        try:
+            meta = dict(self._db.execute("SELECT name, value FROM meta"))
+        except sqlite3.DatabaseError as e:
+            raise ValueError(f"{self.path} is not a lesson pack: {e}") from e
+        if meta and int(meta.get("format", 0)) != PACK_FORMAT:
+            raise ValueError(f"{self.path} is a format {meta.get('format')} lesson pack, "
+                             f"expected format {PACK_FORMAT}")
+        built_by = meta.get("model_id")
+        if built_by and self.model_id and built_by != self.model_id:
+            console.print(f"[yellow]Lesson pack {self.path} was built with {built_by}, "
+                          f"serving it with {self.model_id}.[/]")
+
+    @staticmethod
+    def key(*parts: str) -> str:
+        return _SEP.join(str(p) for p in parts)
+
+    def get(self, *parts: str) -> Optional[str]:
+        with self._lock:
+            row = self._db.execute("SELECT body FROM entries WHERE key = ?", (self.key(*parts),)).fetchone()
+        if row is None:
+            return None
+        return zlib.decompress(row[0]).decode("utf-8")
+
+    def put(self, parts, text: str):
+        body = zlib.compress(text.encode("utf-8"), 9)
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO meta (name, value) VALUES ('format', ?), ('model_id', ?)",
+                (str(PACK_FORMAT), self.model_id),
+            )
+            self._db.execute(
+                "INSERT OR REPLACE INTO entries (key, body) VALUES (?, ?)",
+                (self.key(*parts), body),
+            )
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
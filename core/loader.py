@@ -0,0 +1,48 @@
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Optional
+
+
+class Deferred:
+    """
+    Stand-in for a value still being produced in the background (e.g. the
+    model while its weights load). Attribute access and calls block until
+    the value is ready and then go to the real object; `resolve` swaps a
+    Deferred for its value. A failed load re-raises on first use.
+    """
+
+    def __init__(self, future: Future, index: Optional[int] = None):
+        self._future = future
+        self._index = index
+
+    def result(self) -> Any:
+        value = self._future.result()
+        return value if self._index is None else value[self._index]
+
+    def __getattr__(self, name: str) -> Any:
+        if name in ("_future", "_index"):
+            raise AttributeError(name)
+        return getattr(self.result(), name)
+
+    def __call__(self, *args, **kwargs) -> Any:
+        return self.result()(*args, **kwargs)
+
+
+def resolve(value: Any) -> Any:
+    return value.result() if isinstance(value, Deferred) else value
+
+
+def load_in_background(fn: Callable[..., Any], *args, **kwargs) -> Future:
+    """
+    Run `fn(*args, **kwargs)` on a daemon thread and return its Future.
+    """
+    future: Future = Future()
+
+    def _run():
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=_run, name="model-loader", daemon=True).start()
+    return future
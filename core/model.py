@@ -1,5 +1,8 @@
-from dataclasses import dataclass
-from typing import Any, Dict, List, Tuple
+import threading
+import time
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+from typing import Any, Callable, ContextManager, Dict, Iterator, List, Optional, Tuple
 
 import torch
 from rich.console import Console
@@ -7,36 +10,81 @@ from transformers import (
     AutoModelForCausalLM,
     AutoProcessor,
     AutoTokenizer,
+    LogitsProcessorList,
+    StoppingCriteria,
+    StoppingCriteriaList,
 )
 
+from core.json_decoding import (
+    EnvelopeLogitsProcessor,
+    JSONObjectStoppingCriteria,
+    token_texts,
+)
+from core.utilities import redact_payload, trim_after_json_object
+from core.assisted import DecodeStats, forward_counter
+from core.compiled_decode import CompiledDecoder
+from core.loader import resolve
+from core.timing import startup
+from core.telemetry import telemetry
+from core.scheduler import GenerationScheduler
+from core.response_cache import ResponseCache
+from core.kv_cache import LiveCache, PrefixCache, common_prefix_len, new_dynamic_cache
+from core.kv_snapshot import model_fingerprint
+
 
 console = Console()
 
 
-def load_hf_model_and_processor(
-    model_id: str,
-    *,
-    device_map: str = "auto",
-    dtype: torch.dtype = torch.bfloat16,
-    trust_remote_code: bool = True,
-) -> Tuple[Any, Any]:
-    """
-    Load a text-generation chat model and its processor/tokeinzer in a backend-agnostic way.
-    Works with:
-        - Gemma3
-        - OSS
+# weight-only quantization modes for --quantize
+QUANTIZE_MODES = ("int8", "int4")
 
-    Returns:
-        (hf_model, processor_or_tokenizer)
+
+def _torchao_config(quantize: str) -> Any:
+    """
+    TorchAoConfig for `quantize`, or None when torchao is not installed.
     """
-    console.print(f"[bold green]Loading model:[/bold green] {model_id}")
+    try:
+        from torchao.quantization import Int4WeightOnlyConfig, Int8WeightOnlyConfig
+    except ImportError:
+        return None
+    from transformers import TorchAoConfig
+
+    if quantize == "int8":
+        return TorchAoConfig(Int8WeightOnlyConfig())
+    try:
+        # packed for the CPU int4 kernels
+        config = Int4WeightOnlyConfig(group_size=128, int4_packing_format="opaque")
+    except TypeError:
+        from torchao.dtypes import Int4CPULayout
+
+        config = Int4WeightOnlyConfig(group_size=128, layout=Int4CPULayout())
+    return TorchAoConfig(config)
+
+
+def _load_model(model_id: str, device_map: str, dtype: torch.dtype, trust_remote_code: bool,
+                quantize: Optional[str] = None, local_files_only: bool = False) -> Any:
+    extra: Dict[str, Any] = {"local_files_only": local_files_only}
+    dynamic_int8 = False
+    if quantize is not None:
+        if quantize not in QUANTIZE_MODES:
+            raise ValueError(f"Unknown quantization mode {quantize!r}, expected one of {QUANTIZE_MODES}")
+        config = _torchao_config(quantize)
+        if config is not None:
+            extra["quantization_config"] = config
+        elif quantize == "int8":
+            # loaded in bf16 and quantized layer by layer, see quantize_dynamic_int8
+            console.print("[yellow]torchao not installed; using torch dynamic int8 quantization.[/]")
+            dynamic_int8 = True
+        else:
+            raise RuntimeError("4-bit weight-only quantization needs torchao (pip install torchao).")
 
     try:
         hf_model = AutoModelForCausalLM.from_pretrained(
             model_id,
             device_map=device_map,
             torch_dtype=dtype,
-            trust_remote_code=trust_remote_code
+            trust_remote_code=trust_remote_code,
+            **extra,
         ).eval()
     except Exception as e:
         if "gemma-3" in model_id:
@@ -48,14 +96,73 @@ def load_hf_model_and_processor(
                 device_map=device_map,
                 torch_dtype=dtype,
                 trust_remote_code=trust_remote_code,
+                **extra,
             ).eval()
         else:
             raise e
 
+    if dynamic_int8:
+        hf_model = quantize_dynamic_int8(hf_model)
+    return hf_model
+
+
+def quantize_dynamic_int8(hf_model: Any) -> Any:
+    """
+    Swap every nn.Linear of a CPU model for torch's dynamically quantized
+    int8 version (int8 weights, activations quantized per batch), in place.
+    Those kernels take float32, so each layer is upcast just before it is
+    quantized and only the remaining (small) weights end up in float32:
+    memory peaks at the loaded model plus one float32 layer, not at a
+    float32 copy of the whole checkpoint.
+    """
+    from torch.ao.nn.quantized.dynamic import Linear as DynamicLinear
+    from torch.ao.quantization import default_dynamic_qconfig
+
+    linears = [(name, m) for name, m in hf_model.named_modules() if type(m) is torch.nn.Linear]
+    for name, linear in linears:
+        parent_name, _, attr = name.rpartition(".")
+        parent = hf_model.get_submodule(parent_name)
+        linear.float()
+        linear.qconfig = default_dynamic_qconfig
+        setattr(parent, attr, DynamicLinear.from_float(linear))
+        # free the float weights before the next layer is upcast
+        linear.weight = linear.bias = None
+    del linears
+    return hf_model.float()
+
+
+def load_hf_model_and_processor(
+    model_id: str,
+    *,
+    device_map: str = "auto",
+    dtype: torch.dtype = torch.bfloat16,
+    trust_remote_code: bool = True,
+    quantize: Optional[str] = None,
+    local_files_only: bool = False,
+    verbose: bool = True,
+) -> Tuple[Any, Any]:
+    """
+    Load a text-generation chat model and its processor/tokeinzer in a backend-agnostic way.
+    Works with:
+        - Gemma3
+        - OSS
+
+    `quantize` ("int8" or "int4") loads weight-only quantized weights for
+    CPU inference, through torchao when it is installed. `local_files_only`
+    loads from the local cache without any hub requests.
+
+    Returns:
+        (hf_model, processor_or_tokenizer)
+    """
+    if verbose:
+        console.print(f"[bold green]Loading model:[/bold green] {model_id}" + (f" ({quantize})" if quantize else ""))
+    hf_model = _load_model(model_id, device_map, dtype, trust_remote_code, quantize, local_files_only)
+
     try:
         processor = AutoProcessor.from_pretrained(
             model_id,
             trust_remote_code=trust_remote_code,
+            local_files_only=local_files_only,
         )
         if not hasattr(processor, "apply_chat_template"):
             raise OSError("Processor lacks chat template; falling back to tokenizer.")
@@ -63,6 +170,7 @@ def load_hf_model_and_processor(
         processor = AutoTokenizer.from_pretrained(
             model_id,
             trust_remote_code=trust_remote_code,
+            local_files_only=local_files_only,
         )
 
     try:
@@ -74,6 +182,67 @@ def load_hf_model_and_processor(
     return hf_model, processor
 
 
+def load_draft_model(
+    model_id: str,
+    *,
+    device_map: str = "auto",
+    dtype: torch.dtype = torch.bfloat16,
+    trust_remote_code: bool = True,
+    quantize: Optional[str] = None,
+    local_files_only: bool = False,
+    verbose: bool = True,
+) -> Any:
+    """
+    Load a small model of the same family to draft tokens for assisted
+    generation (e.g. gemma-3-1b-it for gemma-3-27b-it).
+    """
+    if verbose:
+        console.print(f"[bold green]Loading draft model:[/bold green] {model_id}")
+    return _load_model(model_id, device_map, dtype, trust_remote_code, quantize, local_files_only)
+
+
+class CancelledCriteria(StoppingCriteria):
+    """
+    Stops generation as soon as `event` is set (e.g. a discarded prefetch).
+    """
+
+    def __init__(self, event: threading.Event):
+        self.event = event
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        return torch.full((input_ids.shape[0],), self.event.is_set(), dtype=torch.bool, device=input_ids.device)
+
+
+class TokenClock(StoppingCriteria):
+    """
+    Never stops generation; notes when the first new token arrived, which
+    splits a call's time into prefill and decode.
+    """
+
+    def __init__(self):
+        self.first: Optional[float] = None
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        if self.first is None:
+            self.first = time.perf_counter()
+        return torch.zeros((input_ids.shape[0],), dtype=torch.bool, device=input_ids.device)
+
+
+def _decode_timing(stopping: Optional[StoppingCriteriaList], start: float, tokens: int) -> Dict[str, Any]:
+    """
+    Generated tokens and, when a TokenClock ran, prefill time (including
+    any wait in the scheduler) and the decode rate after the first token.
+    """
+    timing: Dict[str, Any] = {"generated_tokens": tokens}
+    clock = next((c for c in stopping or [] if isinstance(c, TokenClock)), None)
+    if clock is not None and clock.first is not None:
+        decode_seconds = time.perf_counter() - clock.first
+        timing.update(prefill=clock.first - start, decode_tokens=max(tokens - 1, 0), decode_seconds=decode_seconds)
+        if tokens > 1 and decode_seconds > 0:
+            timing["decode_tok_s"] = (tokens - 1) / decode_seconds
+    return timing
+
+
 def _as_string_messages(system_prompt: str, user_prompt: str) -> List[Dict[str, str]]:
     return [
         {"role": "system", "content": system_prompt},
@@ -87,40 +256,78 @@ class LLMClient:
     processor: Any
     system_prompt: str
     max_new_tokens: int
+    prefix_cache: Optional[PrefixCache] = None
+    incremental: bool = False
+    constrained_json: bool = False
+    # stop as soon as the reply's top-level JSON object closes
+    stop_at_json_end: bool = False
+    # batches non-streaming, non-incremental calls with other clients
+    scheduler: Optional[GenerationScheduler] = None
+    # on-disk cache of replies, keyed by model revision, prompts and settings
+    response_cache: Optional[ResponseCache] = None
+    # small model of the same family that drafts tokens for assisted generation
+    assistant_model: Any = None
+    # whose requests these are, for round-robin scheduling across learners
+    owner: Any = None
+    # static KV cache + torch.compile'd decoding, shared by the clients of one model
+    compiled: Optional[CompiledDecoder] = None
+    # payload fields left out of the console echo (the coder's reference solution)
+    hidden_fields: Tuple[str, ...] = ()
 
-    def _build_inputs(self, user_prompt: str) -> Any:
-        """
-        Create model-ready inputs from (system, user) messages.
-        """
-        rich_messages = [
-            {"role": "system", "content": [{"type": "text", "text": self.system_prompt}]},
-            {"role": "user",   "content": [{"type": "text", "text": user_prompt}]},
-        ]
-
-        simple_messages = _as_string_messages(self.system_prompt, user_prompt)
+    # chat-template path that worked for this processor: "rich", "simple" or "plain"
+    _template: Optional[str] = field(default=None, init=False, repr=False)
+    _prefix_ids: Optional[List[int]] = field(default=None, init=False, repr=False)
+    _fingerprint: Optional[Dict[str, str]] = field(default=None, init=False, repr=False)
+    last_ttft: Optional[float] = field(default=None, init=False, repr=False)
+    # steps where constrained decoding overrode the model in the last call
+    last_interventions: int = field(default=0, init=False, repr=False)
+    # token counts and prefill/decode split of the last model call, for telemetry
+    last_timing: Dict[str, Any] = field(default_factory=dict, init=False, repr=False)
+    stats: DecodeStats = field(default_factory=DecodeStats, init=False, repr=False)
 
-        def _to_model_inputs(msgs):
-            return self.processor.apply_chat_template(
-                msgs,
-                add_generation_prompt=True,
-                tokenize=True,
-                return_dict=True,
-                return_tensors="pt",
-            )
-
-        raw = None
-        if hasattr(self.processor, "apply_chat_template"):
-            try:
-                raw = _to_model_inputs(rich_messages)
-            except Exception:
-                raw = _to_model_inputs(simple_messages)
-        else:
+    def _render(self, template: str, user_prompt: str) -> Any:
+        if template == "plain":
             text = f"{self.system_prompt}\n\n{user_prompt}\n"
-            raw = self.processor(
+            return self.processor(
                 text,
                 return_tensors="pt",
             )
 
+        if template == "rich":
+            msgs = [
+                {"role": "system", "content": [{"type": "text", "text": self.system_prompt}]},
+                {"role": "user",   "content": [{"type": "text", "text": user_prompt}]},
+            ]
+        else:
+            msgs = _as_string_messages(self.system_prompt, user_prompt)
+
+        return self.processor.apply_chat_template(
+            msgs,
+            add_generation_prompt=True,
+            tokenize=True,
+            return_dict=True,
+            return_tensors="pt",
+        )
+
+    def _build_inputs(self, user_prompt: str) -> Any:
+        """
+        Create model-ready inputs from (system, user) messages.
+        The first call probes rich vs. simple chat messages and remembers
+        whichever the processor accepts.
+        """
+        raw = None
+        if self._template is None:
+            if not hasattr(self.processor, "apply_chat_template"):
+                self._template = "plain"
+            else:
+                try:
+                    raw = self._render("rich", user_prompt)
+                    self._template = "rich"
+                except Exception:
+                    self._template = "simple"
+        if raw is None:
+            raw = self._render(self._template, user_prompt)
+
         inputs = {}
         for k, v in raw.items():
             if isinstance(v, torch.Tensor):
@@ -129,7 +336,332 @@ class LLMClient:
                 inputs[k] = v
         return inputs
 
-    def generate(self, user_prompt: str) -> str:
+    def _resolve_handles(self):
+        """
+        Swap in the real model and processor once they have loaded (main.py
+        hands out Deferred stand-ins while loading in the background).
+        """
+        self.hf_model = resolve(self.hf_model)
+        self.processor = resolve(self.processor)
+        self.assistant_model = resolve(self.assistant_model)
+
+    def count_tokens(self, text: str) -> int:
+        """
+        Number of model tokens in `text`, without special tokens.
+        """
+        self._resolve_handles()
+        tokenizer = getattr(self.processor, "tokenizer", self.processor)
+        return len(tokenizer.encode(text, add_special_tokens=False))
+
+    def _system_prefix(self) -> List[int]:
+        """
+        Token ids shared by every request from this client, i.e. everything
+        the chat template emits before the user prompt.
+        """
+        if self._prefix_ids is None:
+            a = self._build_inputs("a")["input_ids"][0].tolist()
+            b = self._build_inputs("b")["input_ids"][0].tolist()
+            self._prefix_ids = a[:common_prefix_len(a, b)]
+        return self._prefix_ids
+
+    def warm_prefix(self):
+        """
+        Prefill (or load from a snapshot) this client's system-prompt cache
+        ahead of its first request.
+        """
+        self._resolve_handles()
+        if self.prefix_cache is not None:
+            self.prefix_cache.warm(self._system_prefix())
+
+    def _attach_prefix_cache(self, inputs: Dict[str, Any]):
+        """
+        Seed `inputs` with a copy of the prefilled system-prompt KV cache, so
+        `generate` only prefills the user prompt.
+        """
+        prefix = self._system_prefix()
+        ids = inputs["input_ids"][0].tolist()
+        if not prefix or len(prefix) >= len(ids) or ids[:len(prefix)] != prefix:
+            return
+        inputs["past_key_values"] = self.prefix_cache.lookup(prefix)
+
+    def _attach_live_cache(self, inputs: Dict[str, Any], live: LiveCache):
+        """
+        Seed `inputs` with the caller's cache from its previous turn, cropped
+        to the tokens still shared with this request. Falls back to the
+        system-prompt cache (or an empty one) when nothing can be reused.
+        """
+        cache = live.take(inputs["input_ids"][0].tolist())
+        if cache is None:
+            if self.prefix_cache is not None:
+                self._attach_prefix_cache(inputs)
+            cache = inputs.get("past_key_values")
+        if cache is None:
+            cache = new_dynamic_cache(self.hf_model)
+        inputs["past_key_values"] = cache
+
+    def _prepare_inputs(self, user_prompt: str, live: Optional[LiveCache]) -> Dict[str, Any]:
+        inputs = self._build_inputs(user_prompt)
+        # assisted generation from a seeded cache is not greedy-equivalent on
+        # sliding-window models, so it always prefills the whole prompt
+        if self.assistant_model is None:
+            if live is not None:
+                self._attach_live_cache(inputs, live)
+            elif self.prefix_cache is not None:
+                self._attach_prefix_cache(inputs)
+
+        cache = inputs.get("past_key_values")
+        telemetry.annotate(
+            prompt_tokens=inputs["input_ids"].shape[-1],
+            cached_tokens=cache.get_seq_length() if cache is not None else 0,
+        )
+        return inputs
+
+    def _eos_ids(self) -> List[int]:
+        eos = getattr(self.hf_model.generation_config, "eos_token_id", None)
+        if eos is None:
+            eos = getattr(self.processor, "eos_token_id", None)
+        if eos is None:
+            return []
+        return list(eos) if isinstance(eos, (list, tuple)) else [eos]
+
+    def _envelope_processor(self, inputs: Dict[str, Any],
+                            allowed_actions: Optional[List[str]]) -> Optional[EnvelopeLogitsProcessor]:
+        if not self.constrained_json or not allowed_actions:
+            return None
+        tokenizer = getattr(self.processor, "tokenizer", self.processor)
+        return EnvelopeLogitsProcessor(
+            token_texts(tokenizer),
+            actions=allowed_actions,
+            prompt_len=inputs["input_ids"].shape[-1],
+            eos_ids=self._eos_ids(),
+            max_new_tokens=self.max_new_tokens,
+        )
+
+    def _decoding_hooks(self, inputs: Dict[str, Any], allowed_actions: Optional[List[str]],
+                        cancel: Optional[threading.Event] = None
+                        ) -> Tuple[Optional[EnvelopeLogitsProcessor], Optional[StoppingCriteriaList]]:
+        envelope = self._envelope_processor(inputs, allowed_actions)
+        criteria = []
+        if self.stop_at_json_end:
+            tokenizer = getattr(self.processor, "tokenizer", self.processor)
+            criteria.append(JSONObjectStoppingCriteria(token_texts(tokenizer), inputs["input_ids"].shape[-1]))
+        if cancel is not None:
+            criteria.append(CancelledCriteria(cancel))
+        if telemetry.enabled:
+            criteria.append(TokenClock())
+        return envelope, StoppingCriteriaList(criteria) if criteria else None
+
+    def _generate_ids(self, inputs: Dict[str, Any],
+                      allowed_actions: Optional[List[str]] = None,
+                      cancel: Optional[threading.Event] = None, **kwargs) -> Any:
+        envelope, stopping = self._decoding_hooks(inputs, allowed_actions, cancel)
+        if envelope is not None:
+            kwargs["logits_processor"] = LogitsProcessorList([envelope])
+        if stopping is not None:
+            kwargs["stopping_criteria"] = stopping
+        if self.assistant_model is not None:
+            kwargs.update(self._assisted_kwargs())
+
+        target = forward_counter(self.hf_model)
+        draft = forward_counter(self.assistant_model) if self.assistant_model is not None else None
+        rounds, drafted = target.count, draft.count if draft is not None else 0
+        start = time.perf_counter()
+        with self._compiled(inputs) as extra, torch.inference_mode():
+            out = self.hf_model.generate(
+                **inputs,
+                max_new_tokens=self.max_new_tokens,
+                do_sample=False,
+                **(extra or {}),
+                **kwargs,
+            )
+        tokens = out.shape[-1] - inputs["input_ids"].shape[-1]
+        self.last_timing = _decode_timing(stopping, start, tokens)
+        self.stats.record(
+            tokens=tokens,
+            seconds=time.perf_counter() - start,
+            rounds=target.count - rounds if draft is not None else 0,
+            drafted=draft.count - drafted if draft is not None else 0,
+        )
+        self.last_interventions = envelope.interventions if envelope is not None else 0
+        return out
+
+    def _compiled(self, inputs: Dict[str, Any]) -> ContextManager[Optional[Dict[str, Any]]]:
+        """
+        Move `inputs` onto the compiled decoder's static cache, when there is
+        one and this call can use it. Yields extra `generate` kwargs or None.
+        """
+        # live caches outlive the call, and assisted generation brings its own cache
+        if self.compiled is None or self.incremental or self.assistant_model is not None:
+            return nullcontext()
+        return self.compiled.prepare(inputs, self.max_new_tokens)
+
+    def _assisted_kwargs(self) -> Dict[str, Any]:
+        kwargs: Dict[str, Any] = {"assistant_model": self.assistant_model}
+        vocab = self.hf_model.config.get_text_config().vocab_size
+        if self.assistant_model.config.get_text_config().vocab_size != vocab:
+            # same tokenizer, but the checkpoints pad their embeddings differently
+            tokenizer = getattr(self.processor, "tokenizer", self.processor)
+            kwargs.update(tokenizer=tokenizer, assistant_tokenizer=tokenizer)
+        return kwargs
+
+    def _scheduled_ids(self, inputs: Dict[str, Any],
+                       allowed_actions: Optional[List[str]] = None,
+                       cancel: Optional[threading.Event] = None) -> List[int]:
+        """
+        Run the request through the shared scheduler so it can be batched
+        with concurrent requests from other clients. Returns generated ids.
+        """
+        envelope, stopping = self._decoding_hooks(inputs, allowed_actions, cancel)
+        start = time.perf_counter()
+        future = self.scheduler.submit(
+            inputs["input_ids"][0].tolist(),
+            self.max_new_tokens,
+            eos_ids=self._eos_ids(),
+            cache=inputs.get("past_key_values"),
+            logits_processor=envelope,
+            stopping_criteria=stopping,
+            owner=self.owner,
+        )
+        gen_ids = future.result()
+        self.last_timing = _decode_timing(stopping, start, len(gen_ids))
+        self.last_interventions = envelope.interventions if envelope is not None else 0
+        return gen_ids
+
+    def stream(self, user_prompt: str, live: Optional[LiveCache] = None,
+               allowed_actions: Optional[List[str]] = None,
+               cancel: Optional[threading.Event] = None) -> Iterator[str]:
+        """
+        Like `generate`, but yield decoded text chunks as soon as the model
+        produces them. Time to first token is logged and kept in `last_ttft`.
+        """
+        from transformers import TextIteratorStreamer
+
+        self._resolve_handles()
+        start = time.perf_counter()
+        inputs = self._prepare_inputs(user_prompt, live)
+        streamer = TextIteratorStreamer(
+            self.processor,
+            skip_prompt=True,
+            skip_special_tokens=True,
+        )
+        result: Dict[str, Any] = {}
+
+        def _run():
+            try:
+                result["out"] = self._generate_ids(inputs, allowed_actions, cancel, streamer=streamer)
+            except BaseException as e:
+                result["error"] = e
+                streamer.end()
+
+        worker = threading.Thread(target=_run, daemon=True)
+        worker.start()
+
+        ttft = None
+        for chunk in streamer:
+            if not chunk:
+                continue
+            if ttft is None:
+                ttft = time.perf_counter() - start
+                startup.mark("first token")
+            yield chunk
+        worker.join()
+
+        if "error" in result:
+            raise result["error"]
+        if live is not None:
+            live.store(result["out"][0].tolist(), inputs["past_key_values"])
+
+        self.last_ttft = ttft
+        total = time.perf_counter() - start
+        if ttft is not None:
+            console.log(f"[dim]⏱  first token after {ttft:.2f}s, done after {total:.2f}s[/]")
+
+    def _model_id(self) -> str:
+        return getattr(self.hf_model, "name_or_path", "") or getattr(self.hf_model.config, "_name_or_path", "")
+
+    def _cache_key(self, user_prompt: str, allowed_actions: Optional[List[str]]) -> str:
+        """
+        Everything that determines a greedy reply, including the model
+        revision, dtype and quantization.
+        """
+        if self._fingerprint is None:
+            self._fingerprint = model_fingerprint(self.hf_model)
+        return ResponseCache.key(
+            model=self._fingerprint,
+            system_prompt=self.system_prompt,
+            prompt=user_prompt,
+            max_new_tokens=self.max_new_tokens,
+            allowed_actions=allowed_actions if self.constrained_json else None,
+            stop_at_json_end=self.stop_at_json_end,
+        )
+
+    def generate(
+        self,
+        user_prompt: str,
+        live: Optional[LiveCache] = None,
+        on_text: Optional[Callable[[str], None]] = None,
+        allowed_actions: Optional[List[str]] = None,
+        quiet: bool = False,
+        cancel: Optional[threading.Event] = None,
+    ) -> str:
+        """
+        Generate a reply to `user_prompt`. When `live` is given, its cache is
+        reused and refreshed with this turn's tokens. When `on_text` is given,
+        the reply is streamed and `on_text` receives the text so far after
+        every chunk. With `constrained_json`, `allowed_actions` restricts the
+        reply to a valid action envelope naming one of those actions.
+        `quiet` suppresses console output, for calls made in the background,
+        and setting `cancel` stops generation early.
+        """
+        with telemetry.span("llm.generate", "llm", owner=self.owner, streamed=on_text is not None):
+            self._resolve_handles()
+            self.last_timing = {}
+            key = None
+            if self.response_cache is not None:
+                key = self._cache_key(user_prompt, allowed_actions)
+                cached = self.response_cache.get(key)
+                if cached is not None:
+                    self.last_interventions = 0
+                    telemetry.annotate(cached_reply=True)
+                    if on_text is not None:
+                        on_text(cached)
+                    if not quiet:
+                        self._echo(cached, "(cached)")
+                    return cached
+
+            decoded = self._generate_text(user_prompt, live, on_text, allowed_actions, quiet, cancel)
+            telemetry.annotate(**self.last_timing)
+            startup.mark("first reply")
+            if key is not None and not (cancel is not None and cancel.is_set()):
+                self.response_cache.put(key, decoded, meta={"model": self._model_id()})
+            return decoded
+
+    def _echo(self, decoded: str, note: str = ""):
+        label = "LLMClient.generate() output" + (f" {note}" if note else "")
+        console.print(f"[red]▶️  {label}:[/]\n", redact_payload(decoded, self.hidden_fields))
+
+    def _generate_text(
+        self,
+        user_prompt: str,
+        live: Optional[LiveCache] = None,
+        on_text: Optional[Callable[[str], None]] = None,
+        allowed_actions: Optional[List[str]] = None,
+        quiet: bool = False,
+        cancel: Optional[threading.Event] = None,
+    ) -> str:
+        if self.assistant_model is not None:
+            # nothing to reuse: assisted calls are never seeded (see _prepare_inputs)
+            live = None
+        if on_text is not None:
+            decoded = ""
+            for chunk in self.stream(user_prompt, live=live, allowed_actions=allowed_actions, cancel=cancel):
+                decoded += chunk
+                on_text(decoded)
+            if self.stop_at_json_end:
+                decoded = trim_after_json_object(decoded)
+            self._echo(decoded)
+            return decoded
+
         #input = [
         #    {"role": "system", "content": [{"type": "text", "text": self.system_prompt}]},
         #    {"role": "user", "content": [{"type": "text", "text": user_prompt}]}
@@ -137,36 +669,24 @@ class LLMClient:
         # DEBUG print
         #console.print("[blue]▶️  LLMClient.generate() input:[/]\n", input)
 
-        with console.status("Generating response...", spinner="dots"):
-            # tokenize & run
-            #raw = self.processor.apply_chat_template(
-            #    input,
-            #    add_generation_prompt=True,
-            #    tokenize=True,
-            #    return_dict=True,
-            #    return_tensors="pt"
-            #).to(self.hf_model.device, dtype=torch.bfloat16)
-            # )
-
-            # new for 1b model
-            #for k, v in raw.items():
-            #    if isinstance(v, torch.Tensor):
-            #        raw[k] = v.to(self.model.device, dtype=torch.bfloat16)
-            inputs = self._build_inputs(user_prompt)
-
-            # DEBUG print
-            console.print("[blue]▶️  LLMClient.generate() tokenized input:[/]\n", inputs)
-
-            input_len = inputs["input_ids"].shape[-1]
-            with torch.inference_mode():
-                out = self.hf_model.generate(
-                    **inputs,
-                    max_new_tokens=self.max_new_tokens,
-                    # cache_implementation="offloaded",
-                    do_sample=False
-                )
+        status = nullcontext() if quiet else console.status("Generating response...", spinner="dots")
+        with status:
+            inputs = self._prepare_inputs(user_prompt, live)
+
+            # assisted and compiled generation are single-sequence, so they bypass the scheduler
+            if (self.scheduler is not None and live is None
+                    and self.assistant_model is None and self.compiled is None):
+                gen_ids = self._scheduled_ids(inputs, allowed_actions, cancel)
+            else:
+                input_len = inputs["input_ids"].shape[-1]
+                out = self._generate_ids(inputs, allowed_actions, cancel)
+                if live is not None:
+                    live.store(out[0].tolist(), inputs["past_key_values"])
+                gen_ids = out[0][input_len:]
             # decode
-            gen_ids = out[0][input_len:]
             decoded = self.processor.decode(gen_ids, skip_special_tokens=True)
-            console.print("[red]▶️  LLMClient.generate() output:[/]\n", decoded)
+            if self.stop_at_json_end:
+                decoded = trim_after_json_object(decoded)
+            if not quiet:
+                self._echo(decoded)
             return decoded
@@ -1,6 +1,17 @@
 from dataclasses import dataclass
+from typing import Optional
+
+from core.resource_profile import ResourceProfile
 
 
 @dataclass
 class Observation:
     result: str
+    # set for shell commands
+    exit_code: Optional[int] = None
+    duration: Optional[float] = None
+    truncated: bool = False
+    stdout: str = ""
+    stderr: str = ""
+    # wall/CPU time, memory and hardware counters of a program run
+    profile: Optional[ResourceProfile] = None
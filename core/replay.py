@@ -0,0 +1,92 @@
+import json
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+from core.assisted import DecodeStats
+
+
+class ReplayExhausted(RuntimeError):
+    pass
+
+
+@dataclass
+class Recording:
+    """
+    Model replies per agent role ("session", "coder", ...), in the order the
+    role's client was asked for them.
+    """
+    replies: Dict[str, List[str]] = field(default_factory=dict)
+
+    @classmethod
+    def load(cls, path: str) -> "Recording":
+        with open(path) as f:
+            return cls(replies=json.load(f)["replies"])
+
+    def save(self, path: str):
+        with open(path, "w") as f:
+            json.dump({"replies": self.replies}, f, indent=2)
+
+
+@dataclass
+class ReplayClient:
+    """
+    Stands in for LLMClient: answers each `generate` with the next recorded
+    reply for its role, after `latency` seconds, without any model. Enough
+    of LLMClient for the agents and HistoryManager to run unchanged.
+    """
+    role: str
+    recording: Recording
+    latency: float = 0.0
+    system_prompt: str = ""
+    owner: Any = None
+
+    incremental: bool = field(default=False, init=False)
+    assistant_model: Any = field(default=None, init=False)
+    last_interventions: int = field(default=0, init=False)
+    stats: DecodeStats = field(default_factory=DecodeStats, init=False)
+    _next: int = field(default=0, init=False, repr=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False)
+
+    def generate(self, user_prompt: str, live: Any = None,
+                 on_text: Optional[Callable[[str], None]] = None,
+                 allowed_actions: Optional[List[str]] = None,
+                 quiet: bool = False, cancel: Optional[threading.Event] = None) -> str:
+        replies = self.recording.replies.get(self.role, [])
+        with self._lock:
+            if self._next >= len(replies):
+                raise ReplayExhausted(f"no recorded reply #{self._next + 1} for the {self.role} agent")
+            reply = replies[self._next]
+            self._next += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if on_text is not None:
+            on_text(reply)
+        return reply
+
+    def count_tokens(self, text: str) -> int:
+        return len(text.split())
+
+    def warm_prefix(self):
+        pass
+
+
+class RecordingClient:
+    """
+    Wraps a real client and appends each reply it generates to
+    `recording` under `role`, for a later ReplayClient.
+    """
+
+    def __init__(self, client: Any, role: str, recording: Recording):
+        self._client = client
+        self._role = role
+        self._recording = recording
+
+    def generate(self, user_prompt: str, *args, **kwargs) -> str:
+        reply = self._client.generate(user_prompt, *args, **kwargs)
+        self._recording.replies.setdefault(self._role, []).append(reply)
+        return reply
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._client, name)
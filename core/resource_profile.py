@@ -0,0 +1,130 @@
+import os
+import re
+import shlex
+import shutil
+import subprocess
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+
+# hardware counters recorded with `perf stat` when it works on this machine
+PERF_EVENTS = ("cycles", "instructions", "cache-references", "cache-misses")
+
+_perf_lock = threading.Lock()
+_perf_usable: Optional[bool] = None
+
+
+@dataclass
+class ResourceProfile:
+    """
+    What a command cost: wall and CPU time, peak memory and context
+    switches from the kernel's rusage, plus hardware counters when `perf`
+    was available.
+    """
+    wall: float
+    user: float
+    sys: float
+    max_rss_kb: int
+    voluntary_switches: int
+    involuntary_switches: int
+    counters: Dict[str, int] = field(default_factory=dict)
+
+    @classmethod
+    def from_rusage(cls, wall: float, usage) -> "ResourceProfile":
+        return cls(
+            wall=wall,
+            user=usage.ru_utime,
+            sys=usage.ru_stime,
+            max_rss_kb=usage.ru_maxrss,
+            voluntary_switches=usage.ru_nvcsw,
+            involuntary_switches=usage.ru_nivcsw,
+        )
+
+    def summary(self) -> str:
+        """
+        One line for the reviewer, e.g. "wall 1.20s, user 4.60s, sys 0.05s
+        (3.9 cores busy), max RSS 118 MB, ...".
+        """
+        cpu = self.user + self.sys
+        parts = [
+            f"wall {self.wall:.2f}s",
+            f"user {self.user:.2f}s",
+            f"sys {self.sys:.2f}s ({cpu / self.wall:.1f} cores busy)" if self.wall > 0 else f"sys {self.sys:.2f}s",
+            f"max RSS {self.max_rss_kb / 1024:.0f} MB",
+            f"context switches {self.voluntary_switches} voluntary / {self.involuntary_switches} involuntary",
+        ]
+        c = self.counters
+        if "cycles" in c:
+            parts.append(f"{c['cycles'] / 1e9:.2f} G cycles")
+        if c.get("cycles") and "instructions" in c:
+            parts.append(f"IPC {c['instructions'] / c['cycles']:.2f}")
+        if c.get("cache-references") and "cache-misses" in c:
+            parts.append(f"cache misses {100 * c['cache-misses'] / c['cache-references']:.1f}% "
+                         f"of {c['cache-references'] / 1e6:.1f} M references")
+        return "profile: " + ", ".join(parts)
+
+
+def perf_usable() -> bool:
+    """
+    Whether `perf stat` can count PERF_EVENTS here (it is often missing, or
+    blocked by perf_event_paranoid in containers). Checked once.
+    """
+    global _perf_usable
+    with _perf_lock:
+        if _perf_usable is None:
+            _perf_usable = False
+            if shutil.which("perf"):
+                try:
+                    proc = subprocess.run(
+                        ["perf", "stat", "-x", ",", "-e", ",".join(PERF_EVENTS), "--", "true"],
+                        capture_output=True, text=True, timeout=10,
+                    )
+                    _perf_usable = proc.returncode == 0 and "<not supported>" not in proc.stderr
+                except (OSError, subprocess.SubprocessError):
+                    pass
+        return _perf_usable
+
+
+def perf_command(script: str, output: str) -> str:
+    """
+    `script` run under `perf stat`, with CSV counts written to `output`.
+    """
+    return (f"exec perf stat -x , -o {shlex.quote(output)} -e {','.join(PERF_EVENTS)} "
+            f"-- /bin/sh -c {shlex.quote(script)}")
+
+
+def read_perf_counters(path: str) -> Dict[str, int]:
+    counters: Dict[str, int] = {}
+    try:
+        with open(path) as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return counters
+    for line in lines:
+        fields = line.split(",")
+        if line.startswith("#") or len(fields) < 3:
+            continue
+        value, event = fields[0], fields[2].split(":")[0]
+        if event in PERF_EVENTS and value.isdigit():
+            counters[event] = int(value)
+    return counters
+
+
+# `./prog`, `mpirun ... ./prog`, `OMP_NUM_THREADS=4 ./prog`, `time ./prog`
+_PROGRAM_RUN = re.compile(r"^(\w+=\S*\s+)*(time\s+)?(\./|(mpirun|mpiexec|srun)\s)")
+
+
+def is_program_run(cmd: str) -> bool:
+    """
+    Whether `cmd` runs a program built in the working directory (as opposed
+    to compiling, listing or printing files).
+    """
+    return _PROGRAM_RUN.match(cmd.strip()) is not None
+
+
+def wait_with_usage(pid: int):
+    """
+    os.wait4 for `pid`: (exit code, rusage of it and its waited-for children).
+    """
+    _, status, usage = os.wait4(pid, 0)
+    return os.waitstatus_to_exitcode(status), usage
@@ -0,0 +1,97 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional
+
+from rich.console import Console
+
+console = Console()
+
+# bump when the key layout or entry format changes
+CACHE_FORMAT = 1
+
+
+@dataclass
+class ResponseCache:
+    """
+    On-disk, content-addressed cache of greedy generations.
+
+    Entries are JSON files named by the SHA-256 of everything that
+    determines the output (model id and revision, system prompt, prompt,
+    decoding settings). Reads refresh an entry's mtime; once the directory
+    grows past `max_bytes` the least recently used entries are evicted.
+    """
+    directory: str
+    max_bytes: int = 256 * 1024 * 1024
+
+    hits: int = field(default=0, init=False)
+    misses: int = field(default=0, init=False)
+    _size: int = field(default=0, init=False, repr=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False)
+
+    def __post_init__(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._size = sum(os.path.getsize(p) for p in self._entries())
+
+    def _entries(self):
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(".json"):
+                    yield os.path.join(root, name)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    @staticmethod
+    def key(**parts: Any) -> str:
+        blob = json.dumps({"format": CACHE_FORMAT, **parts}, sort_keys=True, default=str)
+        return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        path = self._path(key)
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return entry["text"]
+
+    def put(self, key: str, text: str, meta: Optional[Dict[str, Any]] = None):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = json.dumps({"text": text, "meta": meta or {}})
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            f.write(data)
+        old = os.path.getsize(path) if os.path.exists(path) else 0
+        os.replace(tmp, path)
+        with self._lock:
+            self._size += os.path.getsize(path) - old
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        entries = sorted(self._entries(), key=lambda p: os.path.getmtime(p))
+        for path in entries:
+            if self._size <= self.max_bytes * 0.9:
+                break
+            try:
+                size = os.path.getsize(path)
+                os.remove(path)
+            except OSError:
+                continue
+            self._size -= size
+
+    def stats(self) -> str:
+        total = self.hits + self.misses
+        rate = 100.0 * self.hits / total if total else 0.0
+        return (f"response cache: {self.hits} hits, {self.misses} misses ({rate:.0f}% hit rate), "
+                f"{self._size / 1e6:.1f} MB on disk")
@@ -0,0 +1,176 @@
+import difflib
+import os
+import re
+import shlex
+import shutil
+from dataclasses import dataclass, field
+from typing import Callable, List, Optional
+
+from rich.console import Console
+from rich.panel import Panel
+from rich.syntax import Syntax
+
+from core.utilities import ShellResult
+
+console = Console()
+
+# ranks used to run MPI programs during a review
+REVIEW_RANKS = 2
+# numbers in program output, compared with a tolerance (timings always differ)
+_NUMBER = re.compile(r"[-+]?(?:\d+\.\d*|\.\d+|\d+)(?:[eE][-+]?\d+)?")
+
+
+@dataclass
+class Toolchain:
+    compiler: str
+    flags: List[str]
+    libs: List[str] = field(default_factory=list)
+    openmp: bool = False
+    # run through mpirun
+    mpi: bool = False
+
+    def compile_cmd(self, source: str, binary: str) -> str:
+        return shlex.join([self.compiler, *self.flags, source, "-o", binary, *self.libs])
+
+    def run_cmd(self, binary: str, ranks: int = REVIEW_RANKS) -> str:
+        launcher = ["mpirun", "-np", str(ranks)] if self.mpi else []
+        return shlex.join([*launcher, binary if os.path.isabs(binary) else f"./{binary}"])
+
+
+def pick_toolchain(file_name: str, source: str) -> Optional[Toolchain]:
+    """
+    Compiler and flags for a lesson file, from its extension and the
+    programming models its includes reveal. None for other languages.
+    """
+    ext = os.path.splitext(file_name)[1].lower()
+    mpi = re.search(r"#\s*include\s*[<\"]mpi\.h[>\"]", source) is not None
+    openmp = re.search(r"#\s*include\s*[<\"]omp\.h[>\"]|#\s*pragma\s+omp", source) is not None
+
+    if ext == ".cu":
+        flags = ["-O2"] + (["-Xcompiler", "-fopenmp"] if openmp else [])
+        return Toolchain("nvcc", flags, openmp=openmp, mpi=mpi)
+    if ext == ".cpp" and re.search(r"#\s*include\s*[<\"](sycl/sycl\.hpp|CL/sycl\.hpp)[>\"]", source):
+        compiler = "icpx" if shutil.which("icpx") or not shutil.which("acpp") else "acpp"
+        flags = ["-fsycl", "-O2"] if compiler == "icpx" else ["-O2"]
+        return Toolchain(compiler, flags, openmp=openmp, mpi=mpi)
+    if ext in (".cpp", ".cc", ".cxx"):
+        flags = ["-O2", "-std=c++17"] + (["-fopenmp"] if openmp else [])
+        return Toolchain("mpicxx" if mpi else "g++", flags, openmp=openmp, mpi=mpi)
+    if ext == ".c":
+        flags = ["-O2"] + (["-fopenmp"] if openmp else [])
+        return Toolchain("mpicc" if mpi else "gcc", flags, libs=["-lm"], openmp=openmp, mpi=mpi)
+    return None
+
+
+def compare_outputs(learner: str, reference: str, rel_tol: float = 1e-6) -> str:
+    """
+    How the learner's program output compares with the reference run.
+    """
+    if learner.strip() == reference.strip():
+        return "identical to the reference output"
+    a, b = learner.strip().splitlines(), reference.strip().splitlines()
+    if len(a) == len(b) and all(_NUMBER.sub("#", x) == _NUMBER.sub("#", y) for x, y in zip(a, b)):
+        differing = [
+            i + 1 for i, (x, y) in enumerate(zip(a, b))
+            if any(abs(float(p) - float(q)) > rel_tol * max(abs(float(p)), abs(float(q)), 1e-12)
+                   for p, q in zip(_NUMBER.findall(x), _NUMBER.findall(y)))
+        ]
+        if not differing:
+            return "identical to the reference output up to rounding"
+        return (f"same text as the reference output, but numbers differ on lines {differing[:10]} "
+                "(expected for timings, not for results)")
+    diff = "\n".join(difflib.unified_diff(b, a, "reference output", "learner output", lineterm="", n=1))
+    return "different from the reference output:\n" + _clip(diff, 60)
+
+
+def _clip(text: str, max_lines: int) -> str:
+    lines = text.splitlines()
+    if len(lines) <= max_lines:
+        return text
+    return "\n".join(lines[:max_lines] + [f"… [{len(lines) - max_lines} more lines]"])
+
+
+def _step(title: str, cmd: str, result: ShellResult) -> str:
+    return f"## {title}: `{cmd}`\n{result.summary()}"
+
+
+@dataclass
+class ReviewPipeline:
+    """
+    The mechanical part of a code review, without the model: diff the
+    learner's file against the original, compile it with the toolchain its
+    extension and includes call for, run it, and compare its output with a
+    run of the coder's reference solution. `report` collects everything into
+    one text for a single reviewer call.
+    """
+    run_shell: Callable[[str], ShellResult]
+    workdir: Optional[str] = None
+    # where the reference solutions are kept, away from the learner's files
+    reference_dir: Optional[str] = None
+
+    def _path(self, fname: str) -> str:
+        return os.path.join(self.workdir, fname) if self.workdir else fname
+
+    def _read(self, fname: str) -> Optional[str]:
+        try:
+            with open(self._path(fname)) as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def report(self, file_name: str) -> Optional[str]:
+        """
+        The review report for `file_name` (the original; the learner's copy
+        is `learner_<file_name>`), or None if its language is not supported.
+        """
+        file_name = os.path.basename(file_name)
+        if file_name.startswith("learner_"):
+            file_name = file_name[len("learner_"):]
+        learner_file = f"learner_{file_name}"
+        original = self._read(file_name)
+        learner = self._read(learner_file)
+        if learner is None:
+            return f"The learner's file {learner_file} does not exist."
+        toolchain = pick_toolchain(file_name, learner)
+        if toolchain is None:
+            return None
+
+        sections = [f"## Learner's file `{learner_file}`\n```\n{learner.rstrip()}\n```"]
+        if original is not None:
+            diff = "\n".join(difflib.unified_diff(
+                original.splitlines(), learner.splitlines(), file_name, learner_file, lineterm=""))
+            if diff:
+                console.print(Panel(Syntax(diff, "diff"), title="📝 Learner changes", expand=False))
+            sections.append(f"## Changes against `{file_name}`\n```diff\n{diff or '(none)'}\n```")
+
+        stem = os.path.splitext(file_name)[0]
+        binary = f"learner_{stem}"
+        cmd = toolchain.compile_cmd(learner_file, binary)
+        compiled = self.run_shell(cmd)
+        sections.append(_step("Compile", cmd, compiled))
+        if compiled.exit_code != 0:
+            sections.append("## Run\nSkipped: compilation failed.")
+            return "\n\n".join(sections)
+
+        cmd = toolchain.run_cmd(binary)
+        ran = self.run_shell(cmd)
+        sections.append(_step("Run", cmd, ran))
+
+        reference = self._reference_output(file_name, toolchain)
+        if reference is None:
+            sections.append("## Output check\nNo reference solution to compare against.")
+        elif ran.exit_code == 0 and not ran.timed_out:
+            sections.append("## Output check\nThe learner's output is " + compare_outputs(ran.stdout, reference))
+        return "\n\n".join(sections)
+
+    def _reference_output(self, file_name: str, toolchain: Toolchain) -> Optional[str]:
+        if self.reference_dir is None:
+            return None
+        reference_file = os.path.join(self.reference_dir, file_name)
+        if not os.path.isfile(reference_file):
+            return None
+        binary = os.path.join(self.reference_dir, os.path.splitext(file_name)[0])
+        if self.run_shell(toolchain.compile_cmd(reference_file, binary)).exit_code != 0:
+            return None
+        ran = self.run_shell(toolchain.run_cmd(binary))
+        return ran.stdout if ran.exit_code == 0 else None
@@ -0,0 +1,219 @@
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+import torch
+from rich.console import Console
+
+from core.kv_cache import layer_states
+
+console = Console()
+
+
+@dataclass
+class GenerationRequest:
+    input_ids: List[int]
+    max_new_tokens: int
+    eos_ids: List[int]
+    # prefilled KV state for a prefix of input_ids (e.g. a system-prompt copy)
+    cache: Any = None
+    logits_processor: Any = None
+    stopping_criteria: Any = None
+    # requests are taken round-robin across owners (e.g. learners)
+    owner: Any = None
+    future: Future = field(default_factory=Future)
+    generated: List[int] = field(default_factory=list)
+
+
+def _full_cache() -> Any:
+    # plain full-attention layers; sliding windows are enforced by the mask
+    from transformers import DynamicCache
+
+    return DynamicCache()
+
+
+@dataclass
+class GenerationScheduler:
+    """
+    Central greedy-decoding loop shared by every LLMClient on one hf_model.
+
+    Requests submitted from any thread are collected for `batch_window`
+    seconds (up to `max_batch_size`), prefilled one by one on top of their
+    own prefix cache, then decoded together in a single left-padded batch.
+    Each request keeps its own max_new_tokens, logits processor and stopping
+    criteria; finished sequences are dropped from the batch and their
+    futures resolved straight away. When several owners are waiting, each
+    batch takes their requests in turn, so no owner can crowd out the rest.
+    """
+    hf_model: Any
+    max_batch_size: int = 8
+    batch_window: float = 0.01
+
+    _queue: "queue.Queue[GenerationRequest]" = field(default_factory=queue.Queue, init=False, repr=False)
+    _worker: Optional[threading.Thread] = field(default=None, init=False, repr=False)
+    # waiting requests per owner, in round-robin order (worker thread only)
+    _pending: Dict[Any, Deque[GenerationRequest]] = field(default_factory=dict, init=False, repr=False)
+    batches: int = field(default=0, init=False)
+    batched_requests: int = field(default=0, init=False)
+
+    def submit(self, input_ids: List[int], max_new_tokens: int, eos_ids: List[int],
+               cache: Any = None, logits_processor: Any = None,
+               stopping_criteria: Any = None, owner: Any = None) -> Future:
+        """
+        Queue a request and return a Future for its generated token ids.
+        """
+        req = GenerationRequest(
+            input_ids=input_ids,
+            max_new_tokens=max_new_tokens,
+            eos_ids=eos_ids,
+            cache=cache,
+            logits_processor=logits_processor,
+            stopping_criteria=stopping_criteria,
+            owner=owner,
+        )
+        self.start()
+        self._queue.put(req)
+        return req.future
+
+    def start(self):
+        """
+        Start the decoding thread; `submit` does this on first use.
+        """
+        if self._worker is None:
+            self._worker = threading.Thread(target=self._loop, name="generation-scheduler", daemon=True)
+            self._worker.start()
+
+    def _enqueue(self, req: GenerationRequest):
+        self._pending.setdefault(req.owner, deque()).append(req)
+
+    def _collect(self) -> List[GenerationRequest]:
+        if not self._pending:
+            self._enqueue(self._queue.get())
+        waiting = sum(len(reqs) for reqs in self._pending.values())
+        deadline = time.monotonic() + self.batch_window
+        while waiting < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                self._enqueue(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+            waiting += 1
+        while True:
+            try:
+                self._enqueue(self._queue.get_nowait())
+            except queue.Empty:
+                break
+
+        batch = []
+        while self._pending and len(batch) < self.max_batch_size:
+            # one request from the owner whose turn it is, who then goes to the back
+            owner = next(iter(self._pending))
+            reqs = self._pending.pop(owner)
+            batch.append(reqs.popleft())
+            if reqs:
+                self._pending[owner] = reqs
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._collect()
+            self.batches += 1
+            self.batched_requests += len(batch)
+            try:
+                with torch.inference_mode():
+                    self._run(batch)
+            except BaseException as e:
+                for req in batch:
+                    if not req.future.done():
+                        req.future.set_exception(e)
+
+    def _forward(self, **kwargs) -> torch.Tensor:
+        out = self.hf_model(use_cache=True, logits_to_keep=1, **kwargs)
+        return out.logits[:, -1, :]
+
+    def _prefill(self, req: GenerationRequest) -> Tuple[Any, torch.Tensor]:
+        cache = req.cache if req.cache is not None else _full_cache()
+        past = cache.get_seq_length()
+        ids = torch.tensor([req.input_ids[past:]], device=self.hf_model.device)
+        logits = self._forward(input_ids=ids, past_key_values=cache)
+        return cache, logits[0]
+
+    def _merge(self, caches: List[Any]) -> Tuple[Any, torch.Tensor]:
+        """
+        Left-pad per-request caches to a common length and stack them into
+        one batched cache, returning it with the matching attention mask.
+        """
+        states = [layer_states(c) for c in caches]
+        lengths = [s[0][0].shape[-2] for s in states]
+        longest = max(lengths)
+        merged = _full_cache()
+        for layer_idx in range(len(states[0])):
+            keys, values = [], []
+            for row, n in zip(states, lengths):
+                k, v = row[layer_idx]
+                pad = longest - n
+                if pad:
+                    k = torch.nn.functional.pad(k, (0, 0, pad, 0))
+                    v = torch.nn.functional.pad(v, (0, 0, pad, 0))
+                keys.append(k)
+                values.append(v)
+            merged.update(torch.cat(keys), torch.cat(values), layer_idx)
+        mask = torch.zeros(len(caches), longest, dtype=torch.long, device=self.hf_model.device)
+        for row, n in enumerate(lengths):
+            mask[row, longest - n:] = 1
+        return merged, mask
+
+    def _pick(self, req: GenerationRequest, scores: torch.Tensor) -> bool:
+        """
+        Choose the next token for `req`; returns True once it is finished.
+        """
+        scores = scores[None].float()
+        ids = torch.tensor([req.input_ids + req.generated], device=scores.device)
+        if req.logits_processor is not None:
+            scores = req.logits_processor(ids, scores)
+        token = int(scores[0].argmax())
+        req.generated.append(token)
+        if token in req.eos_ids or len(req.generated) >= req.max_new_tokens:
+            return True
+        if req.stopping_criteria is not None:
+            ids = torch.cat([ids, ids.new_tensor([[token]])], dim=-1)
+            return bool(req.stopping_criteria(ids, scores)[0])
+        return False
+
+    def _run(self, batch: List[GenerationRequest]):
+        prefilled = [self._prefill(req) for req in batch]
+        cache, mask = self._merge([c for c, _ in prefilled])
+        logits = torch.stack([l for _, l in prefilled])
+        positions = mask.sum(-1)
+        active = list(batch)
+
+        while active:
+            keep = []
+            for row, req in enumerate(active):
+                if self._pick(req, logits[row]):
+                    req.future.set_result(req.generated)
+                else:
+                    keep.append(row)
+            if not keep:
+                break
+            if len(keep) < len(active):
+                index = torch.tensor(keep, device=mask.device)
+                cache.batch_select_indices(index)
+                mask, positions = mask[index], positions[index]
+                active = [active[i] for i in keep]
+
+            tokens = torch.tensor([[req.generated[-1]] for req in active], device=mask.device)
+            mask = torch.cat([mask, mask.new_ones(len(active), 1)], dim=-1)
+            logits = self._forward(
+                input_ids=tokens,
+                attention_mask=mask,
+                position_ids=positions[:, None],
+                past_key_values=cache,
+            )
+            positions = positions + 1
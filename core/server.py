@@ -0,0 +1,290 @@
+import asyncio
+import getpass
+import io
+import json
+import os
+import queue
+import re
+import socket
+import sys
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Optional
+
+from rich.console import Console
+
+from core.executor import run_editor
+
+console = Console()
+
+# the learner's terminal for the current thread, when it serves a session
+_route = threading.local()
+
+
+@dataclass
+class Channel:
+    """
+    A connected learner's terminal, as seen from their session thread.
+    Output is sent to the client as it is written; `readline` and `edit`
+    ask the client for a line of input or an editor round trip and block
+    until it answers (or disconnects).
+    """
+    loop: asyncio.AbstractEventLoop
+    writer: asyncio.StreamWriter
+    tty: bool = False
+    replies: "queue.Queue[Optional[str]]" = field(default_factory=queue.Queue)
+    closed: bool = False
+
+    def send(self, **message: Any):
+        if self.closed:
+            return
+        data = (json.dumps(message) + "\n").encode()
+        self.loop.call_soon_threadsafe(self._write, data)
+
+    def _write(self, data: bytes):
+        if not self.writer.is_closing():
+            self.writer.write(data)
+
+    def write(self, text: str) -> int:
+        if text:
+            self.send(out=text)
+        return len(text)
+
+    def readline(self) -> str:
+        self.send(read=True)
+        line = self.replies.get()
+        # an empty read is EOF, which ends the session
+        return "" if line is None else line + "\n"
+
+    def edit(self, path: str):
+        self.send(edit=os.path.abspath(path))
+        self.replies.get()
+
+    def close(self):
+        self.closed = True
+        self.replies.put(None)
+
+
+def current_channel() -> Optional[Channel]:
+    return getattr(_route, "channel", None)
+
+
+class _Routed(io.TextIOBase):
+    """
+    Stand-in for sys.stdout / sys.stdin that goes to the current thread's
+    learner, or to the server's own stream on every other thread. Rich
+    consoles look up sys.stdout on each write, so every module-level
+    console follows it.
+    """
+
+    def __init__(self, default):
+        self._default = default
+
+    def write(self, text: str) -> int:
+        channel = current_channel()
+        return channel.write(text) if channel is not None else self._default.write(text)
+
+    def readline(self, size: int = -1) -> str:
+        channel = current_channel()
+        return channel.readline() if channel is not None else self._default.readline(size)
+
+    def flush(self):
+        if current_channel() is None:
+            self._default.flush()
+
+    def isatty(self) -> bool:
+        channel = current_channel()
+        return channel.tty if channel is not None else self._default.isatty()
+
+    def fileno(self) -> int:
+        # input() only bypasses sys.stdin/sys.stdout for streams without one
+        if current_channel() is not None:
+            raise io.UnsupportedOperation("fileno")
+        return self._default.fileno()
+
+    @property
+    def encoding(self) -> str:
+        return "utf-8"
+
+
+def install_routing():
+    """
+    Route sys.stdout and sys.stdin per thread. Threads started from a
+    session thread (history summaries, prefetch, rich's refresh threads)
+    write to the same learner; threads shared between sessions must be
+    started before serving.
+    """
+    if isinstance(sys.stdout, _Routed):
+        return
+    sys.stdout = _Routed(sys.stdout)
+    sys.stdin = _Routed(sys.stdin)
+
+    start = threading.Thread.start
+
+    def routed_start(thread: threading.Thread):
+        channel = current_channel()
+        if channel is not None:
+            run = thread.run
+
+            def run_routed():
+                _route.channel = channel
+                run()
+
+            thread.run = run_routed
+        return start(thread)
+
+    threading.Thread.start = routed_start
+
+
+def learner_name(name: Any) -> str:
+    """
+    `name` made safe to use as a directory name.
+    """
+    return re.sub(r"[^\w.-]", "_", str(name or ""))[:64].strip("._") or "learner"
+
+
+@dataclass
+class TutorServer:
+    """
+    Serves tutoring sessions to many learners from one resident model.
+
+    Clients (`main.py --connect`) connect over a unix socket; each gets its
+    own SessionAgent from `make_session(learner, workdir, edit)` running on
+    its own thread, with files under `learners_dir/<learner>`. Admission
+    allows one session per learner and at most `max_learners` at a time;
+    fairness between them is the shared scheduler's round-robin.
+    """
+    path: str
+    make_session: Callable[[str, str, Callable[[str], None]], Any]
+    learners_dir: str = "learners"
+    max_learners: int = 30
+
+    _active: Dict[str, Channel] = field(default_factory=dict, init=False, repr=False)
+
+    def serve_forever(self):
+        install_routing()
+        try:
+            asyncio.run(self._serve())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+    async def _serve(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        server = await asyncio.start_unix_server(self._handle, path=self.path)
+        console.log(f"Serving up to {self.max_learners} learners on [bold]{self.path}[/]")
+        async with server:
+            await server.serve_forever()
+
+    def _admit(self, learner: str) -> Optional[str]:
+        """
+        Why `learner` cannot start a session now, or None if they can.
+        """
+        if learner in self._active:
+            return f"{learner} already has a session running."
+        if len(self._active) >= self.max_learners:
+            return f"The tutor is full ({self.max_learners} learners); please try again later."
+        return None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        loop = asyncio.get_running_loop()
+        try:
+            hello = json.loads(await reader.readline() or b"{}")
+        except ValueError:
+            hello = {}
+        learner = learner_name(hello.get("learner"))
+        channel = Channel(loop, writer, tty=bool(hello.get("tty")))
+
+        refused = self._admit(learner)
+        if refused is not None:
+            console.log(f"Refused {learner}: {refused}")
+            writer.write((json.dumps({"bye": refused}) + "\n").encode())
+            await writer.drain()
+            writer.close()
+            return
+
+        self._active[learner] = channel
+        console.log(f"{learner} connected ({len(self._active)}/{self.max_learners})")
+        finished = loop.create_future()
+        threading.Thread(
+            target=self._run_session, args=(learner, channel, loop, finished),
+            name=f"session-{learner}", daemon=True,
+        ).start()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    channel.replies.put(json.loads(line).get("line", ""))
+                except ValueError:
+                    continue
+        finally:
+            channel.close()
+            await finished
+            del self._active[learner]
+            writer.close()
+            console.log(f"{learner} disconnected ({len(self._active)}/{self.max_learners})")
+
+    def _run_session(self, learner: str, channel: Channel, loop: asyncio.AbstractEventLoop,
+                     finished: "asyncio.Future"):
+        _route.channel = channel
+        try:
+            workdir = os.path.join(self.learners_dir, learner)
+            os.makedirs(workdir, exist_ok=True)
+            session = self.make_session(learner, workdir, channel.edit)
+            session.run()
+            channel.send(bye="")
+        except EOFError:
+            pass
+        except Exception:
+            console.print_exception()
+            channel.send(bye="The session ended with an error.")
+        finally:
+            loop.call_soon_threadsafe(finished.set_result, None)
+
+
+def run_client(path: str, learner: Optional[str] = None):
+    """
+    Thin terminal client for a TutorServer: prints what the session writes,
+    answers its input requests from stdin and opens files in $EDITOR.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except OSError as e:
+        console.print(f"[bold red]Cannot connect to the tutor at {path}: {e}[/]")
+        return
+    rfile = sock.makefile("r", encoding="utf-8")
+    wfile = sock.makefile("w", encoding="utf-8")
+
+    def send(**message: Any):
+        wfile.write(json.dumps(message) + "\n")
+        wfile.flush()
+
+    send(learner=learner or getpass.getuser(), tty=sys.stdout.isatty())
+    try:
+        for line in rfile:
+            message = json.loads(line)
+            if "out" in message:
+                sys.stdout.write(message["out"])
+                sys.stdout.flush()
+            elif "read" in message:
+                text = sys.stdin.readline()
+                if not text:
+                    break
+                send(line=text.rstrip("\n"))
+            elif "edit" in message:
+                run_editor(message["edit"])
+                send(line="")
+            elif "bye" in message:
+                if message["bye"]:
+                    console.print(f"[bold yellow]{message['bye']}[/]")
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sock.close()
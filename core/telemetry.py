@@ -0,0 +1,185 @@
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, Iterator, List, Optional
+
+from rich.console import Console
+from rich.table import Table
+
+console = Console()
+
+
+@dataclass
+class Span:
+    """
+    One timed operation: an agent call, a model call, a history lookup, an
+    executor action or a shell command. `start` is seconds since the
+    Telemetry started; `args` holds what was measured (token counts, ...).
+    """
+    name: str
+    cat: str
+    start: float
+    duration: float = 0.0
+    thread: str = ""
+    agent: Optional[str] = None
+    turn: Optional[int] = None
+    args: Dict[str, Any] = field(default_factory=dict)
+
+
+class Telemetry:
+    """
+    Per-call metrics for the tutor itself. Code wraps its work in `span()`
+    and adds measurements with `annotate()`; `scope()` tags everything a
+    thread does meanwhile with the agent and turn it belongs to. Finished
+    spans are appended to a JSONL file as they close and can be written as
+    a Chrome/Perfetto trace. Does nothing until enabled with `configure`.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.spans: List[Span] = []
+        self._start = time.perf_counter()
+        self._jsonl = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def configure(self, jsonl_path: Optional[str] = None):
+        """
+        Start recording, appending finished spans to `jsonl_path` if given.
+        """
+        with self._lock:
+            if jsonl_path is not None and self._jsonl is None:
+                self._jsonl = open(jsonl_path, "a", buffering=1)
+            self.enabled = True
+
+    def _context(self) -> Dict[str, Any]:
+        if not hasattr(self._local, "context"):
+            self._local.context = {}
+            self._local.stack = []
+        return self._local.context
+
+    @contextmanager
+    def scope(self, **context: Any) -> Iterator[None]:
+        """
+        Tag spans opened on this thread inside the block, e.g. agent="CoderAgent" or turn=3.
+        """
+        if not self.enabled:
+            yield
+            return
+        current = self._context()
+        saved = dict(current)
+        current.update(context)
+        try:
+            yield
+        finally:
+            current.clear()
+            current.update(saved)
+
+    @contextmanager
+    def span(self, name: str, cat: str, **args: Any) -> Iterator[Dict[str, Any]]:
+        """
+        Time the block as a span. Yields its args, which the block (or code
+        it calls, through `annotate`) may fill in.
+        """
+        if not self.enabled:
+            yield args
+            return
+        context = self._context()
+        span = Span(
+            name=name, cat=cat,
+            start=time.perf_counter() - self._start,
+            thread=threading.current_thread().name,
+            agent=context.get("agent"),
+            turn=context.get("turn"),
+            args=args,
+        )
+        self._local.stack.append(span)
+        try:
+            yield span.args
+        finally:
+            self._local.stack.pop()
+            span.duration = time.perf_counter() - self._start - span.start
+            self._finish(span)
+
+    def annotate(self, **args: Any):
+        """
+        Add measurements to the innermost open span on this thread.
+        """
+        if not self.enabled:
+            return
+        self._context()
+        if self._local.stack:
+            self._local.stack[-1].args.update(args)
+
+    def _finish(self, span: Span):
+        with self._lock:
+            self.spans.append(span)
+            if self._jsonl is not None:
+                self._jsonl.write(json.dumps(asdict(span), default=str) + "\n")
+
+    def write_trace(self, path: str):
+        """
+        Write the spans as a Chrome trace (open in Perfetto or chrome://tracing).
+        """
+        with self._lock:
+            spans = list(self.spans)
+        pid = os.getpid()
+        threads: Dict[str, int] = {}
+        events = []
+        for span in spans:
+            tid = threads.setdefault(span.thread, len(threads) + 1)
+            args = dict(span.args, agent=span.agent, turn=span.turn)
+            events.append({
+                "name": span.name, "cat": span.cat, "ph": "X",
+                "ts": round(span.start * 1e6), "dur": round(span.duration * 1e6),
+                "pid": pid, "tid": tid,
+                "args": {k: v for k, v in args.items() if v is not None},
+            })
+        for thread, tid in threads.items():
+            events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": thread}})
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f, default=str)
+
+    def report(self):
+        """
+        Totals per agent: model calls and tokens, prefill time, decode rate,
+        JSON retries and time spent in shell commands.
+        """
+        with self._lock:
+            spans = list(self.spans)
+        if not spans:
+            return
+        rows: Dict[str, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+        for span in spans:
+            row, a = rows[span.agent or "-"], span.args
+            if span.cat == "llm":
+                row["calls"] += 1
+                row["prompt"] += a.get("prompt_tokens", 0)
+                row["generated"] += a.get("generated_tokens", 0)
+                row["prefill"] += a.get("prefill", 0.0)
+                row["decode_tokens"] += a.get("decode_tokens", 0)
+                row["decode_seconds"] += a.get("decode_seconds", 0.0)
+            elif span.cat == "agent":
+                row["retries"] += a.get("retries", 0)
+            elif span.cat == "shell":
+                row["shell"] += span.duration
+
+        table = Table(title="Telemetry")
+        for col in ("Agent", "Model calls", "Prompt tokens", "Generated tokens",
+                    "Prefill (s)", "Decode tok/s", "JSON retries", "Shell (s)"):
+            table.add_column(col, justify="left" if col == "Agent" else "right")
+        for agent, row in sorted(rows.items()):
+            rate = row["decode_tokens"] / row["decode_seconds"] if row["decode_seconds"] else 0.0
+            table.add_row(
+                agent, f"{row['calls']:.0f}", f"{row['prompt']:.0f}", f"{row['generated']:.0f}",
+                f"{row['prefill']:.2f}", f"{rate:.1f}" if rate else "-",
+                f"{row['retries']:.0f}", f"{row['shell']:.2f}",
+            )
+        console.print(table)
+
+
+telemetry = Telemetry()
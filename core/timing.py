@@ -0,0 +1,37 @@
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict
+
+from rich.console import Console
+from rich.table import Table
+
+console = Console()
+
+
+@dataclass
+class StartupTimer:
+    """
+    Seconds from process start-up (this module's import, which main.py does
+    first) to named milestones. Only the first occurrence of each is kept.
+    """
+    start: float = field(default_factory=time.perf_counter)
+    marks: Dict[str, float] = field(default_factory=dict)
+    _lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False)
+
+    def mark(self, name: str):
+        with self._lock:
+            self.marks.setdefault(name, time.perf_counter() - self.start)
+
+    def report(self):
+        if not self.marks:
+            return
+        table = Table(title="Startup timing")
+        table.add_column("Milestone")
+        table.add_column("Seconds", justify="right")
+        for name, t in sorted(self.marks.items(), key=lambda kv: kv[1]):
+            table.add_row(name, f"{t:.2f}")
+        console.print(table)
+
+
+startup = StartupTimer()
@@ -1,29 +1,324 @@
+import json
+import os
 import re
+import signal
 import subprocess
+import tempfile
+import threading
+import time
+from contextlib import nullcontext
+from dataclasses import dataclass
+from typing import Optional, Sequence
 
 from rich.console import Console
+from rich.text import Text
+
+from core.resource_profile import ResourceProfile, perf_command, perf_usable, read_perf_counters, wait_with_usage
 
 console = Console()
 
 
 def strip_markdown_fences(text: str) -> str:
     m = re.search(r"```(?:json)?\s*([\s\S]*?)\s*```", text)
+    if m:
+        return m.group(1).strip()
+    # the closing fence is missing when generation stopped at the object's end
+    m = re.match(r"\s*```(?:json)?\s*([\s\S]*)$", text)
     if m:
         return m.group(1).strip()
     return text.strip()
 
 
-def run_shell(cmd: str) -> str:
-    with console.status(f"⏳ [bold blue]Running shell command:[/] {cmd}", spinner="dots"):
+def redact_payload(text: str, fields: Sequence[str]) -> str:
+    """
+    A JSON action reply with the values of the given payload `fields`
+    replaced by a placeholder, for echoing replies that carry something the
+    learner must not see. A reply that does not parse is hidden entirely.
+    """
+    if not fields:
+        return text
+    try:
+        data = json.loads(strip_markdown_fences(text))
+    except json.JSONDecodeError:
+        return "(reply hidden)"
+    payload = data.get("payload") if isinstance(data, dict) else None
+    if isinstance(payload, dict):
+        for name in fields:
+            if name in payload:
+                payload[name] = "(hidden)"
+    return json.dumps(data, indent=2)
+
+
+_JSON_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+
+def partial_json_string(text: str, key: str) -> str:
+    """
+    Return the (possibly unfinished) string value of `key` in a JSON document
+    that is still being generated, or "" if the value has not started yet.
+    """
+    m = re.search(r'"%s"\s*:\s*"' % re.escape(key), text)
+    if not m:
+        return ""
+    out = []
+    i = m.end()
+    while i < len(text):
+        c = text[i]
+        if c == '"':
+            break
+        if c != "\\":
+            out.append(c)
+            i += 1
+            continue
+        if i + 1 >= len(text):
+            break
+        esc = text[i + 1]
+        if esc == "u":
+            code = text[i + 2:i + 6]
+            if len(code) < 4:
+                break
+            try:
+                out.append(chr(int(code, 16)))
+            except ValueError:
+                pass
+            i += 6
+        else:
+            out.append(_JSON_ESCAPES.get(esc, esc))
+            i += 2
+    return "".join(out)
+
+
+@dataclass
+class JSONObjectScanner:
+    """
+    Tracks brace depth outside of strings to tell when the first top-level
+    JSON object in a stream of text has closed. Anything before the opening
+    brace (e.g. a markdown fence) is ignored.
+    """
+    depth: int = 0
+    started: bool = False
+    in_string: bool = False
+    escape: bool = False
+    closed: bool = False
+
+    def feed(self, text: str) -> bool:
+        for ch in text:
+            if self.closed:
+                break
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == "\\":
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+            elif ch == '"':
+                self.in_string = self.started
+            elif ch in "{[":
+                self.started = True
+                self.depth += 1
+            elif ch in "}]" and self.started:
+                self.depth -= 1
+                self.closed = self.depth == 0
+        return self.closed
+
+
+def trim_after_json_object(text: str) -> str:
+    """
+    Drop anything after the first top-level JSON object in `text`, e.g.
+    tokens a draft model got accepted in the same step the object closed.
+    """
+    scanner = JSONObjectScanner()
+    for i, ch in enumerate(text):
+        if scanner.feed(ch):
+            return text[:i + 1]
+    return text
+
+
+@dataclass
+class ShellLimits:
+    """
+    Bounds for one shell command. CPU time and memory are set with `ulimit`
+    inside the shell, so they apply to everything it starts; the memory
+    limit is on the data segment (heap), which leaves CUDA's large virtual
+    address reservations alone. Output beyond `max_output_bytes` per stream
+    keeps only its head and tail.
+    """
+    timeout: float = 60.0
+    cpu_seconds: Optional[int] = 30
+    memory_mb: Optional[int] = 2048
+    max_output_bytes: int = 8192
+
+
+@dataclass
+class ShellResult:
+    stdout: str
+    stderr: str
+    exit_code: Optional[int]
+    duration: float
+    truncated: bool = False
+    timed_out: bool = False
+    profile: Optional[ResourceProfile] = None
+
+    def summary(self) -> str:
+        """
+        The result as the reviewer reads it.
+        """
+        if self.timed_out:
+            status = f"killed after the {self.duration:.0f}s time limit"
+        elif self.exit_code is not None and self.exit_code < 0:
+            status = f"killed by signal {-self.exit_code} after {self.duration:.1f}s"
+        else:
+            status = f"exit code {self.exit_code} after {self.duration:.1f}s"
+        parts = [status]
+        if self.profile is not None:
+            parts.append(self.profile.summary())
+        if self.stdout:
+            parts.append("--- stdout ---\n" + self.stdout.rstrip("\n"))
+        if self.stderr:
+            parts.append("--- stderr ---\n" + self.stderr.rstrip("\n"))
+        return "\n".join(parts)
+
+
+class _Capture:
+    """
+    Output of one pipe: the first and last `limit / 2` bytes and a count of
+    the rest. With `echo`, the first `limit` bytes also go to the console.
+    """
+
+    def __init__(self, limit: int, style: str, echo: bool = True):
+        self.half = limit // 2
+        self.echo_limit = limit if echo else 0
+        self.style = style
+        self.head = bytearray()
+        self.tail = bytearray()
+        self.total = 0
+        self._line = b""
+
+    def feed(self, chunk: bytes):
+        if self.total < self.echo_limit:
+            self._echo(chunk[:self.echo_limit - self.total])
+            if self.total + len(chunk) >= self.echo_limit:
+                self._echo(b"", final=True)
+        # noted once, with the first byte past the limit
+        if self.echo_limit and self.total <= self.echo_limit < self.total + len(chunk):
+            console.print("[dim]… output truncated …[/]")
+        self.total += len(chunk)
+        room = self.half - len(self.head)
+        if room > 0:
+            self.head += chunk[:room]
+            chunk = chunk[room:]
+        self.tail += chunk
+        if len(self.tail) > self.half:
+            del self.tail[:-self.half]
+
+    def _echo(self, chunk: bytes, final: bool = False):
+        *lines, self._line = (self._line + chunk).split(b"\n")
+        if final and self._line:
+            lines.append(self._line)
+            self._line = b""
+        for line in lines:
+            console.print(Text(line.decode("utf-8", errors="replace"), style=self.style))
+
+    @property
+    def truncated(self) -> bool:
+        return self.total > len(self.head) + len(self.tail)
+
+    def text(self) -> str:
+        if self.total < self.echo_limit:
+            self._echo(b"", final=True)
+        head = self.head.decode("utf-8", errors="replace")
+        if not self.truncated:
+            return head + self.tail.decode("utf-8", errors="replace")
+        omitted = self.total - len(self.head) - len(self.tail)
+        tail = self.tail.decode("utf-8", errors="replace")
+        return f"{head}\n… [{omitted} of {self.total} bytes omitted] …\n{tail}"
+
+
+def _pump(pipe, capture: _Capture):
+    for chunk in iter(lambda: pipe.read1(4096), b""):
+        capture.feed(chunk)
+    pipe.close()
+
+
+def run_shell(cmd: str, cwd: Optional[str] = None, limits: Optional[ShellLimits] = None,
+              quiet: bool = False, profile: bool = False) -> ShellResult:
+    """
+    Run `cmd` in a shell within `limits`, echoing its output as it arrives
+    unless `quiet` (which also makes it safe to call from several threads).
+    The whole process group is killed when the wall-clock timeout expires.
+    With `profile`, the result carries the command's ResourceProfile.
+    """
+    limits = limits or ShellLimits()
+    script = cmd
+    if limits.memory_mb:
+        script = f"ulimit -d {limits.memory_mb * 1024} 2>/dev/null\n{script}"
+    if limits.cpu_seconds:
+        script = f"ulimit -t {limits.cpu_seconds} 2>/dev/null\n{script}"
+    perf_out = None
+    if profile and perf_usable():
+        fd, perf_out = tempfile.mkstemp(suffix=".perf")
+        os.close(fd)
+        script = perf_command(script, perf_out)
+
+    out = _Capture(limits.max_output_bytes, style="", echo=not quiet)
+    err = _Capture(limits.max_output_bytes, style="red", echo=not quiet)
+    start = time.perf_counter()
+    status = nullcontext() if quiet else console.status(f"⏳ [bold blue]Running shell command:[/] {cmd}", spinner="dots")
+    with status:
         proc = subprocess.Popen(
-            cmd, shell=True,
+            ["/bin/sh", "-c", script], cwd=cwd,
+            stdin=subprocess.DEVNULL,
             stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT
+            stderr=subprocess.PIPE,
+            start_new_session=True,
         )
-        out, _ = proc.communicate()
-    text = out.decode("utf-8", errors="ignore")
-    console.print(f"🔹 [bold blue]Shell output:[/]\n{text}")
-    return text
+        pumps = [threading.Thread(target=_pump, args=(pipe, capture), daemon=True)
+                 for pipe, capture in ((proc.stdout, out), (proc.stderr, err))]
+        for t in pumps:
+            t.start()
+        expired = threading.Event()
+
+        def kill():
+            expired.set()
+            try:
+                os.killpg(proc.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+
+        timer = threading.Timer(limits.timeout, kill)
+        timer.daemon = True
+        timer.start()
+        try:
+            # wait4 rather than wait, for the rusage of the command and its children
+            proc.returncode, usage = wait_with_usage(proc.pid)
+        finally:
+            timer.cancel()
+        duration = time.perf_counter() - start
+        for t in pumps:
+            # a background child that kept the pipes open is not waited for
+            t.join(timeout=1.0)
+
+    timed_out = expired.is_set()
+    resources = None
+    if profile:
+        resources = ResourceProfile.from_rusage(duration, usage)
+        if perf_out is not None:
+            resources.counters = read_perf_counters(perf_out)
+            os.remove(perf_out)
+    result = ShellResult(
+        stdout=out.text(),
+        stderr=err.text(),
+        exit_code=None if timed_out else proc.returncode,
+        duration=duration,
+        truncated=out.truncated or err.truncated,
+        timed_out=timed_out,
+        profile=resources,
+    )
+    if not quiet:
+        console.print(f"🔹 [bold blue]Shell command finished:[/] {result.summary().splitlines()[0]}"
+                      + (" (output truncated)" if result.truncated else ""))
+    return result
 
 
 def save_to_file(text: str, filename: str):
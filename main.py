@@ -1,17 +1,28 @@
 import argparse
-import torch
-from transformers import Gemma3ForConditionalGeneration, AutoProcessor, AutoTokenizer
+import os
 from rich.console import Console
 from rich.traceback import install
 
-from core.model import LLMClient, load_hf_model_and_processor
-from core.history_manager import HistoryManager
-from core.executor import Executor
-from agents.session_agent import SessionAgent
+# torch and transformers are imported on the loader thread (see load_models),
+# so --help and the topic menu do not wait for them
+from core.timing import startup
+from core.telemetry import telemetry
+from core.loader import Deferred, load_in_background
+from core.kv_cache import PrefixCache
+from core.kv_snapshot import KVSnapshotStore
+from core.response_cache import ResponseCache
+from core.history_manager import HistoryManager, start_summary_worker
+from core.executor import Executor, press_enter, run_editor
+from core.compile_cache import CompileCache
+from core.server import TutorServer, run_client
+from agents.session_agent import SessionAgent, DEFAULT_TOPICS, choose_topic
 from agents.explainer_agent import ExplainerAgent
 from agents.quizzer_agent import QuizzerAgent
 from agents.coder_agent import CoderAgent
 from agents.reviewer_agent import ReviewerAgent
+from agents.prefetch import PrefetchEngine
+from agents.lesson_script import build_lesson_pack
+from core.lesson_pack import LessonPack
 from prompts.session_system_prompt import SESSION_SYSTEM_PROMPT
 from prompts.explainer_prompt import EXPLAINER_PROMPT
 from prompts.quizzer_prompt import QUIZZER_PROMPT
@@ -38,11 +49,347 @@ def parse_args():
         default="27b",
         help="Select the model size to use for the session."
     )
+    p.add_argument(
+        "--quantize",
+        choices=["int8", "int4"],
+        help="Load weight-only quantized weights for CPU inference (int4 needs torchao)."
+    )
+    p.add_argument(
+        "--offline",
+        action="store_true",
+        help="Load the model from the local Hugging Face cache without contacting the hub."
+    )
+    p.add_argument(
+        "--assisted",
+        action="store_true",
+        help="Use gemma-3-1b-it as a draft model for assisted generation with the main model."
+    )
+    p.add_argument(
+        "--draft-model-id",
+        help="Hugging Face model ID of the draft model for assisted generation (implies --assisted)."
+    )
+    p.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Keep each agent's KV cache between turns and only prefill new history."
+    )
+    p.add_argument(
+        "--constrained-json",
+        action="store_true",
+        help="Constrain decoding so every reply is a valid JSON action envelope."
+    )
+    p.add_argument(
+        "--batch",
+        action="store_true",
+        help="Batch concurrent generation requests from all agents on the shared model."
+    )
+    p.add_argument(
+        "--prefetch",
+        action="store_true",
+        help="Speculatively generate the likely next sub-agent output while the learner reads."
+    )
+    p.add_argument(
+        "--kv-snapshots",
+        metavar="DIR",
+        help="Save the prefilled system-prompt KV caches under DIR and load them at startup."
+    )
+    p.add_argument(
+        "--response-cache",
+        metavar="DIR",
+        help="Cache replies on disk under DIR and reuse them for identical requests."
+    )
+    p.add_argument(
+        "--response-cache-mb",
+        type=int,
+        default=256,
+        help="Size limit of the response cache in megabytes."
+    )
+    p.add_argument(
+        "--compile-cache",
+        metavar="DIR",
+        help="Cache the reviewer's compiler invocations under DIR, keyed by sources, flags and compiler."
+    )
+    p.add_argument(
+        "--compile-cache-mb",
+        type=int,
+        default=512,
+        help="Size limit of the compilation cache in megabytes."
+    )
+    p.add_argument(
+        "--no-stream",
+        action="store_true",
+        help="Wait for complete responses instead of rendering them as they are generated."
+    )
+    p.add_argument(
+        "--serve",
+        metavar="SOCKET",
+        help="Keep the model resident and serve many learners' sessions on the unix socket SOCKET."
+    )
+    p.add_argument(
+        "--connect",
+        metavar="SOCKET",
+        help="Join a tutor started with --serve instead of loading a model."
+    )
+    p.add_argument(
+        "--learner",
+        help="Name to connect as (defaults to your user name)."
+    )
+    p.add_argument(
+        "--max-learners",
+        type=int,
+        default=30,
+        help="Number of concurrent sessions a --serve tutor admits."
+    )
+    p.add_argument(
+        "--learners-dir",
+        default="learners",
+        help="Directory holding each learner's working directory in --serve mode."
+    )
+    p.add_argument(
+        "--build-pack",
+        metavar="FILE",
+        help="Pre-generate lessons for the default topics into FILE and exit."
+    )
+    p.add_argument(
+        "--topics-file",
+        metavar="FILE",
+        help="Build the lesson pack for the topics in FILE (one per line) instead."
+    )
+    p.add_argument(
+        "--pack-workers",
+        type=int,
+        default=8,
+        help="Concurrent generation jobs while building a lesson pack."
+    )
+    p.add_argument(
+        "--lesson-pack",
+        metavar="FILE",
+        help="Serve scripted lesson steps from a pre-built lesson pack."
+    )
+    p.add_argument(
+        "--server-url",
+        metavar="URL",
+        help="Generate with an OpenAI-compatible inference server (e.g. llama.cpp or vLLM at "
+             "http://127.0.0.1:8080/v1) instead of loading the model in-process."
+    )
+    p.add_argument(
+        "--server-model",
+        help="Model name to request from --server-url (defaults to --model-id)."
+    )
+    p.add_argument(
+        "--server-connections",
+        type=int,
+        default=8,
+        help="Keep-alive connections (and so concurrent requests) to --server-url."
+    )
+    p.add_argument(
+        "--torch-compile",
+        action="store_true",
+        help="Decode with a static KV cache and a torch.compile'd forward (compiled at startup)."
+    )
+    p.add_argument(
+        "--context-tokens",
+        type=int,
+        default=4096,
+        help="Prompt tokens the --torch-compile caches hold; longer prompts decode eagerly."
+    )
+    p.add_argument(
+        "--telemetry",
+        metavar="FILE",
+        help="Append per-call metrics (tokens, prefill and decode time, retries, shell time) to FILE as JSONL."
+    )
+    p.add_argument(
+        "--trace",
+        metavar="FILE",
+        help="Write the session's model, agent and shell calls to FILE as a Chrome/Perfetto trace at exit."
+    )
     return p.parse_args()
 
 
+# reply budget per agent role
+MAX_NEW_TOKENS = {
+    "session": 2048,
+    "explainer": 1024,
+    "quizzer": 1024,
+    # the skeleton and its complete solution
+    "coder": 4096,
+    "summarizer": 1024,
+    "reviewer": 1024,
+}
+
+
+def build_session(args, hf_model, processor, prefix_cache=None, scheduler=None,
+                  response_cache=None, lesson_pack=None, assistant_model=None,
+                  owner=None, workdir=None, edit=run_editor, compile_cache=None,
+                  make_llm=None, confirm=press_enter, compiled=None) -> SessionAgent:
+    """
+    Wire up the LLM clients, histories and agents for one tutoring session.
+    `owner`, `workdir` and `edit` separate learners sharing one model.
+    `make_llm(role, **client_kwargs)` replaces LLMClient, e.g. with a client
+    replaying recorded replies (see scripts/replay_session.py).
+    """
+    if make_llm is None:
+        from core.model import LLMClient
+
+        make_llm = lambda role, **kwargs: LLMClient(**kwargs)
+
+    def llm(role, system_prompt, max_new_tokens, stop_at_json_end=True, hidden_fields=()):
+        return make_llm(
+            role,
+            hf_model=hf_model,
+            processor=processor,
+            system_prompt=system_prompt,
+            max_new_tokens=max_new_tokens,
+            prefix_cache=prefix_cache,
+            incremental=args.incremental,
+            constrained_json=args.constrained_json,
+            scheduler=scheduler,
+            response_cache=response_cache,
+            assistant_model=assistant_model,
+            owner=owner,
+            stop_at_json_end=stop_at_json_end,
+            compiled=compiled,
+            hidden_fields=hidden_fields,
+        )
+
+    session_llm = llm("session", SESSION_SYSTEM_PROMPT, MAX_NEW_TOKENS["session"])
+    explainer_llm = llm("explainer", EXPLAINER_PROMPT, MAX_NEW_TOKENS["explainer"])
+    quizzer_llm = llm("quizzer", QUIZZER_PROMPT, MAX_NEW_TOKENS["quizzer"])
+    # the reference solution must not reach the learner's console
+    coder_llm = llm("coder", CODER_PROMPT, MAX_NEW_TOKENS["coder"], hidden_fields=("solution",))
+    summarizer_llm = llm("summarizer", SUMMARIZER_PROMPT, MAX_NEW_TOKENS["summarizer"],
+                         stop_at_json_end=False)
+    reviewer_llm = llm("reviewer", REVIEWER_PROMPT, MAX_NEW_TOKENS["reviewer"])
+
+    session_history = HistoryManager(summarizer=summarizer_llm)
+    explainer_history = HistoryManager(summarizer=summarizer_llm)
+    quizzer_history = HistoryManager(summarizer=summarizer_llm)
+    coder_history = HistoryManager(summarizer=summarizer_llm)
+    reviewer_history = HistoryManager(summarizer=summarizer_llm)
+
+    explainer = ExplainerAgent(model=explainer_llm, history=explainer_history)
+    quizzer = QuizzerAgent(model=quizzer_llm, history=quizzer_history)
+    coder = CoderAgent(model=coder_llm, history=coder_history)
+    reviewer = ReviewerAgent(model=reviewer_llm, history=reviewer_history)
+
+    executor = Executor(stream=not args.no_stream, workdir=workdir, edit=edit, confirm=confirm,
+                        compile_cache=compile_cache)
+
+    session = SessionAgent(
+        model=session_llm,
+        history=session_history,
+        executor=executor,
+        explainer=explainer,
+        quizzer=quizzer,
+        coder=coder,
+        reviewer=reviewer,
+        prefetch=PrefetchEngine(quizzer=quizzer) if args.prefetch else None,
+        lesson_pack=lesson_pack,
+    )
+    return session
+
+
+def load_models(args, draft_id=None):
+    """
+    Import torch and transformers and load the model (and draft model).
+    Runs on the loader thread while the topic menu is up.
+    """
+    from transformers.utils import logging as hf_logging
+
+    # progress bars would draw over the menu prompt
+    hf_logging.disable_progress_bar()
+    from core.model import load_hf_model_and_processor, load_draft_model
+    startup.mark("torch and transformers imported")
+
+    hf_model, processor = load_hf_model_and_processor(
+        args.model_id, quantize=args.quantize, local_files_only=args.offline, verbose=False,
+    )
+    draft_model = None
+    if draft_id is not None:
+        draft_model = load_draft_model(
+            draft_id, quantize=args.quantize, local_files_only=args.offline, verbose=False,
+        )
+    startup.mark("model loaded")
+    return hf_model, processor, draft_model
+
+
+SYSTEM_PROMPTS = [
+    SESSION_SYSTEM_PROMPT,
+    EXPLAINER_PROMPT,
+    QUIZZER_PROMPT,
+    CODER_PROMPT,
+    REVIEWER_PROMPT,
+    SUMMARIZER_PROMPT,
+]
+
+
+def warm_prefixes(loading, prefix_cache: PrefixCache):
+    """
+    Load (or prefill and save) every agent's system-prompt cache as soon as
+    the model is ready, while the learner is still in the topic menu.
+    """
+    hf_model, processor, _ = loading.result()
+    from core.model import LLMClient
+
+    for prompt in SYSTEM_PROMPTS:
+        LLMClient(
+            hf_model=hf_model, processor=processor, system_prompt=prompt,
+            max_new_tokens=1, prefix_cache=prefix_cache,
+        ).warm_prefix()
+    startup.mark("system prompts prefilled")
+
+
+def warm_compiled(loading, compiled):
+    """
+    Compile the decode step for every agent's cache size as soon as the
+    model is ready, while the learner is still in the topic menu.
+    """
+    loading.result()
+    compiled.warm(list(MAX_NEW_TOKENS.values()))
+    startup.mark("decoding compiled")
+
+
+def server_llm_factory(args, pool):
+    """
+    make_llm for build_session that sends every agent's requests to the
+    OpenAI-compatible server behind `pool`.
+    """
+    from core.http_backend import OpenAIClient
+
+    model = args.server_model or args.model_id
+
+    def make_llm(role, **kwargs):
+        return OpenAIClient(
+            pool=pool,
+            model=model,
+            system_prompt=kwargs["system_prompt"],
+            max_new_tokens=kwargs["max_new_tokens"],
+            constrained_json=kwargs["constrained_json"],
+            stop_at_json_end=kwargs["stop_at_json_end"],
+            response_cache=kwargs["response_cache"],
+            owner=kwargs["owner"],
+            hidden_fields=kwargs["hidden_fields"],
+        )
+
+    return make_llm
+
+
+def report_telemetry(args):
+    if telemetry.enabled:
+        telemetry.report()
+    if args.trace:
+        telemetry.write_trace(args.trace)
+        console.log(f"Trace written to {args.trace} (open it in https://ui.perfetto.dev)")
+
+
 def main():
     args = parse_args()
+    startup.mark("arguments parsed")
+    if args.telemetry or args.trace:
+        telemetry.configure(jsonl_path=args.telemetry)
+    if args.connect:
+        run_client(args.connect, learner=args.learner)
+        return
 
     #model_id = f"google/gemma-3-{args.model_size}-it"
     #console.print(f"[bold green]Using model:[/bold green] {model_id}")
@@ -61,75 +408,155 @@ def main():
 
     if args.model_size and args.model_id == "google/gemma-3-27b-it":
         args.model_id = f"google/gemma-3-{args.model_size}-it"
+    if args.offline:
+        # must be set before huggingface_hub is imported
+        os.environ["HF_HUB_OFFLINE"] = "1"
 
-    hf_model, processor = load_hf_model_and_processor(args.model_id)
+    pool = make_llm = None
+    if args.server_url:
+        from core.http_backend import ConnectionPool
 
-    session_llm = LLMClient(
-        hf_model=hf_model,
-        processor=processor,
-        system_prompt=SESSION_SYSTEM_PROMPT,
-        max_new_tokens=2048
-    )
+        pool = ConnectionPool(args.server_url, size=args.server_connections)
+        make_llm = server_llm_factory(args, pool)
+        console.print(f"[bold green]Generating with:[/bold green] {args.server_url}")
+        if args.assisted or args.draft_model_id or args.quantize or args.kv_snapshots or args.torch_compile:
+            console.print("[yellow]--assisted, --draft-model-id, --quantize, --kv-snapshots and --torch-compile "
+                          "apply to the in-process model and are ignored with --server-url.[/]")
+        hf_model = processor = draft_model = prefix_cache = None
+        args.torch_compile = False
+    else:
+        if args.torch_compile and (args.batch or args.build_pack or args.serve):
+            # the scheduler batches with dynamic caches
+            console.print("[yellow]--torch-compile is ignored with --batch, --build-pack and --serve.[/]")
+            args.torch_compile = False
+        if args.torch_compile and (args.incremental or args.assisted or args.draft_model_id):
+            # both keep their own dynamic caches
+            console.print("[yellow]--torch-compile disables --incremental and assisted generation.[/]")
+            args.incremental = args.assisted = False
+            args.draft_model_id = None
 
-    explainer_llm = LLMClient(
-        hf_model=hf_model,
-        processor=processor,
-        system_prompt=EXPLAINER_PROMPT,
-        max_new_tokens=1024
-    )
+        draft_id = None
+        if args.assisted or args.draft_model_id:
+            draft_id = args.draft_model_id or "google/gemma-3-1b-it"
+            if draft_id == args.model_id:
+                console.print("[yellow]The draft model is the main model; assisted generation disabled.[/]")
+                draft_id = None
 
-    quizzer_llm = LLMClient(
-        hf_model=hf_model,
-        processor=processor,
-        system_prompt=QUIZZER_PROMPT,
-        max_new_tokens=1024
-    )
+        console.print(f"[bold green]Loading model:[/bold green] {args.model_id}"
+                      + (f" (draft: {draft_id})" if draft_id else "") + " in the background")
+        loading = load_in_background(load_models, args, draft_id)
+        hf_model, processor = Deferred(loading, 0), Deferred(loading, 1)
+        draft_model = Deferred(loading, 2) if draft_id else None
 
-    coder_llm = LLMClient(
-        hf_model=hf_model,
-        processor=processor,
-        system_prompt=CODER_PROMPT,
-        max_new_tokens=2048
-    )
+        snapshots = KVSnapshotStore(args.kv_snapshots) if args.kv_snapshots else None
+        prefix_cache = PrefixCache(hf_model, snapshots=snapshots)
+        if snapshots is not None:
+            load_in_background(warm_prefixes, loading, prefix_cache)
 
-    summarizer_llm = LLMClient(
-        hf_model=hf_model,
-        processor=processor,
-        system_prompt=SUMMARIZER_PROMPT,
-        max_new_tokens=1024
-    )
+    compiled = None
+    if args.torch_compile:
+        from core.compiled_decode import CompiledDecoder
 
-    reviewer_llm = LLMClient(
-        hf_model=hf_model,
-        processor=processor,
-        system_prompt=REVIEWER_PROMPT,
-        max_new_tokens=1024
-    )
+        compiled = CompiledDecoder(hf_model, context_tokens=args.context_tokens)
+        load_in_background(warm_compiled, loading, compiled)
 
-    session_history = HistoryManager(summarizer=summarizer_llm)
-    explainer_history = HistoryManager(summarizer=summarizer_llm)
-    quizzer_history = HistoryManager(summarizer=summarizer_llm)
-    coder_history = HistoryManager(summarizer=summarizer_llm)
-    reviewer_history = HistoryManager(summarizer=summarizer_llm)
+    if args.serve:
+        # streamed, incremental and assisted calls bypass the shared
+        # scheduler, and with it the fair ordering between learners
+        args.no_stream, args.incremental = True, False
+        if draft_model is not None:
+            console.print("[yellow]Assisted generation is not used in --serve mode.[/]")
+            draft_model = None
 
-    explainer = ExplainerAgent(model=explainer_llm, history=explainer_history)
-    quizzer = QuizzerAgent(model=quizzer_llm, history=quizzer_history)
-    coder = CoderAgent(model=coder_llm, history=coder_history)
-    reviewer = ReviewerAgent(model=reviewer_llm, history=reviewer_history)
+    topic = None
+    if not (args.build_pack or args.serve):
+        topic = choose_topic(DEFAULT_TOPICS)
 
-    executor = Executor()
+    # building a pack is all concurrent generation, so it always batches
+    batch = args.batch or bool(args.build_pack) or bool(args.serve)
+    scheduler = None
+    # an inference server batches requests itself
+    if batch and pool is None:
+        from core.scheduler import GenerationScheduler
 
-    session = SessionAgent(
-        model=session_llm,
-        history=session_history,
-        executor=executor,
-        explainer=explainer,
-        quizzer=quizzer,
-        coder=coder,
-        reviewer=reviewer,
+        scheduler = GenerationScheduler(hf_model)
+    response_cache = None
+    if args.response_cache:
+        response_cache = ResponseCache(args.response_cache, max_bytes=args.response_cache_mb * 1024 * 1024)
+    compile_cache = None
+    if args.compile_cache:
+        compile_cache = CompileCache(args.compile_cache, max_bytes=args.compile_cache_mb * 1024 * 1024)
+    lesson_pack = None
+    if args.build_pack or args.lesson_pack:
+        try:
+            lesson_pack = LessonPack(args.build_pack or args.lesson_pack, model_id=args.model_id,
+                                     read_only=not args.build_pack)
+        except (OSError, ValueError) as e:
+            raise SystemExit(f"Cannot open the lesson pack: {e}")
+
+    if args.serve:
+        def make_session(learner, workdir, edit):
+            return build_session(
+                args, hf_model, processor,
+                prefix_cache=prefix_cache,
+                scheduler=scheduler,
+                response_cache=response_cache,
+                lesson_pack=lesson_pack,
+                owner=learner,
+                workdir=workdir,
+                edit=edit,
+                compile_cache=compile_cache,
+                make_llm=make_llm,
+            )
+
+        # shared worker threads are started here, so none is tied to a learner's session
+        if scheduler is not None:
+            scheduler.start()
+        start_summary_worker()
+        TutorServer(
+            args.serve, make_session,
+            learners_dir=args.learners_dir,
+            max_learners=args.max_learners,
+        ).serve_forever()
+        return
+
+    session = build_session(
+        args, hf_model, processor,
+        prefix_cache=prefix_cache,
+        scheduler=scheduler,
+        response_cache=response_cache,
+        lesson_pack=None if args.build_pack else lesson_pack,
+        assistant_model=draft_model,
+        compile_cache=compile_cache,
+        make_llm=make_llm,
+        compiled=compiled,
     )
 
-    session.run()
+    if args.build_pack:
+        topics = session.default_topics
+        if args.topics_file:
+            with open(args.topics_file) as f:
+                topics = [line.strip() for line in f if line.strip()]
+        build_lesson_pack(session, topics, lesson_pack, workers=args.pack_workers)
+        console.log(f"Lesson pack {args.build_pack}: {len(lesson_pack)} entries for {len(topics)} topics")
+        if scheduler is not None:
+            console.log(f"{scheduler.batched_requests} requests in {scheduler.batches} batches")
+        startup.report()
+        report_telemetry(args)
+        return
+
+    session.run(topic=topic)
+
+    if response_cache is not None:
+        console.log(response_cache.stats())
+    if compile_cache is not None:
+        console.log(compile_cache.stats())
+    if pool is not None:
+        console.log(pool.stats())
+    if compiled is not None and compiled.fallbacks:
+        console.log(f"{compiled.fallbacks} replies decoded eagerly (prompt over --context-tokens)")
+    startup.report()
+    report_telemetry(args)
 
 
 if __name__ == "__main__":
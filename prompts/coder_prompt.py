@@ -16,7 +16,8 @@ CODER_PROMPT = (
               "action": "GENERATE_CODE",
               "payload": {
                 "code": "<generated_code_string>",
-                "file_name": "<name_of_file_for_generated_code>"
+                "file_name": "<name_of_file_for_generated_code>",
+                "solution": "<the same code with every TODO implemented>"
               }
             }
 
@@ -26,6 +27,8 @@ CODER_PROMPT = (
         - Do **NOT** complete the TODO sections yourself; leave them for the learner to implement.
         - Make sure the code does not completely solve the problem, but provides a good starting point for the learner.
         - The file name should be descriptive of the code's purpose.
+        - The "solution" is never shown to the learner; it is compiled and run as the reference
+          their program's output is checked against, so it must be complete and deterministic.
         - Do not output any free-text, markdown, or other keys—only the JSON object defined above.
     """
 )
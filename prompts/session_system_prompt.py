@@ -105,7 +105,22 @@ SESSION_SYSTEM_PROMPT = (
             }
         - Use this action to clarify doubts, confirm understanding, or gather feedback on the current stage of the lesson.
 
-    7. **FINISH**
+    7. **BENCHMARK_CODE**
+        - After a successful review of OpenMP or MPI code, to measure how the learner's program scales.
+        - Runs the learner's program and the reference solution across thread and/or rank counts and
+          reports time, speedup and parallel efficiency for each.
+        - Payload:
+            {
+              "file_name": "<name_of_file_used_in_CALL_CODER>",
+              "threads": [1, 2, 4, 8],
+              "ranks": [1, 2, 4],
+              "repetitions": 3
+            }
+        - `threads` (OMP_NUM_THREADS values) and `ranks` (mpirun -np values) are optional; leave them out
+          to sweep powers of two up to the number of cores for whichever model the code uses.
+        - Use it when the learner asks about performance, or to show the effect of their parallelization.
+
+    8. **FINISH**
         - Terminate the session with a summary.
         - Payload:
             {
@@ -0,0 +1,126 @@
+"""
+Compare the default decode loop (dynamic KV cache, eager forward) with
+--torch-compile decoding (static KV cache, torch.compile'd forward) on the
+tutor's own prompts: one-off compile time, prefill time, decode tokens/s,
+and whether the compiled replies are identical to the eager ones.
+
+Both modes share one loaded model, so run it on an otherwise idle machine:
+
+    python -m scripts.bench_decode --model-id google/gemma-3-1b-it --runs 3
+    python -m scripts.bench_decode --dtype float32 --max-new-tokens 128 --context-tokens 2048
+"""
+import argparse
+import json
+import statistics
+import time
+
+from rich.console import Console
+from rich.table import Table
+
+from core.telemetry import telemetry
+from scripts.bench_quantize import CASES, _system_prompt
+
+console = Console()
+
+MODES = ("eager", "compiled")
+
+
+def run_mode(args, hf_model, processor, compiled) -> dict:
+    from core.model import LLMClient
+
+    result = {"mode": "compiled" if compiled is not None else "eager", "calls": []}
+    if compiled is not None:
+        start = time.perf_counter()
+        compiled.warm([args.max_new_tokens])
+        result["compile_s"] = time.perf_counter() - start
+
+    for agent, prompt, _ in CASES[:args.cases]:
+        client = LLMClient(
+            hf_model=hf_model,
+            processor=processor,
+            system_prompt=_system_prompt(agent),
+            max_new_tokens=args.max_new_tokens,
+            stop_at_json_end=True,
+            compiled=compiled,
+        )
+        for run in range(args.runs):
+            text = client.generate(prompt, quiet=True)
+            timing = client.last_timing
+            result["calls"].append({
+                "agent": agent,
+                "run": run,
+                "text": text,
+                "prefill_s": timing.get("prefill", 0.0),
+                "tokens": timing.get("generated_tokens", 0),
+                "decode_tok_s": timing.get("decode_tok_s", 0.0),
+            })
+    if compiled is not None:
+        result["fallbacks"] = compiled.fallbacks
+    return result
+
+
+def report(results: list):
+    baseline = next((r for r in results if r["mode"] == "eager"), None)
+    table = Table(title="Decode loop on CPU")
+    for col in ("Mode", "Compile (s)", "Prefill p50 (s)", "Decode tok/s p50", "Decode tok/s max",
+                "Same as eager", "Eager fallbacks"):
+        table.add_column(col)
+    for r in results:
+        calls = r["calls"]
+        rates = [c["decode_tok_s"] for c in calls if c["decode_tok_s"]]
+        same = "-"
+        if baseline is not None and r is not baseline:
+            matches = sum(a["text"] == b["text"] for a, b in zip(calls, baseline["calls"]))
+            same = f"{matches}/{len(calls)}"
+        table.add_row(
+            r["mode"],
+            f"{r['compile_s']:.1f}" if "compile_s" in r else "-",
+            f"{statistics.median(c['prefill_s'] for c in calls):.2f}" if calls else "-",
+            f"{statistics.median(rates):.2f}" if rates else "-",
+            f"{max(rates):.2f}" if rates else "-",
+            same,
+            str(r.get("fallbacks", "-")),
+        )
+    console.print(table)
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Benchmark eager vs. static-cache torch.compile decoding")
+    p.add_argument("--model-id", default="google/gemma-3-1b-it")
+    p.add_argument("--dtype", default="bfloat16", choices=["bfloat16", "float32"])
+    p.add_argument("--modes", nargs="+", default=list(MODES), choices=MODES)
+    p.add_argument("--runs", type=int, default=3, help="Generations per agent prompt and mode.")
+    p.add_argument("--max-new-tokens", type=int, default=256)
+    p.add_argument("--context-tokens", type=int, default=4096,
+                   help="Prompt tokens the static cache holds, as with --torch-compile.")
+    p.add_argument("--cases", type=int, default=len(CASES), help="Number of agent prompts to run.")
+    p.add_argument("--json", metavar="FILE", help="Also write the raw results to FILE.")
+    return p.parse_args()
+
+
+def main():
+    args = parse_args()
+    import torch
+
+    from core.compiled_decode import CompiledDecoder
+    from core.model import load_hf_model_and_processor
+
+    # for the prefill/decode split in LLMClient.last_timing
+    telemetry.configure()
+    hf_model, processor = load_hf_model_and_processor(
+        args.model_id, device_map="cpu", dtype=getattr(torch, args.dtype), verbose=False,
+    )
+
+    results = []
+    for mode in args.modes:
+        console.log(f"Benchmarking {mode} decoding ...")
+        compiled = CompiledDecoder(hf_model, context_tokens=args.context_tokens) if mode == "compiled" else None
+        results.append(run_mode(args, hf_model, processor, compiled))
+    report(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""
+Compare bf16 and weight-only quantized CPU inference on the tutor's own
+prompts: resident memory, load time, decode tokens/s, and how often the
+replies are still valid JSON actions (and identical to bf16).
+
+Each mode runs in a fresh subprocess so memory figures do not overlap:
+
+    python -m scripts.bench_quantize --model-id google/gemma-3-1b-it --modes bf16 int8 int4
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+from rich.console import Console
+from rich.table import Table
+
+console = Console()
+
+TOPIC = "OpenMP: Parallelizing Loops with Directives"
+CONCEPT = "Using #pragma omp parallel for to split loop iterations across threads"
+
+# (agent, user prompt, expected action) as the agents phrase them
+CASES = [
+    ("session", f"CURRENT STATE: INIT\nUSER INPUT: Initialize lesson plan for topic: {TOPIC}\n", "INITIALIZE"),
+    ("explainer", f"Explain the concept '{CONCEPT}' clearly, including examples if helpful. "
+                  "Return JSON: { 'action': 'EXPLAIN_CONCEPT', 'payload': "
+                  "{ 'explanation': <str>, 'examples': [ ... ] } }.", "EXPLAIN_CONCEPT"),
+    ("quizzer", f"Create a quiz question for the topic '{CONCEPT}'.", "GENERATE_QUIZ"),
+    ("coder", f"Generate code based on the following direction:\nWrite a short C program that "
+              f"demonstrates '{CONCEPT}' with one TODO for the learner.\n"
+              "Use the file name 'omp_for.c' for the generated code.", "GENERATE_CODE"),
+]
+
+
+def _system_prompt(agent: str) -> str:
+    from prompts.session_system_prompt import SESSION_SYSTEM_PROMPT
+    from prompts.explainer_prompt import EXPLAINER_PROMPT
+    from prompts.quizzer_prompt import QUIZZER_PROMPT
+    from prompts.coder_prompt import CODER_PROMPT
+
+    return {
+        "session": SESSION_SYSTEM_PROMPT,
+        "explainer": EXPLAINER_PROMPT,
+        "quizzer": QUIZZER_PROMPT,
+        "coder": CODER_PROMPT,
+    }[agent]
+
+
+def _rss_mb() -> float:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _valid_action(text: str, expected: str) -> bool:
+    from core.utilities import strip_markdown_fences
+
+    try:
+        data = json.loads(strip_markdown_fences(text))
+    except json.JSONDecodeError:
+        return False
+    return isinstance(data, dict) and data.get("action") == expected and "payload" in data
+
+
+def run_worker(args) -> dict:
+    from core.model import LLMClient, load_hf_model_and_processor
+
+    start = time.perf_counter()
+    hf_model, processor = load_hf_model_and_processor(
+        args.model_id,
+        device_map="cpu",
+        quantize=None if args.worker == "bf16" else args.worker,
+    )
+    load_time = time.perf_counter() - start
+    rss = _rss_mb()
+
+    replies = []
+    tokens, seconds = 0, 0.0
+    for agent, prompt, expected in CASES[:args.cases]:
+        client = LLMClient(
+            hf_model=hf_model,
+            processor=processor,
+            system_prompt=_system_prompt(agent),
+            max_new_tokens=args.max_new_tokens,
+            stop_at_json_end=True,
+        )
+        text = client.generate(prompt, quiet=True)
+        tokens += client.stats.tokens
+        seconds += client.stats.seconds
+        replies.append({"agent": agent, "text": text, "valid": _valid_action(text, expected)})
+
+    return {
+        "mode": args.worker,
+        "load_s": load_time,
+        "rss_mb": rss,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "tok_s": tokens / seconds if seconds else 0.0,
+        "replies": replies,
+    }
+
+
+def run_mode(args, mode: str) -> dict:
+    cmd = [
+        sys.executable, "-m", "scripts.bench_quantize",
+        "--worker", mode,
+        "--model-id", args.model_id,
+        "--max-new-tokens", str(args.max_new_tokens),
+        "--cases", str(args.cases),
+    ]
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    proc = subprocess.run(cmd, cwd=root, capture_output=True, text=True)
+    for line in reversed(proc.stdout.splitlines()):
+        if line.startswith("{"):
+            return json.loads(line)
+    return {"mode": mode, "error": (proc.stderr.strip().splitlines() or ["failed"])[-1]}
+
+
+def report(results: list):
+    baseline = next((r for r in results if r["mode"] == "bf16" and "error" not in r), None)
+    table = Table(title="Quantized CPU inference")
+    for col in ("Mode", "Load (s)", "RSS (MB)", "Peak RSS (MB)", "Decode tok/s", "Valid JSON", "Same as bf16"):
+        table.add_column(col)
+    for r in results:
+        if "error" in r:
+            table.add_row(r["mode"], f"[red]{r['error']}[/]", "", "", "", "", "")
+            continue
+        replies = r["replies"]
+        valid = sum(x["valid"] for x in replies)
+        same = "-"
+        if baseline is not None:
+            matches = sum(a["text"] == b["text"] for a, b in zip(replies, baseline["replies"]))
+            same = f"{matches}/{len(replies)}"
+        table.add_row(
+            r["mode"],
+            f"{r['load_s']:.1f}",
+            f"{r['rss_mb']:.0f}",
+            f"{r['peak_rss_mb']:.0f}",
+            f"{r['tok_s']:.2f}",
+            f"{valid}/{len(replies)}",
+            same,
+        )
+    console.print(table)
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Benchmark bf16 vs. quantized CPU inference")
+    p.add_argument("--model-id", default="google/gemma-3-1b-it")
+    p.add_argument("--modes", nargs="+", default=["bf16", "int8", "int4"],
+                   choices=["bf16", "int8", "int4"])
+    p.add_argument("--max-new-tokens", type=int, default=256)
+    p.add_argument("--cases", type=int, default=len(CASES), help="Number of agent prompts to run.")
+    p.add_argument("--json", metavar="FILE", help="Also write the raw results to FILE.")
+    p.add_argument("--worker", help=argparse.SUPPRESS)
+    return p.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.worker:
+        print(json.dumps(run_worker(args)))
+        return
+
+    results = []
+    for mode in args.modes:
+        console.log(f"Benchmarking {mode} ...")
+        results.append(run_mode(args, mode))
+    report(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
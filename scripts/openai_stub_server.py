@@ -0,0 +1,175 @@
+"""
+A stand-in for an OpenAI-compatible inference server (llama.cpp server,
+vLLM), for trying the --server-url backend without a model. It answers
+every chat completion with the same JSON action, word by word, optionally
+with simulated prefill and per-token delays, and counts connections and
+concurrent requests so connection pooling can be checked:
+
+    python -m scripts.openai_stub_server --port 8080 --token-delay 5
+    python main.py --server-url http://127.0.0.1:8080/v1
+"""
+import argparse
+import json
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from rich.console import Console
+
+console = Console()
+
+DEFAULT_REPLY = {
+    "thought": "Stand-in server reply.",
+    "action": "QUERY_USER",
+    "payload": {"question": "This is the stand-in inference server. What would you like to do next?"},
+}
+
+
+class StubStats:
+    def __init__(self):
+        self.connections = 0
+        self.requests = 0
+        self.active = 0
+        self.peak = 0
+        self.lock = threading.Lock()
+
+    def begin(self):
+        with self.lock:
+            self.requests += 1
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+
+    def end(self):
+        with self.lock:
+            self.active -= 1
+
+    def __str__(self) -> str:
+        return (f"{self.requests} requests over {self.connections} connections, "
+                f"at most {self.peak} at once")
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # clients drop connections mid-stream on purpose
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+def make_handler(reply: str, prefill_delay: float, token_delay: float, stats: StubStats):
+    # words and the whitespace before them, so the chunks add up to the reply
+    pieces = re.findall(r"\s*\S+", reply)
+
+    class Handler(BaseHTTPRequestHandler):
+        # keep-alive
+        protocol_version = "HTTP/1.1"
+
+        def setup(self):
+            super().setup()
+            with stats.lock:
+                stats.connections += 1
+
+        def log_message(self, fmt, *args):
+            pass
+
+        def _json(self, data, status=200):
+            body = json.dumps(data).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _chunk(self, data: str):
+            body = data.encode("utf-8")
+            self.wfile.write(f"{len(body):x}\r\n".encode() + body + b"\r\n")
+            self.wfile.flush()
+
+        def do_GET(self):
+            if self.path.rstrip("/").endswith("/models"):
+                self._json({"object": "list", "data": [{"id": "stub", "object": "model"}]})
+            else:
+                self._json({"error": "not found"}, 404)
+
+        def do_POST(self):
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if self.path == "/tokenize":
+                text = request.get("content") or request.get("prompt") or ""
+                self._json({"tokens": list(range(len(text.split())))})
+                return
+            if not self.path.endswith("/chat/completions"):
+                self._json({"error": "not found"}, 404)
+                return
+
+            stats.begin()
+            try:
+                prompt_tokens = sum(len(m.get("content", "").split()) for m in request.get("messages", []))
+                tokens = pieces[:request.get("max_tokens", len(pieces))]
+                time.sleep(prefill_delay)
+                if request.get("stream"):
+                    self._stream(request, tokens, prompt_tokens)
+                else:
+                    time.sleep(token_delay * len(tokens))
+                    self._json({
+                        "id": "stub", "object": "chat.completion", "model": request.get("model"),
+                        "choices": [{"index": 0, "finish_reason": "stop",
+                                     "message": {"role": "assistant", "content": "".join(tokens)}}],
+                        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(tokens)},
+                    })
+            finally:
+                stats.end()
+
+        def _stream(self, request, tokens, prompt_tokens):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            try:
+                for token in tokens:
+                    time.sleep(token_delay)
+                    event = {"object": "chat.completion.chunk",
+                             "choices": [{"index": 0, "delta": {"content": token}}]}
+                    self._chunk(f"data: {json.dumps(event)}\n\n")
+                if (request.get("stream_options") or {}).get("include_usage"):
+                    usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(tokens)}
+                    self._chunk(f"data: {json.dumps({'choices': [], 'usage': usage})}\n\n")
+                self._chunk("data: [DONE]\n\n")
+                self.wfile.write(b"0\r\n\r\n")
+            except (BrokenPipeError, ConnectionResetError):
+                # the client stopped reading, e.g. its JSON object was complete
+                self.close_connection = True
+
+    return Handler
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Stand-in OpenAI-compatible inference server")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8080)
+    p.add_argument("--reply", help="Reply text (a JSON action by default).")
+    p.add_argument("--prefill-delay", type=float, default=0.0, metavar="MS")
+    p.add_argument("--token-delay", type=float, default=0.0, metavar="MS")
+    return p.parse_args()
+
+
+def main():
+    args = parse_args()
+    stats = StubStats()
+    reply = args.reply or json.dumps(DEFAULT_REPLY)
+    handler = make_handler(reply, args.prefill_delay / 1000, args.token_delay / 1000, stats)
+    server = StubServer((args.host, args.port), handler)
+    console.print(f"[bold green]Stand-in inference server on http://{args.host}:{args.port}/v1[/]")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        console.log(str(stats))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+"""
+Replay a scripted tutoring session without a terminal and report per-turn
+and per-agent latency percentiles.
+
+A script is a JSON file with the topic and the learner's inputs, in order.
+A turn may also carry the edits the learner makes when a GENERATE_CODE
+action opens the editor ("content" replaces the file, "replace" swaps
+[old, new] pairs, "append" adds text):
+
+    {"topic": "OpenMP: Parallelizing Loops with Directives",
+     "turns": ["yes, let's start",
+               {"input": "give me an exercise",
+                "edits": [{"replace": [["// TODO", "#pragma omp parallel for"]]}]},
+               "review my code"]}
+
+Record the model's replies once, then replay them as often as needed with
+no model loaded, which measures the tutor's own overhead:
+
+    python -m scripts.replay_session script.json --record replies.json --model-id google/gemma-3-1b-it
+    python -m scripts.replay_session script.json --recording replies.json --repeat 50
+"""
+import argparse
+import contextlib
+import json
+import os
+import tempfile
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from rich.console import Console
+from rich.table import Table
+
+from core.replay import Recording, RecordingClient, ReplayClient, ReplayExhausted
+from core.telemetry import telemetry
+
+console = Console()
+
+PERCENTILES = (50, 90, 99)
+
+
+class ScriptEnded(Exception):
+    pass
+
+
+@dataclass
+class Turn:
+    input: str
+    edits: List[Dict[str, Any]] = field(default_factory=list)
+
+
+def load_script(path: str):
+    with open(path) as f:
+        data = json.load(f)
+    turns = [Turn(input=t) if isinstance(t, str) else Turn(input=t["input"], edits=t.get("edits", []))
+             for t in data["turns"]]
+    return data["topic"], turns
+
+
+def apply_edit(path: str, edit: Dict[str, Any]):
+    with open(path) as f:
+        text = f.read()
+    if "content" in edit:
+        text = edit["content"]
+    for old, new in edit.get("replace", []):
+        text = text.replace(old, new)
+    text += edit.get("append", "")
+    with open(path, "w") as f:
+        f.write(text)
+
+
+@dataclass
+class ScriptedLearner:
+    """
+    Feeds the script's inputs to SessionAgent.run and makes its edits when
+    the editor opens, timing each turn from one input to the next.
+    """
+    turns: List[Turn]
+    times: List[float] = field(default_factory=list)
+    _next: int = 0
+    _edits: List[Dict[str, Any]] = field(default_factory=list)
+    _start: float = field(default_factory=time.perf_counter)
+
+    def read_input(self) -> str:
+        now = time.perf_counter()
+        self.times.append(now - self._start)
+        if self._next >= len(self.turns):
+            raise ScriptEnded()
+        turn = self.turns[self._next]
+        self._next += 1
+        self._edits = list(turn.edits)
+        self._start = time.perf_counter()
+        return turn.input
+
+    def edit(self, path: str):
+        if self._edits:
+            apply_edit(path, self._edits.pop(0))
+
+    def finish(self):
+        """
+        Close the last turn when the session finished before the script did.
+        """
+        if len(self.times) == self._next:
+            self.times.append(time.perf_counter() - self._start)
+
+
+def percentile(values: List[float], q: float) -> float:
+    """
+    The q-th percentile of `values`, interpolating between neighbours.
+    """
+    ordered = sorted(values)
+    pos = (len(ordered) - 1) * q / 100
+    lo = int(pos)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (pos - lo)
+
+
+def _row(label: str, values: List[float]) -> List[str]:
+    cells = [label, str(len(values))]
+    cells += [f"{1000 * percentile(values, q):.1f}" for q in PERCENTILES]
+    return cells + [f"{1000 * max(values):.1f}"]
+
+
+def latency_table(title: str, first: str, rows: Dict[str, List[float]]) -> Table:
+    table = Table(title=title)
+    table.add_column(first)
+    for col in ["Runs"] + [f"p{q} (ms)" for q in PERCENTILES] + ["max (ms)"]:
+        table.add_column(col, justify="right")
+    for label, values in rows.items():
+        if values:
+            table.add_row(*_row(label, values))
+    return table
+
+
+def session_args(args) -> argparse.Namespace:
+    # the main.py options build_session reads
+    return argparse.Namespace(incremental=False, constrained_json=args.constrained_json,
+                              no_stream=True, prefetch=False)
+
+
+def run_once(args, topic: str, turns: List[Turn], make_llm, workdir: str) -> ScriptedLearner:
+    from main import build_session
+
+    learner = ScriptedLearner(turns)
+    session = build_session(
+        session_args(args), None, None,
+        workdir=workdir,
+        edit=learner.edit,
+        confirm=lambda: None,
+        make_llm=make_llm,
+    )
+    try:
+        session.run(topic=topic, read_input=learner.read_input)
+    except ScriptEnded:
+        pass
+    learner.finish()
+    return learner
+
+
+def recording_llm(args, recording: Recording):
+    from core.model import LLMClient, load_hf_model_and_processor
+
+    hf_model, processor = load_hf_model_and_processor(args.model_id, local_files_only=args.offline)
+
+    def make_llm(role, **kwargs):
+        kwargs.update(hf_model=hf_model, processor=processor)
+        return RecordingClient(LLMClient(**kwargs), role, recording)
+
+    return make_llm
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Replay a scripted session and report latency percentiles")
+    p.add_argument("script", help="JSON file with the topic and the learner's inputs.")
+    mode = p.add_mutually_exclusive_group(required=True)
+    mode.add_argument("--recording", metavar="FILE", help="Replay the model replies recorded in FILE.")
+    mode.add_argument("--record", metavar="FILE", help="Run the real model and record its replies to FILE.")
+    p.add_argument("--model-id", default="google/gemma-3-1b-it", help="Model to record with.")
+    p.add_argument("--offline", action="store_true", help="Load the model from the local cache only.")
+    p.add_argument("--constrained-json", action="store_true")
+    p.add_argument("--repeat", type=int, default=1, help="Sessions to replay.")
+    p.add_argument("--latency", type=float, default=0.0, metavar="MS",
+                   help="Simulated model latency per replayed reply.")
+    p.add_argument("--workdir", help="Directory for generated files (a fresh temporary one per session by default).")
+    p.add_argument("--verbose", action="store_true", help="Show the session's console output.")
+    p.add_argument("--json", metavar="FILE", help="Also write the raw timings to FILE.")
+    return p.parse_args()
+
+
+def main():
+    args = parse_args()
+    topic, turns = load_script(args.script)
+    telemetry.configure()
+
+    recording = Recording()
+    if args.record:
+        make_llm, repeat = recording_llm(args, recording), 1
+    else:
+        replayed = Recording.load(args.recording)
+        repeat = args.repeat
+
+        def make_llm(role, **kwargs):
+            return ReplayClient(role, replayed, latency=args.latency / 1000,
+                                system_prompt=kwargs["system_prompt"], owner=kwargs.get("owner"))
+
+    runs: List[List[float]] = []
+    error: Optional[str] = None
+    output = open(os.devnull, "w") if not args.verbose else None
+    with contextlib.ExitStack() as stack:
+        if output is not None:
+            stack.enter_context(output)
+            stack.enter_context(contextlib.redirect_stdout(output))
+        for _ in range(repeat):
+            workdir = args.workdir or stack.enter_context(tempfile.TemporaryDirectory(prefix="replay-"))
+            try:
+                runs.append(run_once(args, topic, turns, make_llm, workdir).times)
+            except ReplayExhausted as e:
+                error = f"{e}; the script no longer matches the recording"
+                break
+
+    if args.record:
+        recording.save(args.record)
+        console.log(f"Recorded {sum(len(r) for r in recording.replies.values())} replies to {args.record}")
+    if error is not None:
+        console.print(f"[bold red]Replay stopped: {error}[/]")
+
+    labels = ["0: (lesson plan)"] + [f"{i + 1}: {t.input[:40]}" for i, t in enumerate(turns)]
+    per_turn = {label: [run[i] for run in runs if i < len(run)] for i, label in enumerate(labels)}
+    per_agent: Dict[str, List[float]] = defaultdict(list)
+    for span in telemetry.spans:
+        if span.cat == "agent":
+            per_agent[span.agent].append(span.duration)
+        elif span.cat in ("executor", "shell"):
+            per_agent[span.name if span.cat == "executor" else "shell"].append(span.duration)
+
+    console.print(latency_table("Turn latency", "Turn", per_turn))
+    console.print(latency_table("Agent and executor latency", "Call", dict(sorted(per_agent.items()))))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"turns": per_turn, "calls": per_agent, "error": error}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+import contextlib
+import io
+import os
+import tempfile
+
+import pytest
+
+from core.compile_cache import CompileCache, _local_headers, parse_compile
+from core.utilities import ShellResult, run_shell
+
+
+@pytest.fixture
+def workdir():
+    with tempfile.TemporaryDirectory() as path:
+        os.makedirs(os.path.join(path, "include", "lib"))
+        with open(os.path.join(path, "include", "lib", "vec.h"), "w") as f:
+            f.write('#include "detail.h"\nstatic int vec_len(void) { return 3; }\n')
+        with open(os.path.join(path, "include", "lib", "detail.h"), "w") as f:
+            f.write("#define DETAIL 1\n")
+        with open(os.path.join(path, "main.c"), "w") as f:
+            f.write("#include <stdio.h>\n#include <lib/vec.h>\n"
+                    "int main(void) { int unused; return vec_len() - 3; }\n")
+        yield path
+
+
+def test_angled_includes_found_in_include_dirs(workdir):
+    job = parse_compile("gcc -Iinclude -c main.c", workdir)
+    assert _local_headers(job, workdir) == ["include/lib/vec.h", "include/lib/detail.h"]
+
+
+def test_cache_hit_replays_diagnostics(workdir):
+    cache = CompileCache(os.path.join(workdir, ".cache"))
+    cmd = "gcc -Wall -Iinclude -c main.c"
+    if cache.key(cmd, parse_compile(cmd, workdir), workdir) is None:
+        pytest.skip("no gcc")
+
+    def compile_quietly():
+        return run_shell(cmd, cwd=workdir, quiet=True)
+
+    first = cache.run(cmd, workdir, compile_quietly)
+    assert "unused" in first.stderr
+
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        second = cache.run(cmd, workdir, lambda: ShellResult("", "", 1, 0.0))
+    assert cache.hits == 1 and second.stderr == first.stderr
+    assert "unused" in out.getvalue()
@@ -0,0 +1,104 @@
+import contextlib
+import io
+import json
+import tempfile
+
+import torch
+
+from core.model import LLMClient
+from core.response_cache import ResponseCache
+from core.utilities import redact_payload
+
+SOLUTION = "int main() { return SECRET_SOLUTION_42; }"
+REPLY = json.dumps({
+    "action": "GENERATE_CODE",
+    "payload": {"code": "int main() { /* TODO */ }", "file_name": "a.c", "solution": SOLUTION},
+})
+
+
+class ByteTokenizer:
+    eos_token_id = 1
+
+    def encode(self, text, add_special_tokens=False):
+        return list(text.encode("utf-8"))
+
+    def apply_chat_template(self, msgs, **kwargs):
+        text = "".join(m["content"] if isinstance(m["content"], str) else m["content"][0]["text"] for m in msgs)
+        ids = self.encode(text)
+        return {"input_ids": torch.tensor([ids]), "attention_mask": torch.ones(1, len(ids), dtype=torch.long)}
+
+    def decode(self, ids, skip_special_tokens=True):
+        ids = ids.tolist() if hasattr(ids, "tolist") else ids
+        return bytes(ids).decode("utf-8", errors="ignore")
+
+
+class CannedModel(torch.nn.Module):
+    """
+    Answers every prompt with REPLY, streaming it like `generate` does.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.config = type("Config", (), {"_name_or_path": "canned", "_commit_hash": None})()
+        self.generation_config = type("GenerationConfig", (), {"eos_token_id": 1})()
+        self.device = torch.device("cpu")
+
+    def generate(self, input_ids, max_new_tokens, streamer=None, **kwargs):
+        reply = torch.tensor([list(REPLY.encode("utf-8"))])
+        if streamer is not None:
+            streamer.put(input_ids[0])
+            for tid in reply[0]:
+                streamer.put(tid.reshape(1))
+            streamer.end()
+        return torch.cat([input_ids, reply], dim=-1)
+
+
+def _console_output(call) -> str:
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        result = call()
+    assert result == REPLY
+    return out.getvalue()
+
+
+def _coder(**kwargs) -> LLMClient:
+    return LLMClient(hf_model=CannedModel(), processor=ByteTokenizer(), system_prompt="coder",
+                     max_new_tokens=512, hidden_fields=("solution",), **kwargs)
+
+
+def test_solution_not_echoed():
+    output = _console_output(lambda: _coder().generate("write code"))
+    assert "SECRET_SOLUTION_42" not in output
+    assert "GENERATE_CODE" in output
+
+
+def test_solution_not_echoed_when_streamed():
+    chunks = []
+    output = _console_output(lambda: _coder().generate("write code", on_text=chunks.append))
+    assert chunks and "SECRET_SOLUTION_42" not in output
+
+
+def test_solution_not_echoed_from_response_cache():
+    with tempfile.TemporaryDirectory() as cache_dir:
+        coder = _coder(response_cache=ResponseCache(cache_dir))
+        _console_output(lambda: coder.generate("write code"))
+        output = _console_output(lambda: coder.generate("write code"))
+    assert "(cached)" in output and "SECRET_SOLUTION_42" not in output
+
+
+def test_server_client_hides_solution():
+    from core.http_backend import ConnectionPool, OpenAIClient
+
+    client = OpenAIClient(pool=ConnectionPool("http://127.0.0.1:9/v1"), model="m", system_prompt="coder",
+                          max_new_tokens=512, hidden_fields=("solution",))
+    client._complete = lambda payload: REPLY
+    output = _console_output(lambda: client.generate("write code"))
+    assert "SECRET_SOLUTION_42" not in output
+
+
+def test_redact_payload():
+    assert SOLUTION not in redact_payload(REPLY, ["solution"])
+    assert json.loads(redact_payload(REPLY, ["solution"]))["payload"]["file_name"] == "a.c"
+    assert redact_payload(REPLY, []) == REPLY
+    # a cut-off reply cannot be redacted field by field
+    assert SOLUTION[:10] not in redact_payload(REPLY[:-20], ["solution"])
@@ -0,0 +1,81 @@
+import threading
+
+import torch
+
+from core.history_manager import HistoryManager
+from core.scheduler import GenerationScheduler
+
+
+def tiny_model():
+    from transformers import Gemma3ForCausalLM, Gemma3TextConfig
+
+    torch.manual_seed(0)
+    config = Gemma3TextConfig(vocab_size=64, hidden_size=32, intermediate_size=64, num_hidden_layers=2,
+                              num_attention_heads=2, num_key_value_heads=1, head_dim=16, sliding_window=16,
+                              pad_token_id=0, eos_token_id=1, bos_token_id=2)
+    return Gemma3ForCausalLM(config).eval()
+
+
+class ScheduledSummarizer:
+    """
+    Summarizes by decoding a few tokens through the shared scheduler, like an
+    LLMClient with a scheduler set.
+    """
+    def __init__(self, scheduler, started):
+        self.scheduler = scheduler
+        self.started = started
+
+    def count_tokens(self, text):
+        return len(text.split())
+
+    def generate(self, text, quiet=False):
+        self.started.wait()
+        self.scheduler.submit([2, 5, 6, 7], max_new_tokens=4, eos_ids=[]).result()
+        return "summary"
+
+
+def test_concurrent_summaries_share_a_batch():
+    scheduler = GenerationScheduler(tiny_model(), batch_window=0.5)
+    started = threading.Event()
+    histories = [
+        HistoryManager(summarizer=ScheduledSummarizer(scheduler, started), token_limit=8,
+                       history=["one two three four five six seven"])
+        for _ in range(2)
+    ]
+    assert all(h.start_background_summary() for h in histories)
+    pending = [h._pending for h in histories]
+    started.set()
+    for h, future in zip(histories, pending):
+        future.result()
+        assert h.history == ["History summary: summary"]
+    assert scheduler.batches == 1
+    assert scheduler.batched_requests == 2
+
+
+class BlockingSummarizer:
+    def __init__(self):
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def count_tokens(self, text):
+        return len(text.split())
+
+    def generate(self, text, quiet=False):
+        self.started.set()
+        assert self.release.wait(5)
+        return "summary"
+
+
+def test_adds_do_not_wait_for_a_synchronous_summary():
+    summarizer = BlockingSummarizer()
+    history = HistoryManager(summarizer=summarizer, token_limit=4, history=["one two three four five"])
+    reader = threading.Thread(target=history.get_full)
+    reader.start()
+    assert summarizer.started.wait(5)
+    adder = threading.Thread(target=history.add, args=("late entry",))
+    adder.start()
+    adder.join(1)
+    assert not adder.is_alive()
+    summarizer.release.set()
+    reader.join(5)
+    assert history.history == ["History summary: summary", "late entry"]
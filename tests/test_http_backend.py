@@ -0,0 +1,99 @@
+import json
+import tempfile
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+import pytest
+
+from core.http_backend import ConnectionPool, OpenAIClient
+from core.response_cache import ResponseCache
+
+REPLY = '{"action": "FINISH", "payload": {}}'
+
+
+class FakeServer:
+    """
+    A minimal OpenAI-compatible server that counts the requests per path.
+    """
+
+    def __init__(self, served_id: str):
+        self.served_id = served_id
+        self.hits: Counter = Counter()
+        owner = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, data):
+                body = json.dumps(data).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                owner.hits[self.path] += 1
+                self._reply({"data": [{"id": owner.served_id}]})
+
+            def do_POST(self):
+                owner.hits[self.path] += 1
+                payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                if self.path == "/tokenize":
+                    # two characters per token
+                    self._reply({"tokens": list(range(len(payload["content"]) // 2))})
+                else:
+                    self._reply({"choices": [{"message": {"content": REPLY}}], "usage": {"completion_tokens": 9}})
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}/v1"
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def cache_dir():
+    with tempfile.TemporaryDirectory() as path:
+        yield path
+
+
+def _client(server: FakeServer, cache_dir: Optional[str] = None) -> OpenAIClient:
+    return OpenAIClient(pool=ConnectionPool(server.url), model="tutor", system_prompt="x" * 40,
+                        max_new_tokens=64, response_cache=ResponseCache(cache_dir) if cache_dir else None)
+
+
+def test_count_tokens_measures_once():
+    server = FakeServer("model-a.gguf")
+    try:
+        client = _client(server)
+        assert [client.count_tokens("y" * n) for n in (10, 100, 1000)] == [5, 50, 500]
+        assert server.hits["/tokenize"] == 1
+    finally:
+        server.close()
+
+
+def test_response_cache_follows_the_served_model(cache_dir):
+    first, moved, swapped = FakeServer("model-a.gguf"), FakeServer("model-a.gguf"), FakeServer("model-b.gguf")
+    try:
+        _client(first, cache_dir).generate("hi", quiet=True)
+        # same weights behind another URL: a cache hit
+        _client(moved, cache_dir).generate("hi", quiet=True)
+        assert moved.hits["/v1/chat/completions"] == 0
+        # other weights behind the same kind of URL: a miss
+        _client(swapped, cache_dir).generate("hi", quiet=True)
+        assert swapped.hits["/v1/chat/completions"] == 1
+        assert first.hits["/v1/models"] == 1
+    finally:
+        for server in (first, moved, swapped):
+            server.close()
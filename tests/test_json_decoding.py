@@ -0,0 +1,92 @@
+import json
+
+import pytest
+import torch
+
+from agents.base_agent import MAX_JSON_ATTEMPTS, BaseAgent, InvalidReply
+from core.history_manager import HistoryManager
+from core.json_decoding import EnvelopeGrammar, EnvelopeLogitsProcessor, TokenTexts
+
+ACTIONS = ["QUERY_USER", "FINISH"]
+
+
+@pytest.mark.parametrize("prefix", [
+    "",
+    "{",
+    '{"thou',
+    '{"thought": "still thinking \\u00',
+    '{"action": "QUE',
+    '{"action": "FINISH", "payload": {"n": 12345',
+    '{"action": "FINISH", "payload": {"xs": [1, [true, -',
+    '{"payload": {"a": {"b": "c\\',
+    '{"action": "FINISH", "payload": 1.5e',
+])
+def test_closing_completes_the_envelope(prefix):
+    grammar = EnvelopeGrammar(actions=ACTIONS)
+    assert grammar.feed(prefix)
+    closing = grammar.closing()
+    data = json.loads(prefix + closing)
+    assert data["action"] in ACTIONS and "payload" in data
+
+
+class CharTokenizer:
+    """
+    One token per printable ASCII character; id 0 is EOS, 1 is the anchor.
+    """
+    chars = [chr(c) for c in range(32, 127)]
+
+    def encode(self, text, add_special_tokens=False):
+        return [1]
+
+    def decode(self, ids, skip_special_tokens=True):
+        return "".join("a" if i == 1 else self.chars[i - 2] if i >= 2 else "" for i in ids)
+
+
+def _generate(prefer: str, max_new_tokens: int) -> str:
+    """
+    Greedy decoding under the envelope with a "model" that always ranks the
+    characters of `prefer` first, like one stuck emitting digits.
+    """
+    tok = CharTokenizer()
+    vocab = len(tok.chars) + 2
+    processor = EnvelopeLogitsProcessor(TokenTexts(tok), ACTIONS, prompt_len=1, eos_ids=[0],
+                                        max_new_tokens=max_new_tokens)
+    ids = [1]
+    for _ in range(max_new_tokens):
+        scores = torch.zeros(1, vocab)
+        for rank, ch in enumerate(prefer):
+            scores[0, tok.chars.index(ch) + 2] = 10.0 - rank / 10
+        token = int(processor(torch.tensor([ids]), scores)[0].argmax())
+        if token == 0:
+            break
+        ids.append(token)
+    return tok.decode(ids[1:])
+
+
+@pytest.mark.parametrize("prefer", [
+    '{"payload":{"n":1' + "1234567890",
+    '{"thought":"' + "abc",
+    '{"action":"FINISH","payload":[[[[' + "[0,",
+])
+def test_reply_closes_within_budget(prefer):
+    text = _generate(prefer, max_new_tokens=80)
+    data = json.loads(text)
+    assert data["action"] in ACTIONS and "payload" in data
+
+
+class GarbageModel:
+    incremental = False
+    last_interventions = 0
+    calls = 0
+
+    def generate(self, prompt, **kwargs):
+        self.calls += 1
+        return '{"action": "FINISH", "payload": {"n": 1234'
+
+
+def test_retries_are_bounded():
+    model = GarbageModel()
+    agent = BaseAgent(model=model, history=HistoryManager(summarizer=None))
+    with pytest.raises(InvalidReply):
+        agent._generate("hi")
+    assert model.calls == MAX_JSON_ATTEMPTS
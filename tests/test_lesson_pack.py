@@ -0,0 +1,40 @@
+import os
+import sqlite3
+import tempfile
+
+import pytest
+
+from core.lesson_pack import LessonPack
+
+
+@pytest.fixture
+def tmpdir():
+    with tempfile.TemporaryDirectory() as path:
+        yield path
+
+
+def test_missing_pack_is_not_created(tmpdir):
+    path = os.path.join(tmpdir, "typo.db")
+    with pytest.raises(FileNotFoundError):
+        LessonPack(path, read_only=True)
+    assert not os.path.exists(path)
+
+
+def test_read_only_pack_serves_but_is_not_written(tmpdir):
+    path = os.path.join(tmpdir, "pack.db")
+    built = LessonPack(path, model_id="m")
+    built.put(("topic", "objective", "call"), '{"action": "FINISH"}')
+    built.close()
+
+    pack = LessonPack(path, model_id="m", read_only=True)
+    assert pack.get("topic", "objective", "call") == '{"action": "FINISH"}'
+    with pytest.raises(sqlite3.OperationalError):
+        pack.put(("topic", "objective", "other"), "{}")
+
+
+def test_other_files_are_rejected(tmpdir):
+    path = os.path.join(tmpdir, "notes.txt")
+    with open(path, "w") as f:
+        f.write("not a database\n" * 100)
+    with pytest.raises(ValueError):
+        LessonPack(path, read_only=True)
@@ -0,0 +1,38 @@
+import contextlib
+import io
+
+import pytest
+
+from core.utilities import _Capture
+
+
+def _echoed(chunks, limit=8):
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        capture = _Capture(limit, style="")
+        for chunk in chunks:
+            capture.feed(chunk)
+        text = capture.text()
+    return out.getvalue(), text
+
+
+@pytest.mark.parametrize("chunks", [[b"1234567\n"], [b"1234", b"567\n"]])
+def test_output_of_exactly_the_limit_is_not_truncated(chunks):
+    echoed, text = _echoed(chunks)
+    assert "truncated" not in echoed
+    assert "1234567" in echoed and text == "1234567\n"
+
+
+@pytest.mark.parametrize("chunks", [[b"1234567\nX"], [b"1234567\n", b"X", b"YZ"]])
+def test_truncation_noted_once_past_the_limit(chunks):
+    echoed, _ = _echoed(chunks)
+    assert echoed.count("truncated") == 1
+    assert "X" not in echoed
+
+
+def test_quiet_capture_notes_nothing():
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        capture = _Capture(8, style="", echo=False)
+        capture.feed(b"0123456789" * 4)
+    assert out.getvalue() == ""